@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # Connect the rollup, partner location, catalog cache, search index, user cache and query metrics signal handlers
+        from . import rollups, geo, catalog_cache, search, authentication, metrics  # noqa: F401
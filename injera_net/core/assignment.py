@@ -0,0 +1,208 @@
+"""
+Delivery partner assignment.
+
+Partners are claimed atomically so concurrent `mark_paid` calls can never hand
+the same partner two orders: with `SELECT ... FOR UPDATE SKIP LOCKED` where
+the database supports it (PostgreSQL, MySQL 8), otherwise with a
+compare-and-set `UPDATE ... SET is_available = false WHERE is_available`
+whose row count tells us whether we won the partner.
+
+Strategies differ only in which candidates they try first; pick one with the
+DELIVERY_ASSIGNMENT_STRATEGY setting.
+"""
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection, transaction
+
+from . import rollups
+from .geo import locator
+from .models import User, Order, Delivery, Notification
+
+# How many extra candidates to read per requested partner. Concurrent workers
+# pick from a shuffled window, so they rarely race for the same row.
+CANDIDATE_WINDOW = 4
+# Give up after this many candidate windows lost to concurrent claimers
+MAX_CLAIM_ROUNDS = 10
+# Attempts at releasing partners whose deliveries could not be created, and
+# the delay before the first retry (doubling after each)
+RELEASE_ATTEMPTS = 4
+RELEASE_RETRY_DELAY = 0.05
+
+logger = logging.getLogger(__name__)
+
+
+class AssignmentEngine:
+    def available_partners(self):
+        return User.objects.filter(role='delivery_partner', is_available=True)
+
+    def candidates(self, count, orders=()):
+        """Ids of available partners to try, best first; strategies override this"""
+        ids = list(self.available_partners().order_by('id').values_list('id', flat=True)[:count * CANDIDATE_WINDOW])
+        random.shuffle(ids)
+        return ids
+
+    def claim(self, count, orders=()):
+        """Mark up to `count` available partners busy and return their ids"""
+        claimed = []
+        for _ in range(MAX_CLAIM_ROUNDS):
+            need = count - len(claimed)
+            candidates = self.candidates(need, orders) if need else []
+            if not candidates:
+                break
+            claimed += self.claim_from(candidates, need)
+        return claimed
+
+    def claim_from(self, candidates, need=None):
+        """Claim up to `need` (default: all) of the given partner ids, in order, and return the winners"""
+        need = len(candidates) if need is None else need
+        if connection.features.has_select_for_update_skip_locked:
+            return self._claim_locked(candidates, need)
+        return self._claim_compare_and_set(candidates, need)
+
+    def _claim_locked(self, candidates, need):
+        with transaction.atomic():
+            locked = set(
+                self.available_partners().filter(id__in=candidates)
+                .select_for_update(skip_locked=True).values_list('id', flat=True)
+            )
+            won = [partner_id for partner_id in candidates if partner_id in locked][:need]
+            User.objects.filter(id__in=won).update(is_available=False)
+        self.partners_unavailable(won)
+        return won
+
+    def _claim_compare_and_set(self, candidates, need):
+        won, lost = [], []
+        for partner_id in candidates:
+            if len(won) == need:
+                break
+            # Only one concurrent claimer sees rowcount 1
+            if User.objects.filter(id=partner_id, is_available=True).update(is_available=False):
+                won.append(partner_id)
+            else:
+                lost.append(partner_id)
+        self.partners_unavailable(won + lost)
+        return won
+
+    def release(self, partner_ids):
+        if partner_ids:
+            User.objects.filter(id__in=partner_ids).update(is_available=True)
+            self.partners_available(partner_ids)
+
+    def partners_unavailable(self, partner_ids):
+        """Hook: these partners were claimed (or found busy) through a queryset update"""
+
+    def partners_available(self, partner_ids):
+        """Hook: these partners were released through a queryset update"""
+
+    def assign(self, orders):
+        """
+        Give each order in `orders` its own available partner. Returns the
+        created deliveries; orders left over when partners run out, or that
+        another worker assigned first, are skipped.
+        """
+        orders = list(orders)
+        if not orders:
+            return []
+        partner_ids = self.claim(len(orders), orders)
+        return self.create_deliveries(list(zip(orders, partner_ids)))
+
+    def create_deliveries(self, pairs):
+        """Create deliveries for claimed (order, partner_id) pairs, releasing partners of orders assigned meanwhile"""
+        if not pairs:
+            return []
+        try:
+            return self._create_deliveries(pairs)
+        except Exception:
+            # The claims are committed already: don't leave partners busy without a delivery
+            self._release_unassigned(pairs)
+            raise
+
+    def _release_unassigned(self, pairs):
+        """Release the partners of `pairs` whose order got no delivery from them, retrying lock timeouts and the like"""
+        partner_ids = [partner_id for _, partner_id in pairs]
+        for attempt in range(RELEASE_ATTEMPTS):
+            try:
+                assigned = set(Delivery.objects.filter(
+                    order__in=[order for order, _ in pairs], delivery_partner_id__in=partner_ids,
+                ).values_list('delivery_partner_id', flat=True))
+                self.release([partner_id for partner_id in partner_ids if partner_id not in assigned])
+                return
+            except DatabaseError:
+                # A broken surrounding transaction can't be retried; its rollback undoes the claims as well
+                if connection.in_atomic_block or attempt == RELEASE_ATTEMPTS - 1:
+                    logger.exception("Could not release partners claimed for %d orders", len(pairs))
+                    return
+                time.sleep(RELEASE_RETRY_DELAY * 2 ** attempt)
+
+    def _create_deliveries(self, pairs):
+        try:
+            with transaction.atomic():
+                deliveries = Delivery.objects.bulk_create([
+                    Delivery(order=order, delivery_partner_id=partner_id, status='assigned')
+                    for order, partner_id in pairs
+                ])
+        except IntegrityError:
+            # Some order already has a delivery: fall back to one row at a time
+            deliveries = []
+            for order, partner_id in pairs:
+                try:
+                    with transaction.atomic():
+                        deliveries.append(Delivery.objects.create(
+                            order=order, delivery_partner_id=partner_id, status='assigned',
+                        ))
+                except IntegrityError:
+                    self.release([partner_id])
+        else:
+            rollups.record_created(deliveries)
+
+        for delivery in deliveries:
+            Notification.send(delivery.delivery_partner_id, f"New delivery assigned: Order #{delivery.order_id}")
+            Notification.send(delivery.order.customer_id, f"Delivery partner assigned to your order #{delivery.order_id}")
+        return deliveries
+
+    def assign_pending(self, limit=100):
+        """Assign partners to paid orders that don't have a delivery yet, oldest first"""
+        orders = Order.objects.filter(status='paid', delivery__isnull=True).order_by('created_at', 'id')[:limit]
+        return self.assign(orders)
+
+
+class NearestPartnerEngine(AssignmentEngine):
+    """Tries the partners closest to the maker of the order first"""
+
+    def candidates(self, count, orders=()):
+        pickup = self.pickup_location(orders)
+        nearest = locator.nearest(*pickup, k=count * CANDIDATE_WINDOW) if pickup else []
+        if not nearest:
+            # No located partner left: fall back to any available one
+            return super().candidates(count, orders)
+        return [partner_id for _, partner_id in nearest]
+
+    def pickup_location(self, orders):
+        # Batches are spread over many makers; only single orders have one pickup point
+        if len(orders) != 1:
+            return None
+        maker = orders[0].product.maker
+        if maker.latitude is None or maker.longitude is None:
+            return None
+        return maker.latitude, maker.longitude
+
+    def partners_unavailable(self, partner_ids):
+        locator.remove(partner_ids)
+
+    def partners_available(self, partner_ids):
+        # Positions aren't tracked for busy partners: reload on next lookup
+        locator.invalidate()
+
+
+ENGINES = {
+    'first_available': AssignmentEngine(),
+    'nearest': NearestPartnerEngine(),
+}
+
+
+def get_engine(strategy=None):
+    return ENGINES[strategy or getattr(settings, 'DELIVERY_ASSIGNMENT_STRATEGY', 'first_available')]
+
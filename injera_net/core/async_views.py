@@ -0,0 +1,231 @@
+"""
+Async (ASGI-native) implementations of the read-heavy GET endpoints.
+
+Under ASGI every synchronous DRF view runs in a worker thread for the whole
+request, waiting on the database. The handlers here run on the event loop
+and only leave it for the queries themselves (Django's async ORM), so a
+worker serves many more concurrent reads. They answer GET only: every other
+method of the same URL, and GET as well when ASYNC_READ_VIEWS is False, goes
+to the regular viewset action in a thread, exactly as before.
+
+Responses match the viewsets': the same serializers, query plans, cursor
+pagination, catalog cache/ETags, permissions and error bodies.
+"""
+import asyncio
+from datetime import timedelta
+from functools import wraps
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.http import Http404, HttpResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, permissions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from . import catalog_cache, metrics, rollups
+from .authentication import ClaimsJWTAuthentication
+from .models import Product, Order, Notification
+from .pagination import KeysetCursorPagination
+from .query_planning import plan_queryset
+from .serializers import ProductSerializer, OrderSerializer, NotificationSerializer, UserSerializer
+from .views import ProductViewSet, NotificationViewSet, DeliveryViewSet, AnalyticsViewSet, DATE_RANGE_ERROR, product_ordering
+
+User = get_user_model()
+
+
+def render(data, status=200, headers=None):
+    """JSON response rendered like DRF's JSONRenderer"""
+    with metrics.serialization():
+        body = b'' if data is None else JSONRenderer().render(data)
+    return HttpResponse(body, status=status, headers=headers, content_type='application/json')
+
+
+async def authenticate(request):
+    """The user of the request's Bearer token, resolved like ClaimsJWTAuthentication; anonymous without one"""
+    scheme, _, raw_token = request.headers.get('Authorization', '').partition(' ')
+    if scheme not in jwt_settings.AUTH_HEADER_TYPES or not raw_token:
+        return AnonymousUser()
+    authenticator = ClaimsJWTAuthentication()
+    return await authenticator.aget_user(await authenticator.aget_validated_token(raw_token.encode()))
+
+
+def _error(exc):
+    if isinstance(exc, Http404):
+        exc = exceptions.NotFound(*exc.args)
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    headers = None
+    # Authentication failures get 401 and the challenge, as from DRF with JWT authentication first
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        headers = {'WWW-Authenticate': ClaimsJWTAuthentication().authenticate_header(None)}
+    return render(data, exc.status_code, headers)
+
+
+def async_read(fallback, permission_class=permissions.IsAuthenticated):
+    """
+    Serve GET with the decorated coroutine (called with a DRF Request whose
+    user is set) and any other method with the sync DRF view `fallback`.
+    """
+    fallback = sync_to_async(fallback)
+
+    def decorator(handler):
+        @wraps(handler)
+        async def view(request, *args, **kwargs):
+            if request.method != 'GET' or not getattr(settings, 'ASYNC_READ_VIEWS', True):
+                return await fallback(request, *args, **kwargs)
+            try:
+                drf_request = Request(request, authenticators=())
+                drf_request.user = await authenticate(request)
+                if not permission_class().has_permission(drf_request, None):
+                    if not drf_request.user.is_authenticated:
+                        raise exceptions.NotAuthenticated()
+                    raise exceptions.PermissionDenied()
+                return await handler(drf_request, *args, **kwargs)
+            except (exceptions.APIException, Http404) as exc:
+                return _error(exc)
+        return csrf_exempt(view)
+    return decorator
+
+
+async def alist(queryset, chunk_size=100):
+    return [row async for row in queryset.aiterator(chunk_size=chunk_size)]
+
+
+async def paginated(request, queryset, serializer_class, ordering=None):
+    """The cursor-paginated list response body, like a viewset's list()"""
+    paginator = KeysetCursorPagination()
+    view = SimpleNamespace(cursor_ordering=ordering) if ordering else None
+    extra_columns = [field.lstrip('-') for field in paginator.get_ordering(request, queryset, view)]
+    queryset = plan_queryset(queryset, serializer_class, True, extra_columns)
+    page = await paginator.apaginate_queryset(queryset, request, view)
+    data = serializer_class(page, many=True, context={'request': request}).data
+    return paginator.get_paginated_response(data).data
+
+
+# Products
+
+@async_read(ProductViewSet.as_view({'get': 'list', 'post': 'create'}, basename='product', detail=False),
+            permissions.IsAuthenticatedOrReadOnly)
+async def product_list(request):
+    async def fetch():
+        return 200, await paginated(request, Product.objects.all(), ProductSerializer, product_ordering(request))
+    status, data, headers = await catalog_cache.acached(request, await catalog_cache.alist_tag(request), fetch)
+    return render(data, status, headers)
+
+
+@async_read(ProductViewSet.as_view(
+    {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'},
+    basename='product', detail=True,
+), permissions.IsAuthenticatedOrReadOnly)
+async def product_detail(request, pk):
+    async def fetch():
+        product = await plan_queryset(Product.objects.all(), ProductSerializer).filter(pk=pk).afirst()
+        if product is None:
+            return 404, {'detail': 'No Product matches the given query.'}
+        return 200, ProductSerializer(product, context={'request': request}).data
+    status, data, headers = await catalog_cache.acached(request, await catalog_cache.aproduct_tag(pk), fetch)
+    return render(data, status, headers)
+
+
+# Notifications
+
+@async_read(NotificationViewSet.as_view({'get': 'list', 'post': 'create'}, basename='notification', detail=False))
+async def notification_list(request):
+    return render(await paginated(request, Notification.objects.filter(user=request.user), NotificationSerializer))
+
+
+@async_read(NotificationViewSet.as_view({'get': 'unread'}, basename='notification', detail=False))
+async def notification_unread(request):
+    # Denormalized on the user row by Notification and core.notifications
+    unread_count = await User.objects.values_list('unread_notifications', flat=True).aget(pk=request.user.pk)
+    return render({'unread_count': unread_count})
+
+
+# Deliveries
+
+@async_read(DeliveryViewSet.as_view({'get': 'available_partners'}, basename='delivery', detail=False))
+async def available_partners(request):
+    if request.user.role not in ['admin', 'maker']:
+        return render({'error': 'Not authorized'}, 403)
+    partners = User.objects.filter(role='delivery_partner', is_available=True)
+    partners = plan_queryset(partners, UserSerializer, restrict_columns=True)
+    return render(UserSerializer(await alist(partners, chunk_size=2000), many=True).data)
+
+
+# Analytics: every endpoint is one rollup read, or independent reads run concurrently
+
+def _analytics_view(action):
+    return AnalyticsViewSet.as_view({'get': action}, basename='analytics', detail=False)
+
+
+@async_read(_analytics_view('dashboard_stats'))
+async def dashboard_stats(request):
+    if request.user.role != 'admin':
+        return render({'error': 'Admin access required'}, 403)
+    try:
+        since, until = rollups.parse_day_range(request.query_params.get('since'), request.query_params.get('until'))
+    except ValueError:
+        return render({'error': DATE_RANGE_ERROR}, 400)
+    platform = await rollups.atotals('platform', since=since, until=until)
+    return render({
+        'total_users': platform.users,
+        'total_orders': platform.orders,
+        'total_revenue': float(platform.paid_revenue),
+        'pending_orders': platform.pending_orders
+    })
+
+
+@async_read(_analytics_view('maker_analytics'))
+async def maker_analytics(request):
+    if request.user.role != 'maker':
+        return render({'error': 'Maker access required'}, 403)
+    try:
+        since, until = rollups.parse_day_range(request.query_params.get('since'), request.query_params.get('until'))
+    except ValueError:
+        return render({'error': DATE_RANGE_ERROR}, 400)
+    maker, top_products = await rollups.amaker_summary(request.user.id, since, until)
+    return render({
+        'total_sales': maker.delivered_orders,
+        'total_earnings': float(maker.delivered_revenue),
+        'top_products': top_products
+    })
+
+
+@async_read(_analytics_view('customer_analytics'))
+async def customer_analytics(request):
+    if request.user.role != 'customer':
+        return render({'error': 'Customer access required'}, 403)
+    recent_orders = plan_queryset(Order.objects.filter(customer=request.user), OrderSerializer).order_by('-created_at')[:5]
+    customer, recent_orders = await asyncio.gather(
+        rollups.aget_rollup('customer', request.user.id),
+        alist(recent_orders),
+    )
+    return render({
+        'total_orders': customer.orders,
+        'total_spent': float(customer.delivered_revenue),
+        'recent_orders': OrderSerializer(recent_orders, many=True).data
+    })
+
+
+@async_read(_analytics_view('delivery_analytics'))
+async def delivery_analytics(request):
+    if request.user.role != 'delivery_partner':
+        return render({'error': 'Delivery partner access required'}, 403)
+    today = timezone.now().date()
+    partner, weekly_deliveries = await asyncio.gather(
+        rollups.aget_rollup('delivery_partner', request.user.id),
+        rollups.asum_days('delivery_partner', request.user.id, today - timedelta(days=7), 'deliveries'),
+    )
+    total_deliveries = partner.deliveries
+    completed_deliveries = partner.completed_deliveries
+    return render({
+        'total_deliveries': total_deliveries,
+        'completed_deliveries': completed_deliveries,
+        'weekly_deliveries': weekly_deliveries,
+        'completion_rate': round((completed_deliveries / total_deliveries * 100) if total_deliveries > 0 else 0, 2)
+    })
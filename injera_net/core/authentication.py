@@ -0,0 +1,214 @@
+"""
+JWT authentication without a user query per request.
+
+Access tokens from /api/auth/login/ and /api/auth/refresh/ carry the user's
+username, role and is_staff next to the user id. ClaimsJWTAuthentication
+builds request.user from them: a User instance with only those fields
+loaded, whose other fields (e.g. latitude) are fetched from the database
+only if a view reads them. Role and staff checks, ownership comparisons and
+foreign key filters on request.user need no query at all.
+
+Claims are trusted for JWT_CLAIMS_MAX_AGE seconds after the token was
+issued. Older tokens, and tokens issued before the claims existed, are
+resolved through an in-process LRU cache of user rows that keeps each row
+for JWT_USER_CACHE_TTL seconds, so a changed role or a deactivated user is
+noticed within those bounds at one query per user per TTL.
+
+Every token is also checked against the revoked tokens and sessions held in
+memory by core.revocation, again without a query.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from rest_framework_simplejwt.utils import datetime_to_epoch
+
+from .revocation import SESSION_CLAIM, revocations
+
+User = get_user_model()
+
+CLAIMS = ('username', 'role', 'is_staff')
+# Columns of the cached user rows; request.user has exactly these loaded
+LOADED_FIELDS = ('id', 'username', 'role', 'is_staff', 'is_active')
+
+
+def stamp_claims(token, user):
+    for claim in CLAIMS:
+        token[claim] = getattr(user, claim)
+    return token
+
+
+class PreciseIssuedAtMixin:
+    """Stamps `iat` to the microsecond, so a login right after a revoke_all is told apart from the tokens it revoked"""
+
+    def set_iat(self, claim='iat', at_time=None):
+        at_time = at_time or self.current_time
+        self.payload[claim] = datetime_to_epoch(at_time) + at_time.microsecond / 1_000_000
+
+
+class ClaimsAccessToken(PreciseIssuedAtMixin, AccessToken):
+    @classmethod
+    def for_user(cls, user):
+        return stamp_claims(super().for_user(user), user)
+
+
+class ClaimsRefreshToken(PreciseIssuedAtMixin, RefreshToken):
+    # The access tokens derived from it copy the claims, the session id included
+    access_token_class = ClaimsAccessToken
+
+    @classmethod
+    def for_user(cls, user):
+        token = stamp_claims(super().for_user(user), user)
+        token[SESSION_CLAIM] = token[api_settings.JTI_CLAIM]
+        return token
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = ClaimsRefreshToken
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = ClaimsRefreshToken
+
+    def validate(self, attrs):
+        """A new access token with the user's current claims; the refresh token is not rotated"""
+        refresh = self.token_class(attrs['refresh'])
+        revocations.follow()
+        if revocations.is_revoked(refresh.payload):
+            raise InvalidToken('Token has been revoked')
+        user = User.objects.filter(**{api_settings.USER_ID_FIELD: refresh.get(api_settings.USER_ID_CLAIM)}).first()
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        user_cache.invalidate(user.pk)
+        return {'access': str(stamp_claims(refresh.access_token, user))}
+
+
+class UserCache:
+    """Thread-safe LRU of {user id: LOADED_FIELDS values}, each kept for JWT_USER_CACHE_TTL seconds"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = OrderedDict()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._rows.get(user_id)
+            if entry is None:
+                return None
+            expires, row = entry
+            if expires < time.monotonic():
+                del self._rows[user_id]
+                return None
+            self._rows.move_to_end(user_id)
+            return row
+
+    def put(self, user_id, row):
+        size = getattr(settings, 'JWT_USER_CACHE_SIZE', 10000)
+        if not size:
+            return row
+        with self._lock:
+            self._rows[user_id] = (time.monotonic() + getattr(settings, 'JWT_USER_CACHE_TTL', 60), row)
+            self._rows.move_to_end(user_id)
+            while len(self._rows) > size:
+                self._rows.popitem(last=False)
+        return row
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._rows.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+
+
+user_cache = UserCache()
+
+
+def lightweight_user(row):
+    """A User with only the fields in `row` loaded; reading any other field loads it"""
+    names = [field.attname for field in User._meta.concrete_fields if field.attname in row]
+    return User.from_db(DEFAULT_DB_ALIAS, names, [row[name] for name in names])
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication whose request.user comes from the token's claims or the user cache"""
+    revocations = revocations
+
+    def get_validated_token(self, raw_token):
+        """The validated token, unless revoked"""
+        self.revocations.follow()
+        return self._unrevoked(super().get_validated_token(raw_token))
+
+    async def aget_validated_token(self, raw_token):
+        """get_validated_token for async views, loading the revocations in a worker thread the first time"""
+        if self.revocations.loaded:
+            self.revocations.follow()
+        else:
+            await sync_to_async(self.revocations.follow)()
+        return self._unrevoked(super().get_validated_token(raw_token))
+
+    def _unrevoked(self, validated_token):
+        if self.revocations.is_revoked(validated_token.payload):
+            raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+        return validated_token
+
+    def get_user(self, validated_token):
+        user_id, row = self._from_claims(validated_token)
+        if row is None:
+            row = user_cache.get(user_id)
+        if row is None:
+            row = user_cache.put(user_id, User.objects.filter(pk=user_id).values(*LOADED_FIELDS).first())
+        return self._user(row)
+
+    async def aget_user(self, validated_token):
+        """get_user for async views, loading cache misses with the async ORM"""
+        user_id, row = self._from_claims(validated_token)
+        if row is None:
+            row = user_cache.get(user_id)
+        if row is None:
+            row = user_cache.put(user_id, await User.objects.filter(pk=user_id).values(*LOADED_FIELDS).afirst())
+        return self._user(row)
+
+    def _from_claims(self, validated_token):
+        """(user id, row built from the claims, or None when they are missing or too old)"""
+        try:
+            user_id = User._meta.pk.to_python(validated_token[api_settings.USER_ID_CLAIM])
+        except (KeyError, ValueError):
+            raise InvalidToken('Token contained no recognizable user identification')
+        issued = validated_token.get('iat')
+        if (
+            issued is None or any(claim not in validated_token for claim in CLAIMS)
+            or time.time() - issued > getattr(settings, 'JWT_CLAIMS_MAX_AGE', 300)
+        ):
+            return user_id, None
+        return user_id, {
+            'id': user_id, 'is_active': True, **{claim: validated_token[claim] for claim in CLAIMS},
+        }
+
+    def _user(self, row):
+        if row is None:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+        if not row['is_active']:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return lightweight_user(row)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    # Other processes notice within JWT_USER_CACHE_TTL
+    user_cache.invalidate(instance.pk)
@@ -0,0 +1,124 @@
+"""Helpers shared by the benchmark management commands"""
+import math
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .models import User, Product, Order, Notification
+from .notifications import recount_unread
+
+BATCH_SIZE = 10000
+
+
+class Rollback(Exception):
+    """Raised inside `rolled_back()` to discard everything a benchmark wrote"""
+
+
+@contextmanager
+def rolled_back():
+    """Run a benchmark inside a transaction that is always rolled back"""
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback
+    except Rollback:
+        pass
+
+
+@contextmanager
+def timed(results, label):
+    """Record the wall time of the block, in milliseconds, as results[label]"""
+    start = time.perf_counter()
+    yield
+    results[label] = round((time.perf_counter() - start) * 1000, 3)
+
+
+def latency_summary(latencies):
+    """Percentiles, mean and max of a list of latencies in milliseconds"""
+    latencies = sorted(latencies)
+    if not latencies:
+        return {}
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 3)
+
+    return {
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'max_ms': round(latencies[-1], 3),
+    }
+
+
+def bulk_insert(model, rows, batch_size=BATCH_SIZE):
+    """bulk_create an iterable of unsaved instances in fixed-size batches"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            model.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch)
+
+
+def seed_users(role, count, prefix=None):
+    prefix = prefix or f'bench_{role}'
+    bulk_insert(User, (User(username=f'{prefix}_{i}', role=role) for i in range(count)))
+    return list(User.objects.filter(username__startswith=f'{prefix}_').order_by('id'))
+
+
+def seed_products(makers, per_maker):
+    bulk_insert(Product, (
+        Product(maker=maker, name=f'Bench dish {maker.id}-{i}', price=Decimal('2.50') + i, stock=1000)
+        for maker in makers for i in range(per_maker)
+    ))
+    return list(Product.objects.filter(maker__in=makers).order_by('id'))
+
+
+def seed_orders(customers, products, count, statuses=('pending', 'accepted', 'paid', 'delivered', 'cancelled')):
+    """Spread `count` orders round-robin over customers, products and statuses"""
+    bulk_insert(Order, (
+        Order(
+            customer=customers[i % len(customers)],
+            product=products[i % len(products)],
+            quantity=1 + i % 3,
+            total_price=products[i % len(products)].price * (1 + i % 3),
+            status=statuses[i % len(statuses)],
+        )
+        for i in range(count)
+    ))
+
+
+def spread_created_at(queryset, days):
+    """Backdate the rows of `queryset` evenly over the last `days` days, in primary key order"""
+    # auto_now_add overwrites created_at on insert, so it can only be changed afterwards
+    bounds = queryset.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return
+    step = math.ceil((bounds['high'] - bounds['low'] + 1) / days)
+    now = timezone.now()
+    for day in range(days):
+        low = bounds['low'] + day * step
+        queryset.filter(pk__gte=low, pk__lt=low + step).update(created_at=now - timedelta(days=day))
+
+
+def seed_notifications(users, count, read_ratio=0.9):
+    """Create `count` notifications, most of them already read like in production"""
+    read_every = max(1, round(1 / (1 - read_ratio))) if read_ratio < 1 else None
+    bulk_insert(Notification, (
+        Notification(
+            user=users[i % len(users)],
+            message=f'Benchmark notification {i}',
+            is_read=read_every is None or i % read_every != 0,
+        )
+        for i in range(count)
+    ))
+    # bulk_create bypasses the unread counters
+    recount_unread([user.pk for user in users])
@@ -0,0 +1,146 @@
+"""
+Bulk order and delivery transitions.
+
+A maker accepting a morning's orders, or a partner starting a round, sends
+all the ids at once instead of one request per order. Each action loads
+(and locks) the rows in one query that also tells whose they are, moves
+every eligible row with a single UPDATE guarded on its current status, and
+follows up in bulk: rollups, stock, payments and one batch of
+notifications. The moves go through the models' state machines
+(`StateMachine.apply_many`), as the single-row methods do, so the same
+`transitioned` signal follows every moved row.
+
+Results are reported per id: the new status, or 'not_found',
+'not_authorized' or 'invalid_status' (the row can't make that transition,
+e.g. it was accepted already).
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Product, Order, OrderLine, Payment, Delivery, Notification
+
+MAX_IDS = 500
+
+NOT_FOUND = 'not_found'
+NOT_AUTHORIZED = 'not_authorized'
+INVALID_STATUS = 'invalid_status'
+
+
+def parse_ids(ids):
+    """The distinct ids of a request's `ids` list, in order; raises ValueError"""
+    error = f"ids must be a list of at most {MAX_IDS} ids"
+    if not isinstance(ids, list) or not ids or len(ids) > MAX_IDS:
+        raise ValueError(error)
+    try:
+        return list(dict.fromkeys(int(pk) for pk in ids))
+    except (TypeError, ValueError):
+        raise ValueError(error)
+
+
+def _transition(queryset, ids, allowed, name, **changes):
+    """
+    Move the rows of `queryset` with the given ids that pass `allowed` along
+    the model's transition `name` (setting `changes` too) with one UPDATE.
+    Returns ({id: result}, moved instances); call within a transaction.
+    """
+    machine = queryset.model.transitions
+    rows = queryset.select_for_update(of=('self',)).in_bulk(ids)
+    results, eligible = {}, []
+    for pk in ids:
+        row = rows.get(pk)
+        if row is None:
+            results[pk] = NOT_FOUND
+        elif not allowed(row):
+            results[pk] = NOT_AUTHORIZED
+        elif not machine.allows(row, name):
+            results[pk] = INVALID_STATUS
+        else:
+            eligible.append(row)
+    moved = machine.apply_many(eligible, name, **changes)
+    results.update((row.pk, INVALID_STATUS) for row in eligible)
+    results.update((row.pk, row.status) for row in moved)
+    return results, moved
+
+
+def _in_order(ids, results):
+    return {pk: results[pk] for pk in ids}
+
+
+def accept_orders(maker, ids):
+    """Accept the maker's pending orders among `ids`"""
+    with transaction.atomic():
+        results, accepted = _transition(
+            Order.objects.select_related('product'), ids,
+            lambda order: order.product.maker_id == maker.id, 'accept',
+        )
+        Notification.notify_orders_accepted(accepted)
+    return _in_order(ids, results)
+
+
+def cancel_orders(user, ids):
+    """Cancel the pending or accepted orders among `ids` that `user` placed or makes, returning their stock"""
+    with transaction.atomic():
+        results, cancelled = _transition(
+            Order.objects.select_related('product'), ids,
+            lambda order: user.id in (order.customer_id, order.product.maker_id), 'cancel',
+        )
+
+        quantities = Counter()
+        for order in cancelled:
+            if not order.line_count:
+                quantities[order.product_id] += order.quantity
+        carts = [order.pk for order in cancelled if order.line_count]
+        for product_id, quantity in OrderLine.objects.filter(order_id__in=carts).values_list('product_id', 'quantity'):
+            quantities[product_id] += quantity
+        if quantities:
+            Product.release_stocks(quantities)
+
+        # Their pending payments fail, as in Order.cancel_order
+        customers = {order.pk: order.customer_id for order in cancelled}
+        payments = Payment.transitions.apply_many(
+            Payment.objects.select_for_update().filter(order_id__in=customers, status__in=Payment.transitions['fail'].sources),
+            'fail',
+        )
+        Notification.send_many(
+            (customers[payment.order_id], f"Payment for Order #{payment.order_id} failed. Please try again.")
+            for payment in payments
+        )
+    return _in_order(ids, results)
+
+
+def mark_in_transit(partner, ids):
+    """Start the partner's assigned deliveries among `ids`"""
+    with transaction.atomic():
+        results, started = _transition(
+            Delivery.objects.select_related('order'), ids,
+            lambda delivery: delivery.delivery_partner_id == partner.id, 'start',
+        )
+        Notification.send_many(
+            (delivery.order.customer_id, f"Your order #{delivery.order_id} is out for delivery!")
+            for delivery in started
+        )
+    return _in_order(ids, results)
+
+
+def mark_completed(partner, ids):
+    """Complete the partner's deliveries in transit among `ids`, delivering their orders"""
+    with transaction.atomic():
+        results, completed = _transition(
+            Delivery.objects.select_related('order__product'), ids,
+            lambda delivery: delivery.delivery_partner_id == partner.id, 'complete',
+            delivered_at=timezone.now(),
+        )
+        # Re-read under lock: the rollups diff against these rows' statuses
+        Order.transitions.apply_many(
+            Order.objects.select_for_update(of=('self',)).select_related('product').filter(
+                pk__in=[delivery.order_id for delivery in completed], status__in=Order.transitions['deliver'].sources,
+            ),
+            'deliver',
+        )
+        Notification.send_many(
+            (delivery.order.customer_id, f"Your order #{delivery.order_id} has been delivered!")
+            for delivery in completed
+        )
+    return _in_order(ids, results)
@@ -0,0 +1,397 @@
+"""
+Streaming bulk import and export of products and inventory.
+
+A maker or supplier manages hundreds of rows as one CSV or JSONL file
+instead of one request per row. Both directions hold a single chunk in
+memory whatever the file's size:
+
+- import reads the file line by line, validates CHUNK_SIZE rows at a time
+  with the model fields' own rules, and writes each chunk with one
+  bulk_create(update_conflicts=True) in its own transaction. Rows with an
+  `id` update that row (which must be the importer's), rows without one
+  are created. Only the file's columns are written: a column left out,
+  or a null or blank number or boolean cell, keeps the current value (or
+  the default for new rows). Columns that exports add but imports can't
+  set (the owner, timestamps, ratings) are ignored, so an export can be
+  edited and sent back as is. Invalid rows are skipped and reported with
+  their line.
+- export streams the rows in primary key order from .iterator(), so an
+  exported file can be imported again.
+
+BulkRowsMixin adds both as POST <list>/import/ (the file is the request
+body; its Content-Type, or ?as=csv|jsonl, gives the format) and
+GET <list>/export/?as=csv|jsonl (default csv). The import_rows and
+export_rows commands do the same from files.
+
+bulk_create bypasses save() and the post_save handlers, so each chunk does
+their work in bulk: products invalidate the catalog cache, the search index
+and their rollup labels; inventory queues one batch of low stock
+notifications.
+"""
+import csv
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import OuterRef, Subquery
+from django.http import StreamingHttpResponse
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from . import catalog_cache, search
+from .models import Product, Inventory, Notification, AnalyticsRollup
+
+CHUNK_SIZE = 1000
+# Rows per write of a streamed export
+EXPORT_BATCH = 500
+# Errors listed in an import report; later ones are only counted
+MAX_ERRORS = 100
+
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+BOOLEANS = {'true': True, 'yes': True, 'false': False, 'no': False}
+
+
+def format_for(content_type):
+    """The file format of a request's Content-Type, or None"""
+    content_type = content_type.split(';')[0].strip().lower()
+    if content_type in ('text/csv', 'application/csv'):
+        return 'csv'
+    if content_type in ('application/x-ndjson', 'application/jsonl', 'application/x-jsonlines'):
+        return 'jsonl'
+    return None
+
+
+class Table:
+    """How the rows of one model are imported and exported"""
+    name = None
+    model = None
+    owner_field = None
+    # Columns an import may set, besides `id`
+    fields = ()
+    # Further columns of an export, ignored by imports
+    read_only_fields = ()
+
+    @property
+    def export_fields(self):
+        return ('id', *self.fields, self.owner_field, *self.read_only_fields)
+
+    @property
+    def required(self):
+        """Fields a new row must be given"""
+        return [
+            name for name in self.fields
+            if not self.model._meta.get_field(name).has_default() and not self.model._meta.get_field(name).blank
+        ]
+
+    @property
+    def auto_now_fields(self):
+        # bulk_create sets them on every row, as save() would
+        return [field.name for field in self.model._meta.fields if getattr(field, 'auto_now', False)]
+
+    def after_upsert(self, created, updated):
+        """Bulk follow-up of the rows of a chunk, inside its transaction"""
+
+
+class ProductTable(Table):
+    name = 'products'
+    model = Product
+    owner_field = 'maker'
+    fields = ('name', 'description', 'price', 'stock', 'available')
+    read_only_fields = ('created_at', 'rating_count', 'rating_average')
+
+    def after_upsert(self, created, updated):
+        ids = [product.pk for product in created + updated]
+        catalog_cache.products_changed(ids)
+        search.get_backend().reindex(ids)
+        if updated:
+            AnalyticsRollup.objects.filter(scope='product', key__in=[product.pk for product in updated]).update(
+                label=Subquery(Product.objects.filter(pk=OuterRef('key')).values('name')[:1]),
+            )
+
+
+class InventoryTable(Table):
+    name = 'inventory'
+    model = Inventory
+    owner_field = 'owner'
+    fields = ('item_name', 'quantity', 'low_stock_threshold')
+    read_only_fields = ('updated_at',)
+
+    def after_upsert(self, created, updated):
+        # Inventory.save only warns about rows that already existed
+        Notification.send_many([
+            (item.owner_id, f"Your {item.item_name} is running low! Current stock: {item.quantity}")
+            for item in updated if item.is_low_stock
+        ])
+
+
+PRODUCTS = ProductTable()
+INVENTORY = InventoryTable()
+TABLES = {table.name: table for table in (PRODUCTS, INVENTORY)}
+
+
+# Reading
+
+def read_records(lines, file_format):
+    """
+    Yield (line number, record) for each row of an iterable of text lines;
+    a record is a dict, or a string describing why the line is no row.
+    Raises ValueError if the file can't be read as `file_format` at all.
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(lines)
+        try:
+            for record in reader:
+                if None in record:
+                    yield reader.line_num, f"More cells than the {len(reader.fieldnames)} columns"
+                else:
+                    yield reader.line_num, record
+        except csv.Error as exc:
+            raise ValueError(f"Line {reader.line_num}: {exc}")
+    elif file_format == 'jsonl':
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield number, "Not valid JSON"
+                continue
+            yield number, record if isinstance(record, dict) else "Not a JSON object"
+    else:
+        raise ValueError(f"Format must be one of {', '.join(FORMATS)}")
+
+
+def decoded(lines, encoding='utf-8-sig'):
+    """Text lines of an iterable of byte lines, e.g. an HttpRequest or a binary file; raises ValueError"""
+    for number, line in enumerate(lines, 1):
+        try:
+            yield line.decode(encoding)
+        except UnicodeDecodeError:
+            raise ValueError(f"Line {number} is not {encoding.split('-sig')[0].upper()} text")
+
+
+# Importing
+
+class RowError(Exception):
+    pass
+
+
+def _clean(field, value):
+    """`value` as the model field stores it; None for a null or blank cell; raises RowError"""
+    if value is None:
+        return None
+    if isinstance(value, str) and not isinstance(field, (models.CharField, models.TextField)):
+        value = value.strip()
+        if not value:
+            return None
+        if isinstance(field, models.BooleanField):
+            value = BOOLEANS.get(value.lower(), value)
+    try:
+        return field.clean(value, None)
+    except ValidationError as exc:
+        raise RowError(f"{field.name}: {' '.join(exc.messages)}")
+
+
+def _parse_id(value):
+    if value is None or value == '':
+        return None
+    try:
+        pk = int(value)
+    except (TypeError, ValueError):
+        raise RowError("id must be an integer")
+    if pk <= 0:
+        raise RowError("id must be positive")
+    return pk
+
+
+class Importer:
+    """Upserts the records of one file into `table` as `owner`'s rows, one chunk at a time"""
+
+    def __init__(self, table, owner, chunk_size=CHUNK_SIZE):
+        self.table = table
+        self.owner = owner
+        self.chunk_size = chunk_size
+        self.report = {'rows': 0, 'created': 0, 'updated': 0, 'failed': 0, 'errors': []}
+        self.checked = False
+
+    def run(self, records):
+        """Import (line number, record) pairs from read_records; returns the report"""
+        chunk = []
+        for number, record in records:
+            self.report['rows'] += 1
+            if isinstance(record, str):
+                self.fail(number, record)
+                continue
+            if not self.checked:
+                # The CSV header, or the first JSON record: a wrong file rather than a wrong row
+                self.check_columns(record)
+                self.checked = True
+            chunk.append((number, record))
+            if len(chunk) >= self.chunk_size:
+                self.write(chunk)
+                chunk = []
+        if chunk:
+            self.write(chunk)
+        return self.report
+
+    def check_columns(self, record):
+        unknown = set(record) - set(self.table.export_fields)
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(sorted(unknown))}")
+
+    def fail(self, number, message):
+        self.report['failed'] += 1
+        if len(self.report['errors']) < MAX_ERRORS:
+            self.report['errors'].append({'line': number, 'error': message})
+
+    def parse(self, record):
+        """(id or None, {field: value}) of a record; raises RowError"""
+        unknown = set(record) - set(self.table.export_fields)
+        if unknown:
+            raise RowError(f"Unknown columns: {', '.join(sorted(unknown))}")
+        values = {}
+        for name in self.table.fields:
+            if name in record:
+                value = _clean(self.table.model._meta.get_field(name), record[name])
+                if value is not None:
+                    values[name] = value
+        return _parse_id(record.get('id')), values
+
+    def write(self, chunk):
+        model = self.table.model
+        owner_id = f'{self.table.owner_field}_id'
+        with transaction.atomic():
+            parsed = []
+            for number, record in chunk:
+                try:
+                    parsed.append((number, *self.parse(record)))
+                except RowError as exc:
+                    self.fail(number, str(exc))
+
+            ids = {pk for _, pk, _ in parsed if pk is not None}
+            existing = model.objects.select_for_update().in_bulk(ids) if ids else {}
+            created, updated, columns = [], {}, set()
+            for number, pk, values in parsed:
+                if pk is None:
+                    missing = [name for name in self.table.required if name not in values]
+                    if missing:
+                        self.fail(number, f"{', '.join(missing)}: This field is required.")
+                        continue
+                    created.append(model(**{self.table.owner_field: self.owner}, **values))
+                elif pk not in existing:
+                    self.fail(number, f"No row with id {pk}")
+                    continue
+                elif getattr(existing[pk], owner_id) != self.owner.pk:
+                    self.fail(number, f"Row {pk} is not yours")
+                    continue
+                else:
+                    row = existing[pk]
+                    for name, value in values.items():
+                        setattr(row, name, value)
+                    updated[pk] = row  # the file's last row for an id wins
+                columns.update(values)
+
+            # Rows that exist keep the columns no row of the chunk sets
+            update_fields = [name for name in self.table.fields if name in columns] + self.table.auto_now_fields
+            updated = list(updated.values())
+            if created or (updated and update_fields):
+                model.objects.bulk_create(
+                    created + updated,
+                    update_conflicts=True,
+                    unique_fields=['id'],
+                    update_fields=update_fields,
+                )
+                self.table.after_upsert(created, updated)
+        self.report['created'] += len(created)
+        self.report['updated'] += len(updated)
+
+
+def import_rows(table, owner, lines, file_format, chunk_size=CHUNK_SIZE):
+    """
+    Import the rows of a CSV or JSONL file, given as text lines, into
+    `table` for `owner`. Returns the report: rows read, rows created and
+    updated, rows failed and the first MAX_ERRORS errors by line. Raises
+    ValueError if the file itself is unusable (format, columns); chunks
+    written before that stay written.
+    """
+    return Importer(table, owner, chunk_size).run(read_records(lines, file_format))
+
+
+# Exporting
+
+class _Echo:
+    """File-like object whose write returns what was written, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def _text(value):
+    # Dates and times as ISO 8601 in both formats; decimals as exact strings in JSON
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def export_rows(queryset, table, file_format, chunk_size=CHUNK_SIZE):
+    """Yield `queryset`'s rows as CSV or JSONL text, EXPORT_BATCH rows at a time, in constant memory"""
+    if file_format not in FORMATS:
+        raise ValueError(f"Format must be one of {', '.join(FORMATS)}")
+    fields = table.export_fields
+    columns = [f'{name}_id' if name == table.owner_field else name for name in fields]
+    rows = queryset.order_by('pk').values_list(*columns).iterator(chunk_size=chunk_size)
+    if file_format == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(fields)
+
+        def encode(row):
+            return writer.writerow([value if value is None else _text(value) for value in row])
+    else:
+        def encode(row):
+            return json.dumps(dict(zip(fields, row)), default=_text) + '\n'
+    batch = []
+    for row in rows:
+        batch.append(encode(row))
+        if len(batch) >= EXPORT_BATCH:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+class BulkRowsMixin:
+    """`import` and `export` actions for a viewset over `bulk_table`'s model"""
+    bulk_table = None
+    # Roles that may import rows of their own
+    import_roles = ()
+
+    def export_queryset(self, request):
+        return self.bulk_table.model.objects.all()
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_rows(self, request):
+        """Create and update the caller's rows from a CSV or JSONL request body"""
+        if request.user.role not in self.import_roles:
+            return Response({'error': 'Not authorized to import rows'}, status=403)
+        file_format = request.query_params.get('as') or format_for(request.content_type)
+        if file_format not in FORMATS:
+            return Response({'error': f"Send text/csv or application/x-ndjson, or pass ?as={'|'.join(FORMATS)}"}, status=415)
+        importer = Importer(self.bulk_table, request.user)
+        try:
+            # Read the body line by line rather than through request.data
+            importer.run(read_records(decoded(request._request), file_format))
+        except ValueError as exc:
+            # Chunks written before the error stay written
+            return Response({'error': str(exc), **importer.report}, status=400)
+        return Response(importer.report)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream the rows as CSV or JSONL"""
+        file_format = request.query_params.get('as', 'csv')
+        if file_format not in FORMATS:
+            return Response({'error': f"as must be one of {', '.join(FORMATS)}"}, status=400)
+        return StreamingHttpResponse(
+            export_rows(self.export_queryset(request), self.bulk_table, file_format),
+            content_type=CONTENT_TYPES[file_format],
+            headers={'Content-Disposition': f'attachment; filename="{self.bulk_table.name}.{file_format}"'},
+        )
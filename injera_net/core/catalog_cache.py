@@ -0,0 +1,186 @@
+"""
+Read-through cache for the product catalog.
+
+List and detail responses of ProductViewSet are cached under versioned keys.
+Every product has a version counter, and so does the catalog as a whole;
+saving or deleting a product (or changing its stock through an order) bumps
+both once the transaction commits. Stale entries are never read again and
+simply expire, so invalidation is a single cache write and never a scan.
+
+The versions double as ETags: a request whose If-None-Match still matches
+the current version gets a 304 after one cache read, without touching the
+database. Works with any Django cache backend (local memory, Redis, ...)
+selected by CATALOG_CACHE_ALIAS. The async read views in core.async_views
+share the same keys through `acached`.
+"""
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.response import Response
+
+from .models import Product
+
+LIST_VERSION_KEY = 'catalog:list:version'
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _cache():
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')]
+
+
+def _count(event):
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def stats():
+    """Hit/miss/not-modified counters of this process"""
+    with _stats_lock:
+        return {event: _stats[event] for event in ('hits', 'misses', 'not_modified')}
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def _product_version_key(product_id):
+    return f'catalog:product:{product_id}:version'
+
+
+def _version(key):
+    # Start from the clock rather than 1 so versions (and ETags) issued before
+    # a cache flush are never reused for different content
+    cache = _cache()
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+async def _aversion(key):
+    cache = _cache()
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), None)
+        version = await cache.aget(key)
+    return version
+
+
+def _bump(key):
+    cache = _cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), None)
+
+
+def products_changed(product_ids):
+    """Invalidate the catalog list and the given products once the current transaction commits"""
+    product_ids = list(product_ids)
+
+    def bump():
+        for product_id in product_ids:
+            _bump(_product_version_key(product_id))
+        _bump(LIST_VERSION_KEY)
+
+    transaction.on_commit(bump)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        products_changed([instance.pk])
+
+
+def _list_tag(request, version):
+    # Page links are absolute, so the host is part of the key
+    variant = hashlib.sha1(request.build_absolute_uri().encode()).hexdigest()[:16]
+    return f'list-{version}-{variant}'
+
+
+def _not_modified(request, etag):
+    if etag in request.headers.get('If-None-Match', ''):
+        _count('not_modified')
+        return True
+    return False
+
+
+class CachedCatalogMixin:
+    """Serves `list` and `retrieve` from the catalog cache, with ETag support"""
+
+    def list(self, request, *args, **kwargs):
+        return self._cached_list(request, lambda: super(CachedCatalogMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        product_id = kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        version = _version(_product_version_key(product_id))
+        return self._cached(request, f'product-{product_id}-{version}', lambda: super(CachedCatalogMixin, self).retrieve(request, *args, **kwargs))
+
+    def _cached_list(self, request, fetch):
+        """Cache `fetch()`, a response over the whole catalog, until any product changes"""
+        return self._cached(request, _list_tag(request, _version(LIST_VERSION_KEY)), fetch)
+
+    def _cached(self, request, tag, fetch):
+        etag = f'"{tag}"'
+        if _not_modified(request, etag):
+            return Response(status=304, headers={'ETag': etag})
+
+        cache = _cache()
+        key = f'catalog:response:{tag}'
+        data = cache.get(key)
+        if data is not None:
+            _count('hits')
+            return Response(data, headers={'ETag': etag, 'X-Cache': 'HIT'})
+
+        _count('misses')
+        response = fetch()
+        if response.status_code == 200:
+            cache.set(key, response.data, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300))
+            response['ETag'] = etag
+        response['X-Cache'] = 'MISS'
+        return response
+
+
+async def alist_tag(request):
+    return _list_tag(request, await _aversion(LIST_VERSION_KEY))
+
+
+async def aproduct_tag(product_id):
+    return f'product-{product_id}-{await _aversion(_product_version_key(product_id))}'
+
+
+async def acached(request, tag, fetch):
+    """
+    CachedCatalogMixin._cached for async views: `fetch` is a coroutine
+    function returning (status, data); returns (status, data, headers).
+    """
+    etag = f'"{tag}"'
+    if _not_modified(request, etag):
+        return 304, None, {'ETag': etag}
+
+    cache = _cache()
+    key = f'catalog:response:{tag}'
+    data = await cache.aget(key)
+    if data is not None:
+        _count('hits')
+        return 200, data, {'ETag': etag, 'X-Cache': 'HIT'}
+
+    _count('misses')
+    status, data = await fetch()
+    headers = {'X-Cache': 'MISS'}
+    if status == 200:
+        await cache.aset(key, data, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300))
+        headers['ETag'] = etag
+    return status, data, headers
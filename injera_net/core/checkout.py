@@ -0,0 +1,128 @@
+"""
+Oversell-proof order placement.
+
+Stock is reserved with a conditional `UPDATE ... SET stock = stock - n WHERE
+stock >= n`, so there is no read-check-write window for concurrent buyers to
+slip through. A multi-item checkout reserves every product, inserts the
+orders and their payments in bulk, and commits or rolls back as a whole.
+Products are reserved in id order so two overlapping carts always lock rows
+in the same sequence.
+"""
+from collections import Counter
+
+from django.db import transaction
+
+from . import rollups
+from .models import Product, Order, OrderLine, Payment, Notification
+
+
+class CheckoutError(Exception):
+    pass
+
+
+def _quantities(items):
+    """Total quantity per product id of (product_id, quantity, ...) items"""
+    quantities = Counter()
+    for product_id, quantity, *_ in items:
+        if quantity < 1:
+            raise CheckoutError(f"Invalid quantity for product #{product_id}")
+        quantities[product_id] += quantity
+    if not quantities:
+        raise CheckoutError("No items to order")
+    return quantities
+
+
+def _load_products(product_ids):
+    # Read prices before the transaction so it only holds write locks
+    products = Product.objects.select_related('maker').in_bulk(list(product_ids))
+    missing = set(product_ids) - set(products)
+    if missing:
+        raise CheckoutError(f"Unknown product #{min(missing)}")
+    return products
+
+
+def _reserve(quantities):
+    for product_id in sorted(quantities):
+        Product.reserve_stock(product_id, quantities[product_id])
+
+
+def _create_payments(orders):
+    payments = Payment.objects.bulk_create([
+        Payment(order=order, amount=order.total_price, status='pending') for order in orders
+    ])
+    # bulk_create skips the rollup signals
+    rollups.record_created(orders + payments)
+
+
+def place_orders(customer, items):
+    """
+    Create one order per (product_id, quantity) in `items`, all or nothing.
+    Raises OutOfStock if any product can't cover its quantity and
+    CheckoutError for unknown products or bad quantities.
+    """
+    quantities = _quantities(items)
+    products = _load_products(quantities)
+
+    with transaction.atomic():
+        _reserve(quantities)
+        orders = Order.objects.bulk_create([
+            Order(
+                customer=customer,
+                product=products[product_id],
+                quantity=quantity,
+                total_price=products[product_id].price * quantity,
+            )
+            for product_id, quantity in items
+        ])
+        _create_payments(orders)
+
+    for order in orders:
+        Notification.notify_order_created(order)
+    return orders
+
+
+def checkout_cart(customer, items):
+    """
+    Turn a cart of (product_id, quantity, expected_price) items into one order
+    per maker, each with its lines and a single payment. `expected_price` may
+    be None; otherwise it must still match the product's price. Raises
+    OutOfStock or CheckoutError and creates nothing in that case.
+    """
+    quantities = _quantities(items)
+    products = _load_products(quantities)
+    for product_id, _, expected_price in items:
+        product = products[product_id]
+        if not product.available:
+            raise CheckoutError(f"Product #{product_id} is not available")
+        if expected_price is not None and expected_price != product.price:
+            raise CheckoutError(f"Price of product #{product_id} changed to {product.price}")
+
+    carts = {}
+    for product_id, quantity in quantities.items():
+        product = products[product_id]
+        carts.setdefault(product.maker_id, []).append(
+            OrderLine(product=product, quantity=quantity, unit_price=product.price)
+        )
+
+    with transaction.atomic():
+        _reserve(quantities)
+        orders = Order.objects.bulk_create([
+            Order(
+                customer=customer,
+                product=lines[0].product,
+                quantity=sum(line.quantity for line in lines),
+                total_price=sum(line.line_total for line in lines),
+                line_count=len(lines),
+            )
+            for lines in carts.values()
+        ])
+        for order, lines in zip(orders, carts.values()):
+            for line in lines:
+                line.order = order
+        OrderLine.objects.bulk_create([line for lines in carts.values() for line in lines])
+        _create_payments(orders)
+
+    # One notification per maker
+    for order in orders:
+        Notification.notify_order_created(order)
+    return orders
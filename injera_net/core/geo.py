@@ -0,0 +1,165 @@
+"""
+In-memory spatial index of available delivery partners.
+
+Partners are bucketed into a fixed grid of `cell_size` degree cells. A
+nearest-neighbour query scans rings of cells around the query point and
+stops once no unscanned cell can hold anything closer than the k-th best
+match, so lookups touch a handful of cells regardless of fleet size.
+
+The index is a per-process cache: it loads lazily from the database, follows
+User saves and assignment claims in this process, and reloads every
+GEO_INDEX_TTL seconds to pick up changes made by other processes. The
+assignment engine's compare-and-set claim stays the source of truth.
+"""
+import heapq
+import math
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import User
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+
+# Beyond this many rings a linear scan is cheaper than walking empty cells
+MAX_RINGS = 64
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class PartnerGridIndex:
+    def __init__(self, cell_size=0.01):
+        self.cell_size = cell_size
+        self._lock = threading.RLock()
+        self._cells = defaultdict(set)
+        self._points = {}
+
+    def __len__(self):
+        return len(self._points)
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.cell_size), math.floor(lon / self.cell_size)
+
+    def clear(self):
+        with self._lock:
+            self._cells.clear()
+            self._points.clear()
+
+    def add(self, partner_id, lat, lon):
+        with self._lock:
+            self.remove(partner_id)
+            self._points[partner_id] = (lat, lon)
+            self._cells[self._cell(lat, lon)].add(partner_id)
+
+    def remove(self, partner_id):
+        with self._lock:
+            point = self._points.pop(partner_id, None)
+            if point is not None:
+                cell = self._cell(*point)
+                self._cells[cell].discard(partner_id)
+                if not self._cells[cell]:
+                    del self._cells[cell]
+
+    def nearest(self, lat, lon, k=1):
+        """[(distance_km, partner_id)] of the `k` closest partners, closest first"""
+        with self._lock:
+            if not self._points:
+                return []
+            ci, cj = self._cell(lat, lon)
+            # Smallest km width of a cell around this latitude, to bound unscanned rings
+            cell_km = self.cell_size * KM_PER_DEGREE * max(math.cos(math.radians(min(abs(lat) + 1, 89))), 0.01)
+            best, seen = [], 0
+            for ring in range(MAX_RINGS):
+                for cell in self._ring(ci, cj, ring):
+                    for partner_id in self._cells.get(cell, ()):
+                        seen += 1
+                        distance = haversine_km(lat, lon, *self._points[partner_id])
+                        heapq.heappush(best, (-distance, partner_id))
+                        if len(best) > k:
+                            heapq.heappop(best)
+                if seen == len(self._points):
+                    break
+                if len(best) == k and -best[0][0] <= ring * cell_km:
+                    break
+            else:
+                best = [(-haversine_km(lat, lon, *point), partner_id) for partner_id, point in self._points.items()]
+            return sorted((-distance, partner_id) for distance, partner_id in heapq.nlargest(k, best))
+
+    @staticmethod
+    def _ring(ci, cj, ring):
+        if ring == 0:
+            yield ci, cj
+            return
+        for dj in range(-ring, ring + 1):
+            yield ci - ring, cj + dj
+            yield ci + ring, cj + dj
+        for di in range(-ring + 1, ring):
+            yield ci + di, cj - ring
+            yield ci + di, cj + ring
+
+
+class PartnerLocator:
+    """The shared grid index of available partners, loaded from the database on demand"""
+
+    def __init__(self, ttl=None, cell_size=None):
+        self.ttl = ttl if ttl is not None else getattr(settings, 'GEO_INDEX_TTL', 30)
+        self.index = PartnerGridIndex(cell_size or getattr(settings, 'GEO_INDEX_CELL_SIZE', 0.01))
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        rows = User.objects.filter(
+            role='delivery_partner', is_available=True,
+            latitude__isnull=False, longitude__isnull=False,
+        ).values_list('id', 'latitude', 'longitude')
+        with self.index._lock:
+            self.index.clear()
+            for partner_id, lat, lon in rows.iterator():
+                self.index.add(partner_id, lat, lon)
+        self._loaded_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            with self._lock:
+                if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+                    self.refresh()
+
+    def nearest(self, lat, lon, k=1):
+        self._ensure_fresh()
+        return self.index.nearest(lat, lon, k)
+
+    def update(self, partner_id, lat, lon, available):
+        if available and lat is not None and lon is not None:
+            self.index.add(partner_id, lat, lon)
+        else:
+            self.index.remove(partner_id)
+
+    def remove(self, partner_ids):
+        for partner_id in partner_ids:
+            self.index.remove(partner_id)
+
+    def invalidate(self):
+        self._loaded_at = None
+
+
+locator = PartnerLocator()
+
+
+@receiver(post_save, sender=User)
+def partner_saved(sender, instance, raw=False, **kwargs):
+    if instance.role == 'delivery_partner' and not raw:
+        locator.update(instance.pk, instance.latitude, instance.longitude, instance.is_available)
+
+
+@receiver(post_delete, sender=User)
+def partner_deleted(sender, instance, **kwargs):
+    locator.remove([instance.pk])
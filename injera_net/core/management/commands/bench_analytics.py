@@ -0,0 +1,197 @@
+import json
+import statistics
+from datetime import datetime, time as day_start, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count, Q, Sum
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core import rollups
+from core.benchmarking import rolled_back, timed, bulk_insert, seed_users, seed_products, seed_orders, spread_created_at
+from core.models import User, Order, Payment
+
+
+def _bounds(field, since, until):
+    """Indexed created_at-style bounds for the inclusive day range"""
+    bounds = Q()
+    if since is not None:
+        bounds &= Q(**{f'{field}__gte': timezone.make_aware(datetime.combine(since, day_start.min))})
+    if until is not None:
+        bounds &= Q(**{f'{field}__lt': timezone.make_aware(datetime.combine(until + timedelta(days=1), day_start.min))})
+    return bounds
+
+
+# The three ways of answering the two endpoints. Each returns the endpoint's figures.
+
+def dashboard_sequential(since, until):
+    """The original implementation: four queries over the source tables"""
+    orders = Order.objects.filter(_bounds('created_at', since, until))
+    revenue = Payment.objects.filter(_bounds('created_at', since, until), status='paid').aggregate(Sum('amount'))['amount__sum']
+    return {
+        'total_users': User.objects.filter(_bounds('date_joined', since, until)).count(),
+        'total_orders': orders.count(),
+        'total_revenue': float(revenue or 0),
+        'pending_orders': orders.filter(status='pending').count(),
+    }
+
+
+def dashboard_single_pass(since, until):
+    """One conditional aggregation per table instead of one query per figure"""
+    orders = Order.objects.filter(_bounds('created_at', since, until)).aggregate(
+        total=Count('id'), pending=Count('id', filter=Q(status='pending')),
+    )
+    revenue = Payment.objects.filter(_bounds('created_at', since, until)).aggregate(
+        paid=Sum('amount', filter=Q(status='paid')),
+    )['paid']
+    return {
+        'total_users': User.objects.filter(_bounds('date_joined', since, until)).count(),
+        'total_orders': orders['total'],
+        'total_revenue': float(revenue or 0),
+        'pending_orders': orders['pending'],
+    }
+
+
+def dashboard_rollups(since, until):
+    platform = rollups.totals('platform', since=since, until=until)
+    return {
+        'total_users': platform.users,
+        'total_orders': platform.orders,
+        'total_revenue': float(platform.paid_revenue),
+        'pending_orders': platform.pending_orders,
+    }
+
+
+def _maker_figures(total_sales, total_earnings, top_products):
+    return {
+        'total_sales': total_sales,
+        'total_earnings': float(total_earnings or 0),
+        'top_products': [(row['product__name'], row['total_sold']) for row in top_products],
+    }
+
+
+def maker_sequential(maker, since, until):
+    """The original implementation: count, sum and a grouped query over the same orders"""
+    orders = Order.objects.filter(_bounds('created_at', since, until), product__maker=maker)
+    delivered = orders.filter(status='delivered')
+    top_products = (
+        orders.values('product__name').annotate(total_sold=Count('id'), total_revenue=Sum('total_price'))
+        .order_by('-total_sold', 'product__name')[:5]
+    )
+    return _maker_figures(delivered.count(), delivered.aggregate(Sum('total_price'))['total_price__sum'], top_products)
+
+
+def maker_single_pass(maker, since, until):
+    """One grouped scan with conditional aggregates; maker totals are the sum of the product groups"""
+    rows = list(
+        Order.objects.filter(_bounds('created_at', since, until), product__maker=maker)
+        .values('product__name')
+        .annotate(
+            total_sold=Count('id'),
+            total_revenue=Sum('total_price'),
+            delivered=Count('id', filter=Q(status='delivered')),
+            earnings=Sum('total_price', filter=Q(status='delivered')),
+        )
+        .order_by()
+    )
+    rows.sort(key=lambda row: (-row['total_sold'], row['product__name']))
+    return _maker_figures(sum(row['delivered'] for row in rows), sum(row['earnings'] or 0 for row in rows), rows[:5])
+
+
+def maker_rollups(maker, since, until):
+    summary, top_products = rollups.maker_summary(maker.id, since, until)
+    return _maker_figures(summary.delivered_orders, summary.delivered_revenue, top_products)
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed orders and payments inside a rolled-back transaction and compare dashboard_stats and "
+        "maker_analytics computed three ways: the original sequential queries, single-pass "
+        "conditional aggregation over the orders, and the rollups the endpoints read."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000000)
+        parser.add_argument('--days', type=int, default=365, help='Spread order dates over this many days')
+        parser.add_argument('--range-days', type=int, default=30, help='Size of the date-range variant')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per measurement; the median is reported')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        report = {'orders': options['orders']}
+        with rolled_back():
+            with timed(report, 'seed_ms'):
+                maker = self.seed(options)
+            with timed(report, 'rollup_rebuild_ms'):
+                rollups.rebuild()
+            today = timezone.localdate()
+            ranges = {
+                'all_time': (None, None),
+                f'last_{options["range_days"]}_days': (today - timedelta(days=options['range_days'] - 1), today),
+            }
+            variants = {
+                'dashboard_stats': {
+                    'sequential': dashboard_sequential,
+                    'single_pass': dashboard_single_pass,
+                    'rollups': dashboard_rollups,
+                },
+                'maker_analytics': {
+                    'sequential': lambda since, until: maker_sequential(maker, since, until),
+                    'single_pass': lambda since, until: maker_single_pass(maker, since, until),
+                    'rollups': lambda since, until: maker_rollups(maker, since, until),
+                },
+            }
+            for endpoint, implementations in variants.items():
+                for range_name, (since, until) in ranges.items():
+                    results = {
+                        name: self.measure(implementation, since, until, options['repeat'])
+                        for name, implementation in implementations.items()
+                    }
+                    answers = [result.pop('result') for result in results.values()]
+                    results['consistent'] = all(answer == answers[0] for answer in answers)
+                    report[f'{endpoint}.{range_name}'] = results
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(
+            f"{report['orders']} orders seeded in {report['seed_ms']} ms, "
+            f"rollups rebuilt in {report['rollup_rebuild_ms']} ms"
+        )
+        for name, results in report.items():
+            if not isinstance(results, dict):
+                continue
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"{name}" + ('' if results.pop('consistent') else ' (results differ!)')
+            ))
+            for variant, result in results.items():
+                self.stdout.write(f"  {variant:11}: {result['ms']:10.3f} ms, {result['queries']} queries")
+
+    def seed(self, options):
+        customers = seed_users('customer', 1000)
+        makers = seed_users('maker', 50)
+        products = seed_products(makers, 5)
+        seed_orders(customers, products, options['orders'])
+        orders = Order.objects.filter(customer__in=customers)
+        bulk_insert(Payment, (
+            Payment(order_id=order_id, amount=total_price, status='paid')
+            for order_id, total_price in orders.filter(status__in=['paid', 'delivered'])
+            .values_list('id', 'total_price').iterator(chunk_size=10000)
+        ))
+        spread_created_at(orders, options['days'])
+        spread_created_at(Payment.objects.filter(order__customer__in=customers), options['days'])
+        # Refresh planner statistics so plans reflect the seeded volume
+        if connection.vendor in ('sqlite', 'postgresql'):
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        return makers[0]
+
+    def measure(self, implementation, since, until, repeat):
+        timings = []
+        for _ in range(repeat):
+            run = {}
+            with CaptureQueriesContext(connection) as context, timed(run, 'ms'):
+                result = implementation(since, until)
+            timings.append(run['ms'])
+        return {'ms': statistics.median(timings), 'queries': len(context.captured_queries), 'result': result}
@@ -0,0 +1,112 @@
+import json
+import threading
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+
+from core.assignment import get_engine
+from core import rollups
+from core.benchmarking import BATCH_SIZE
+from core.models import User, Product, Order, Delivery
+from core.notifications import dispatcher
+
+PREFIX = 'bench_assign'
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire concurrent single-order assignments (as mark_paid does) from several threads, "
+        "verify that no partner is assigned twice and report throughput per worker count. "
+        "Writes to the configured database and removes its rows afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=400)
+        parser.add_argument('--partners', type=int, default=400)
+        parser.add_argument('--workers', default='1,2,4,8', help='Comma separated worker counts')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=PREFIX).exists():
+            raise CommandError(f"Found leftover '{PREFIX}' users; delete them before benchmarking.")
+
+        report = []
+        try:
+            for workers in [int(value) for value in options['workers'].split(',')]:
+                report.append(self.run(workers, options['orders'], options['partners']))
+        finally:
+            dispatcher.flush()
+            User.objects.filter(username__startswith=PREFIX).delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for row in report:
+            self.stdout.write(
+                f"{row['workers']:>3} workers: {row['assigned']}/{row['expected']} assigned in {row['seconds']}s "
+                f"({row['per_second']}/s), errors={row['errors']}, double_assigned={row['double_assigned']}"
+            )
+
+    def seed(self, run, orders, partners):
+        prefix = f'{PREFIX}_{run}'
+        customer = User.objects.create(username=f'{prefix}_customer', role='customer')
+        maker = User.objects.create(username=f'{prefix}_maker', role='maker')
+        product = Product.objects.create(maker=maker, name='Bench injera', price=Decimal('2.00'))
+        # bulk_create skips the rollup signals, so record the rows explicitly
+        # to keep the rollups exact once the cleanup deletes them again
+        partner_rows = User.objects.bulk_create([
+            User(username=f'{prefix}_partner_{i}', role='delivery_partner', is_available=True)
+            for i in range(partners)
+        ], batch_size=BATCH_SIZE)
+        order_rows = Order.objects.bulk_create([
+            Order(customer=customer, product=product, total_price=product.price, status='paid')
+            for _ in range(orders)
+        ], batch_size=BATCH_SIZE)
+        rollups.record_created(partner_rows + order_rows)
+        return order_rows, prefix
+
+    def run(self, workers, orders, partners):
+        # Leave earlier runs' partners busy so each run only sees its own
+        User.objects.filter(username__startswith=PREFIX).update(is_available=False)
+        order_list, prefix = self.seed(workers, orders, partners)
+        errors = []
+        engine = get_engine()
+
+        def work(chunk):
+            try:
+                for order in chunk:
+                    try:
+                        engine.assign([order])
+                    except Exception as exc:
+                        errors.append(repr(exc))
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=work, args=(order_list[i::workers],))
+            for i in range(workers)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        deliveries = Delivery.objects.filter(order__customer__username=f'{prefix}_customer')
+        double_assigned = (
+            deliveries.values('delivery_partner').annotate(n=Count('id')).filter(n__gt=1).count()
+        )
+        assigned = deliveries.count()
+        return {
+            'workers': workers,
+            'assigned': assigned,
+            'expected': min(orders, partners),
+            'double_assigned': double_assigned,
+            'errors': len(errors),
+            'seconds': round(elapsed, 3),
+            'per_second': round(assigned / elapsed, 1) if elapsed else None,
+        }
@@ -0,0 +1,141 @@
+import asyncio
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.benchmarking import seed_users, seed_products, seed_notifications
+from core.checkout import place_orders
+from core.models import User, Product
+from core.notifications import dispatcher
+
+PREFIX = 'bench_async'
+
+
+async def asgi_get(application, path, headers):
+    """One GET through the ASGI application; returns the status code"""
+    path, _, query = path.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'root_path': '', 'query_string': query.encode(),
+        'headers': [(b'host', b'localhost')] + headers,
+        'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+    }
+    requested = False
+    status = None
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # The client never disconnects early
+        await asyncio.Future()
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await application(scope, receive, send)
+    return status
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare requests/sec and latency percentiles of the async read views (core.async_views) "
+        "with the sync viewsets, driving the ASGI application in-process with concurrent clients. "
+        "Writes to the configured database and removes its rows afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=50, help='Requests in flight at once')
+        parser.add_argument('--requests', type=int, default=1000, help='Requests per endpoint and mode')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=PREFIX).exists():
+            raise CommandError(f"Found leftover '{PREFIX}' users; delete them before benchmarking.")
+        try:
+            endpoints = self.seed()
+            report = {}
+            for name, (path, user) in endpoints.items():
+                headers = [(b'authorization', f'Bearer {AccessToken.for_user(user)}'.encode())] if user else []
+                report[name] = {
+                    mode: self.measure(path, headers, enabled, options['concurrency'], options['requests'])
+                    for mode, enabled in (('sync', False), ('async', True))
+                }
+        finally:
+            dispatcher.flush()
+            User.objects.filter(username__startswith=PREFIX).delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for name, modes in report.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for mode, result in modes.items():
+                self.stdout.write(
+                    f"  {mode:5}: {result['requests_per_second']:8.1f} req/s, "
+                    f"p50={result['p50_ms']}ms p99={result['p99_ms']}ms, statuses {result['statuses']}"
+                )
+
+    def seed(self):
+        admin = User.objects.create_user(username=f'{PREFIX}_admin', role='admin', is_staff=True)
+        customers = seed_users('customer', 20, prefix=f'{PREFIX}_customer')
+        makers = seed_users('maker', 5, prefix=f'{PREFIX}_maker')
+        partners = seed_users('delivery_partner', 200, prefix=f'{PREFIX}_partner')
+        products = seed_products(makers, 20)
+        seed_notifications(customers, 20 * 500, read_ratio=0.8)
+        for customer in customers[:5]:
+            place_orders(customer, [(product.id, 1) for product in products[:5]])
+        product = Product.objects.filter(maker__in=makers).first()
+        return {
+            'products.list': ('/api/products/', None),
+            'products.detail': (f'/api/products/{product.id}/', None),
+            'notifications.list': ('/api/notifications/', customers[0]),
+            'notifications.unread': ('/api/notifications/unread/', customers[0]),
+            'deliveries.available_partners': ('/api/deliveries/available_partners/', makers[0]),
+            'analytics.dashboard_stats': ('/api/analytics/dashboard_stats/', admin),
+            'analytics.maker_analytics': ('/api/analytics/maker_analytics/', makers[0]),
+            'analytics.customer_analytics': ('/api/analytics/customer_analytics/', customers[0]),
+            'analytics.delivery_analytics': ('/api/analytics/delivery_analytics/', partners[0]),
+        }
+
+    def measure(self, path, headers, async_views_enabled, concurrency, requests):
+        from injera_net.asgi import application
+
+        async def run():
+            latencies, statuses = [], {}
+            remaining = iter(range(requests))
+
+            async def client():
+                for _ in remaining:
+                    start = time.perf_counter()
+                    status = await asgi_get(application, path, headers)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    statuses[status] = statuses.get(status, 0) + 1
+
+            # Warm up connections and caches
+            await asyncio.gather(*(asgi_get(application, path, headers) for _ in range(concurrency)))
+            start = time.perf_counter()
+            await asyncio.gather(*(client() for _ in range(concurrency)))
+            return time.perf_counter() - start, sorted(latencies), statuses
+
+        with override_settings(ASYNC_READ_VIEWS=async_views_enabled):
+            seconds, latencies, statuses = asyncio.run(run())
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 2)
+
+        return {
+            'requests_per_second': round(len(latencies) / seconds, 1),
+            'p50_ms': percentile(0.50),
+            'p99_ms': percentile(0.99),
+            'mean_ms': round(statistics.fmean(latencies), 2),
+            'statuses': statuses,
+        }
@@ -0,0 +1,103 @@
+import json
+import time
+from contextlib import nullcontext
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.test import APIClient
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.authentication import ClaimsAccessToken, user_cache
+from core.benchmarking import rolled_back, seed_users, seed_products, seed_notifications, latency_summary
+from core.checkout import place_orders
+
+PREFIX = 'bench_auth'
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare requests/sec and queries per request of hot read endpoints authenticated by "
+        "session + JWTAuthentication (a user query per request), by a token's role claims and by "
+        "a claim-less token through the user cache. Runs in a rolled back transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per endpoint and variant')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        report = {}
+        with rolled_back():
+            customer, maker, endpoints = self.seed()
+            variants = {
+                'session+jwt': (
+                    AccessToken, {'JWT_USER_CACHE_SIZE': 0},
+                    mock.patch.object(APIView, 'authentication_classes', [SessionAuthentication, JWTAuthentication]),
+                ),
+                'claims': (ClaimsAccessToken, {}, nullcontext()),
+                'cached_user': (AccessToken, {}, nullcontext()),
+            }
+            for name, (path, role) in endpoints.items():
+                user = customer if role == 'customer' else maker
+                report[name] = {}
+                for variant, (token_class, overrides, patch) in variants.items():
+                    user_cache.clear()
+                    client = APIClient(SERVER_NAME='localhost')
+                    client.credentials(HTTP_AUTHORIZATION=f'Bearer {token_class.for_user(user)}')
+                    # Served by the DRF viewsets, whose authentication classes the baseline swaps
+                    with override_settings(ASYNC_READ_VIEWS=False, REQUEST_METRICS=False, **overrides), patch:
+                        report[name][variant] = self.measure(client, path, options['requests'])
+        user_cache.clear()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for name, variants in report.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for variant, result in variants.items():
+                self.stdout.write(
+                    f"  {variant:12}: {result['requests_per_second']:8.1f} req/s, "
+                    f"{result['queries_per_request']:.2f} queries/request, "
+                    f"p50={result['p50_ms']}ms p99={result['p99_ms']}ms, statuses {result['statuses']}"
+                )
+
+    def seed(self):
+        customers = seed_users('customer', 2, prefix=f'{PREFIX}_customer')
+        makers = seed_users('maker', 2, prefix=f'{PREFIX}_maker')
+        products = seed_products(makers, 10)
+        seed_notifications(customers, 2 * 200, read_ratio=0.8)
+        place_orders(customers[0], [(product.id, 1) for product in products[:5]])
+        return customers[0], makers[0], {
+            'orders.list': ('/api/orders/?page_size=20', 'customer'),
+            'notifications.unread': ('/api/notifications/unread/', 'customer'),
+            'analytics.maker_analytics': ('/api/analytics/maker_analytics/', 'maker'),
+        }
+
+    def measure(self, client, path, requests):
+        client.get(path)  # warm up
+        latencies, statuses, queries = [], {}, 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            start = time.perf_counter()
+            for _ in range(requests):
+                began = time.perf_counter()
+                status = client.get(path).status_code
+                latencies.append((time.perf_counter() - began) * 1000)
+                statuses[status] = statuses.get(status, 0) + 1
+            seconds = time.perf_counter() - start
+        return {
+            'requests_per_second': round(requests / seconds, 1),
+            'queries_per_request': round(queries / requests, 2),
+            **latency_summary(latencies),
+            'statuses': statuses,
+        }
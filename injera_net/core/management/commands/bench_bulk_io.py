@@ -0,0 +1,148 @@
+import csv
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import bulk_io
+from core.models import User
+from core.notifications import dispatcher
+from core.serializers import ProductSerializer, InventorySerializer
+
+PREFIX = 'bench_bulk_io'
+SERIALIZERS = {'products': ProductSerializer, 'inventory': InventorySerializer}
+OWNER_ROLES = {'products': 'maker', 'inventory': 'supplier'}
+
+
+@contextmanager
+def traced(results, label):
+    """Record the peak Python memory allocated in the block, in KiB, as results[label]"""
+    tracemalloc.start()
+    try:
+        yield
+    finally:
+        results[label] = round(tracemalloc.get_traced_memory()[1] / 1024)
+        tracemalloc.stop()
+
+
+def measure(results, label, rows, function):
+    """Run `function`, recording its milliseconds and rows per second under `label`"""
+    start = time.perf_counter()
+    value = function()
+    seconds = time.perf_counter() - start
+    results[f'{label}_ms'] = round(seconds * 1000, 3)
+    results[f'{label}_rows_per_s'] = round(rows / seconds) if seconds else None
+    return value
+
+
+class Command(BaseCommand):
+    help = (
+        "Import --rows generated products (or inventory items) from a CSV or JSONL file, export "
+        "them, and import the export back as updates; reports throughput and peak memory, next to "
+        "the memory of serializing the rows as one list. Writes to the configured database in "
+        "committed chunks, like a real import, and deletes its rows afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000)
+        parser.add_argument('--table', choices=sorted(bulk_io.TABLES), default='products')
+        parser.add_argument('--format', choices=bulk_io.FORMATS, default='csv')
+        parser.add_argument('--chunk-size', type=int, default=bulk_io.CHUNK_SIZE)
+        parser.add_argument(
+            '--list-rows', type=int, default=100000,
+            help='Rows serialized as one list for the memory comparison (0 to skip)',
+        )
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=PREFIX).exists():
+            raise CommandError(f"Found leftover '{PREFIX}' users; delete them before benchmarking.")
+        table = bulk_io.TABLES[options['table']]
+        report = {'table': table.name, 'format': options['format'], 'rows': options['rows']}
+        owner = User.objects.create(username=f'{PREFIX}_owner', role=OWNER_ROLES[table.name])
+        directory = tempfile.mkdtemp(prefix=PREFIX)
+        source = os.path.join(directory, f"import.{options['format']}")
+        exported = os.path.join(directory, f"export.{options['format']}")
+        try:
+            self.generate(table, source, options['format'], options['rows'])
+            report['file_mb'] = round(os.path.getsize(source) / 2 ** 20, 1)
+
+            created = measure(report, 'import', options['rows'], lambda: self.load(table, owner, source, options))
+            report['created'] = created['created']
+            report['failed'] = created['failed']
+            queryset = table.model.objects.filter(**{table.owner_field: owner})
+
+            measure(report, 'export', options['rows'], lambda: self.export(queryset, table, exported, options))
+            with traced(report, 'export_peak_kb'):
+                self.export(queryset, table, os.devnull, options)
+            with traced(report, 'reimport_peak_kb'):
+                updated = measure(
+                    report, 'reimport', options['rows'], lambda: self.load(table, owner, exported, options),
+                )
+            report['updated'] = updated['updated']
+
+            if options['list_rows']:
+                with traced(report, 'list_peak_kb'):
+                    SERIALIZERS[table.name](queryset.order_by('pk')[:options['list_rows']], many=True).data
+        finally:
+            dispatcher.flush()
+            for name in (source, exported):
+                if os.path.exists(name):
+                    os.remove(name)
+            os.rmdir(directory)
+            self.clean_up(table, owner)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{report['rows']} {report['table']} as {report['format']} ({report['file_mb']} MiB)"
+        ))
+        for label in ('import', 'export', 'reimport'):
+            self.stdout.write(f"  {label:9}: {report[f'{label}_ms']:12.1f} ms, {report[f'{label}_rows_per_s']} rows/s")
+        self.stdout.write(
+            f"  peak memory: export {report['export_peak_kb']} KiB, reimport {report['reimport_peak_kb']} KiB"
+            + (f", {options['list_rows']} rows as one list {report['list_peak_kb']} KiB" if options['list_rows'] else '')
+        )
+        self.stdout.write(f"  created {report['created']}, updated {report['updated']}, failed {report['failed']}")
+
+    def generate(self, table, path, file_format, rows):
+        """Write `rows` new rows, streamed to the file"""
+        with open(path, 'w', newline='', encoding='utf-8') as output:
+            if file_format == 'csv':
+                writer = csv.writer(output)
+                writer.writerow(table.fields)
+                for i in range(rows):
+                    writer.writerow(self.row(table, i))
+            else:
+                for i in range(rows):
+                    output.write(json.dumps(dict(zip(table.fields, self.row(table, i)))) + '\n')
+
+    def row(self, table, i):
+        if table.name == 'products':
+            return (f'Bench dish {i}', f'Imported benchmark dish number {i}', f'{2 + i % 50}.50', 100 + i % 900, i % 7 != 0)
+        return (f'Bench item {i}', 100 + i % 900, 5)
+
+    def load(self, table, owner, path, options):
+        importer = bulk_io.Importer(table, owner, options['chunk_size'])
+        with open(path, 'rb') as source:
+            return importer.run(bulk_io.read_records(bulk_io.decoded(source), options['format']))
+
+    def export(self, queryset, table, path, options):
+        with open(path, 'w', newline='', encoding='utf-8') as output:
+            for text in bulk_io.export_rows(queryset, table, options['format'], options['chunk_size']):
+                output.write(text)
+
+    def clean_up(self, table, owner):
+        # Delete in slices so the per-row delete signals never load every row at once
+        queryset = table.model.objects.filter(**{table.owner_field: owner})
+        while True:
+            ids = list(queryset.values_list('pk', flat=True)[:10000])
+            if not ids:
+                break
+            table.model.objects.filter(pk__in=ids).delete()
+        owner.delete()
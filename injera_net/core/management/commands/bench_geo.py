@@ -0,0 +1,61 @@
+import json
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.geo import PartnerGridIndex
+
+
+class Command(BaseCommand):
+    help = "Time nearest-partner lookups and updates on an in-memory grid index of random partner positions."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--partners', type=int, default=50000)
+        parser.add_argument('--queries', type=int, default=10000)
+        parser.add_argument('--k', type=int, default=5)
+        parser.add_argument('--spread', type=float, default=0.3, help='Degrees around the city centre')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        # Addis Ababa
+        centre_lat, centre_lon, spread = 9.03, 38.74, options['spread']
+        rng = random.Random(42)
+
+        def point():
+            return centre_lat + rng.uniform(-spread, spread), centre_lon + rng.uniform(-spread, spread)
+
+        index = PartnerGridIndex()
+        start = time.perf_counter()
+        for partner_id in range(options['partners']):
+            index.add(partner_id, *point())
+        build_s = time.perf_counter() - start
+
+        lookups = []
+        for _ in range(options['queries']):
+            lat, lon = point()
+            start = time.perf_counter()
+            index.nearest(lat, lon, options['k'])
+            lookups.append((time.perf_counter() - start) * 1e6)
+
+        updates = []
+        for _ in range(options['queries']):
+            partner_id = rng.randrange(options['partners'])
+            start = time.perf_counter()
+            index.add(partner_id, *point())
+            updates.append((time.perf_counter() - start) * 1e6)
+
+        lookups.sort()
+        report = {
+            'partners': options['partners'],
+            'build_seconds': round(build_s, 3),
+            'lookup_us_p50': round(statistics.median(lookups), 1),
+            'lookup_us_p99': round(lookups[int(len(lookups) * 0.99) - 1], 1),
+            'update_us_mean': round(statistics.fmean(updates), 1),
+        }
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for key, value in report.items():
+            self.stdout.write(f"{key}: {value}")
@@ -0,0 +1,111 @@
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.benchmarking import (
+    rolled_back, timed, bulk_insert, seed_users, seed_products, seed_orders, seed_notifications,
+)
+from core.models import User, Order, Delivery, Notification
+
+# Indexes added for the hot filters in core/views.py
+HOT_INDEXES = {
+    User: ['user_available_role_idx'],
+    Order: ['order_status_idx', 'order_customer_created_idx'],
+    Delivery: ['delivery_partner_status_idx', 'delivery_partner_assigned_idx'],
+    Notification: ['notif_user_unread_idx'],
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed notifications, orders and deliveries inside a rolled-back transaction and "
+        "compare query plans and timings of the hot filters with and without their indexes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notifications', type=int, default=1000000)
+        parser.add_argument('--orders', type=int, default=1000000)
+        parser.add_argument('--deliveries', type=int, default=100000)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            self.seed(options)
+            report = {
+                'with_indexes': self.measure('with_indexes'),
+            }
+            with transaction.atomic():
+                self.drop_hot_indexes()
+                report['without_indexes'] = self.measure('without_indexes')
+                transaction.set_rollback(True)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for label, queries in report.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            for name, result in queries.items():
+                self.stdout.write(f"  {name}: {result['ms']} ms")
+                for line in result['plan'].splitlines():
+                    self.stdout.write(f"      {line}")
+
+    def seed(self, options):
+        self.customers = seed_users('customer', options['users'])
+        makers = seed_users('maker', max(1, options['users'] // 20))
+        self.partners = seed_users('delivery_partner', max(1, options['users'] // 10))
+        products = seed_products(makers, 5)
+        seed_orders(self.customers, products, options['orders'])
+        seed_notifications(self.customers, options['notifications'])
+
+        order_ids = list(
+            Order.objects.filter(status='delivered', delivery__isnull=True)
+            .values_list('id', flat=True)[:options['deliveries']]
+        )
+        bulk_insert(Delivery, (
+            Delivery(order_id=order_id, delivery_partner=self.partners[i % len(self.partners)], status='completed')
+            for i, order_id in enumerate(order_ids)
+        ))
+        # Refresh planner statistics so plans reflect the seeded volume
+        if connection.vendor in ('sqlite', 'postgresql'):
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def hot_queries(self):
+        customer, partner = self.customers[0], self.partners[0]
+        week_ago = timezone.now() - timedelta(days=7)
+        return {
+            'notifications.unread': Notification.objects.filter(user=customer, is_read=False),
+            'orders.pending': Order.objects.filter(status='pending'),
+            'orders.customer_recent': Order.objects.filter(customer=customer).order_by('-created_at')[:5],
+            'deliveries.partner_completed': Delivery.objects.filter(delivery_partner=partner, status='completed'),
+            'deliveries.partner_weekly': Delivery.objects.filter(delivery_partner=partner, assigned_at__gte=week_ago),
+            'users.available_partners': User.objects.filter(role='delivery_partner', is_available=True),
+        }
+
+    def measure(self, phase):
+        # Tag the SQL with the phase: SQLite reuses cached statements (and their
+        # plans) for identical SQL text even after the indexes are dropped.
+        results = {}
+        with connection.cursor() as cursor:
+            for name, queryset in self.hot_queries().items():
+                sql, params = queryset.values_list('id', flat=True).query.sql_with_params()
+                sql = f'{sql} /* {phase} */'
+                timings = {}
+                with timed(timings, 'ms'):
+                    cursor.execute(sql, params)
+                    cursor.fetchall()
+                cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+                plan = '\n'.join(str(row[-1]) for row in cursor.fetchall())
+                results[name] = {'ms': timings['ms'], 'plan': plan}
+        return results
+
+    def drop_hot_indexes(self):
+        # Plain DROP INDEX: SQLite's schema editor refuses to run inside a transaction
+        with connection.cursor() as cursor:
+            for names in HOT_INDEXES.values():
+                for name in names:
+                    cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
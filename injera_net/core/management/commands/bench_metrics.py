@@ -0,0 +1,68 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.urls import resolve
+
+from core import metrics
+
+
+def no_queries(request):
+    return HttpResponse(b'{}', content_type='application/json')
+
+
+def three_queries(request):
+    with connection.cursor() as cursor:
+        for _ in range(3):
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+    return HttpResponse(b'{}', content_type='application/json')
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the per-request overhead of RequestMetricsMiddleware: the same trivial views "
+        "called directly and through the middleware, in a tight loop. Does not write to the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100000)
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        request = RequestFactory().get('/api/orders/', HTTP_HOST='localhost')
+        request.resolver_match = resolve('/api/orders/')
+        report = {}
+        with override_settings(REQUEST_METRICS=True):
+            connection.ensure_connection()
+            for view in (no_queries, three_queries):
+                bare = self.measure(view, request, options['requests'])
+                instrumented = self.measure(metrics.RequestMetricsMiddleware(view), request, options['requests'])
+                report[view.__name__] = {
+                    'bare_us': round(bare, 2),
+                    'instrumented_us': round(instrumented, 2),
+                    'overhead_us': round(instrumented - bare, 2),
+                }
+        metrics.registry.reset()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for name, result in report.items():
+            self.stdout.write(
+                f"{name:14}: {result['bare_us']:8.2f} us bare, {result['instrumented_us']:8.2f} us instrumented, "
+                f"overhead {result['overhead_us']:.2f} us/request"
+            )
+
+    def measure(self, view, request, requests):
+        """Mean microseconds per call, best of three runs"""
+        runs = []
+        for _ in range(3):
+            start = time.perf_counter()
+            for _ in range(requests):
+                view(request)
+            runs.append((time.perf_counter() - start) / requests * 1e6)
+        return min(runs)
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import resource
+import statistics
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.models import User, Notification
+from core.notifications import dispatcher
+from core.streams import hub
+
+PREFIX = 'bench_stream'
+
+
+def rss_mb():
+    """Current resident set size; falls back to the peak where /proc isn't available"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class SimulatedClient:
+    """Drives one GET /api/notifications/stream/ through the project's ASGI application, like a browser EventSource"""
+
+    def __init__(self, application, token):
+        self.application = application
+        self.token = token
+        self.connected = asyncio.Event()
+        self.disconnect = asyncio.Event()
+        self.received = {}  # notification message -> arrival time
+        self.status = None
+        self._buffer = ''
+
+    async def run(self):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': '/api/notifications/stream/',
+            'raw_path': b'/api/notifications/stream/', 'root_path': '',
+            'query_string': f'token={self.token}'.encode(),
+            'headers': [(b'host', b'localhost'), (b'accept', b'text/event-stream')],
+            'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+        }
+        await self.application(scope, self.receive, self.send)
+
+    async def receive(self):
+        if not hasattr(self, '_sent_request'):
+            self._sent_request = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self.disconnect.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+            if self.status != 200:
+                self.connected.set()
+            return
+        self._buffer += message.get('body', b'').decode()
+        while '\n\n' in self._buffer:
+            block, self._buffer = self._buffer.split('\n\n', 1)
+            if block.startswith('event: unread'):
+                self.connected.set()
+            elif block.startswith('event: notification'):
+                event = json.loads(block.split('data: ', 1)[1])
+                self.received[event['message']] = time.perf_counter()
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test for the notification stream: opens many simulated SSE clients against the ASGI "
+        "application in-process, sends notifications and reports connect time, delivery latency "
+        "percentiles and memory. Writes to the configured database and removes its rows afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=500, help='Clients are spread over this many users')
+        parser.add_argument('--rounds', type=int, default=5, help='Notification rounds to every user')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=PREFIX).exists():
+            raise CommandError(f"Found leftover '{PREFIX}' users; delete them before benchmarking.")
+        users = User.objects.bulk_create([
+            User(username=f'{PREFIX}_{i}', role='customer') for i in range(options['users'])
+        ])
+        try:
+            report = asyncio.run(self.run(users, options['clients'], options['rounds']))
+        finally:
+            dispatcher.flush()
+            User.objects.filter(username__startswith=PREFIX).delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(
+            f"{report['connected']}/{report['clients']} clients connected in {report['connect_seconds']}s, "
+            f"memory +{report['rss_growth_mb']} MB; {report['delivered']}/{report['expected']} events delivered, "
+            f"latency p50={report['latency_ms']['p50']}ms p95={report['latency_ms']['p95']}ms "
+            f"p99={report['latency_ms']['p99']}ms"
+        )
+
+    async def run(self, users, clients, rounds):
+        from injera_net.asgi import application
+        tokens = [str(AccessToken.for_user(user)) for user in users]
+        streams = [SimulatedClient(application, tokens[i % len(users)]) for i in range(clients)]
+
+        rss_before = rss_mb()
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(stream.run()) for stream in streams]
+        await asyncio.gather(*(stream.connected.wait() for stream in streams))
+        connect_seconds = time.perf_counter() - start
+        rss_growth_mb = rss_mb() - rss_before
+
+        sent = {}
+        for round_number in range(rounds):
+            messages = {user.id: f'{PREFIX} round {round_number} for {user.id}' for user in users}
+            sent_at = time.perf_counter()
+            await sync_to_async(self.send_round)(messages)
+            sent.update({message: sent_at for message in messages.values()})
+            await asyncio.sleep(0.05)
+
+        # Wait for the dispatcher's background flush to reach the streams
+        deadline = time.perf_counter() + 10
+        while time.perf_counter() < deadline and any(
+            len(stream.received) < rounds for stream in streams if stream.status == 200
+        ):
+            await asyncio.sleep(0.05)
+
+        latencies = sorted(
+            (arrived - sent[message]) * 1000
+            for stream in streams for message, arrived in stream.received.items()
+        )
+        open_streams = hub.connections()
+        for stream in streams:
+            stream.disconnect.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 2) if latencies else None
+
+        return {
+            'clients': clients,
+            'users': len(users),
+            'connected': sum(stream.status == 200 for stream in streams),
+            'open_streams': open_streams,
+            'connect_seconds': round(connect_seconds, 3),
+            'rss_growth_mb': round(rss_growth_mb, 1),
+            'expected': clients * rounds,
+            'delivered': len(latencies),
+            'latency_ms': {
+                'p50': percentile(0.50), 'p95': percentile(0.95), 'p99': percentile(0.99),
+                'mean': round(statistics.fmean(latencies), 2) if latencies else None,
+            },
+            'streams_per_user': round(clients / len(users), 1),
+        }
+
+    def send_round(self, messages):
+        for user_id, message in messages.items():
+            Notification.send(user_id, message)
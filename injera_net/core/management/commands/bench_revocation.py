@@ -0,0 +1,104 @@
+import json
+import time
+import tracemalloc
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from core.authentication import ClaimsJWTAuthentication, ClaimsRefreshToken
+from core.benchmarking import rolled_back, bulk_insert, seed_users, timed
+from core.models import TokenRevocation
+from core.revocation import RevocationList, SESSION_CLAIM
+
+PREFIX = 'bench_revoke'
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the per-request cost of the token revocation check: the in-memory lookup, "
+        "token validation with and without it, and the same check as a database query; plus the "
+        "time and memory of loading the revocations. Runs in a rolled back transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--revocations', type=int, default=100000, help='Revoked tokens in the table')
+        parser.add_argument('--checks', type=int, default=100000, help='In-memory checks per measurement')
+        parser.add_argument('--queries', type=int, default=2000, help='Database checks')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        report = {'revocations': options['revocations']}
+        with rolled_back():
+            users = seed_users('customer', 100, prefix=f'{PREFIX}_customer')
+            expires = timezone.now() + timedelta(days=365)
+            bulk_insert(TokenRevocation, (
+                TokenRevocation(user=users[i % len(users)], jti=uuid.uuid4().hex, expires_at=expires)
+                for i in range(options['revocations'])
+            ))
+            # Every tenth user has revoked all of their tokens
+            bulk_insert(TokenRevocation, (TokenRevocation(user=user, expires_at=expires) for user in users[::10]))
+            TokenRevocation.objects.update(created_at=timezone.now() - timedelta(days=1))
+
+            loaded = RevocationList()
+            tracemalloc.start()
+            with timed(report, 'full_sync_ms'):
+                loaded.sync()
+            report['memory_kb'] = round(tracemalloc.get_traced_memory()[0] / 1024)
+            tracemalloc.stop()
+            # What a process reads every TOKEN_REVOCATION_SYNC_INTERVAL after 100 logouts elsewhere
+            bulk_insert(TokenRevocation, (
+                TokenRevocation(user=users[i], jti=uuid.uuid4().hex, expires_at=expires) for i in range(100)
+            ))
+            with timed(report, 'incremental_sync_ms'):
+                loaded.sync()
+
+            refresh = ClaimsRefreshToken.for_user(users[1])
+            access = refresh.access_token
+            raw = str(access).encode()
+            revoked = dict(access.payload, jti=TokenRevocation.objects.filter(jti__gt='').values_list('jti', flat=True)[0])
+
+            report['check_us'] = self.per_call(lambda: loaded.is_revoked(access.payload), options['checks'])
+            report['check_revoked_us'] = self.per_call(lambda: loaded.is_revoked(revoked), options['checks'])
+
+            plain, checked = JWTAuthentication(), ClaimsJWTAuthentication()
+            checked.revocations = loaded
+            report['validate_us'] = self.per_call(lambda: plain.get_validated_token(raw), options['checks'] // 10)
+            report['validate_and_check_us'] = self.per_call(
+                lambda: checked.get_validated_token(raw), options['checks'] // 10,
+            )
+            # The checks started its background reads, of a table about to be rolled back
+            loaded.stop()
+
+            def query():
+                return TokenRevocation.objects.filter(
+                    Q(jti__in=[access['jti'], access[SESSION_CLAIM]])
+                    | Q(user_id=access['user_id'], jti='', created_at__gte=timezone.now() - timedelta(days=365))
+                ).exists()
+            report['database_check_us'] = self.per_call(query, options['queries'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(self.style.MIGRATE_HEADING(f"{report['revocations']} revoked tokens"))
+        self.stdout.write(
+            f"  load: {report['full_sync_ms']}ms, {report['memory_kb']} KiB; "
+            f"incremental sync of 100 new {report['incremental_sync_ms']}ms"
+        )
+        self.stdout.write(
+            f"  in-memory check: {report['check_us']}us (revoked: {report['check_revoked_us']}us); "
+            f"database check: {report['database_check_us']}us"
+        )
+        self.stdout.write(
+            f"  token validation: {report['validate_us']}us, with the check {report['validate_and_check_us']}us"
+        )
+
+    def per_call(self, function, calls):
+        """Mean microseconds per call"""
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        return round((time.perf_counter() - start) / calls * 1e6, 3)
@@ -0,0 +1,117 @@
+import json
+import random
+import statistics
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from core import search
+from core.benchmarking import rolled_back, timed, bulk_insert, seed_users
+from core.models import Product
+
+DISHES = (
+    'injera', 'doro wot', 'misir wot', 'shiro', 'kitfo', 'tibs', 'firfir', 'gomen', 'atakilt', 'dulet',
+    'genfo', 'chechebsa', 'kolo', 'dabo', 'ambasha', 'sambusa', 'ayib', 'fosolia', 'key wot', 'alicha',
+)
+STYLES = ('spicy', 'mild', 'fasting', 'special', 'family', 'teff', 'barley', 'homemade', 'festive', 'vegan')
+SIDES = ('lentils', 'chicken', 'beef', 'lamb', 'cabbage', 'potatoes', 'chickpeas', 'collard greens', 'egg', 'butter')
+
+# (label, query parameters) of the measured searches
+QUERIES = (
+    ('word', {'q': 'kitfo'}),
+    ('two_words', {'q': 'spicy lentils'}),
+    ('prefix', {'q': 'cheche'}),
+    ('typo', {'q': 'chechbesa'}),
+    ('maker', {'q': 'bench_search_maker_7'}),
+    ('filtered', {'q': 'wot', 'available': 'true', 'min_price': '5', 'max_price': '20'}),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed products inside a rolled-back transaction and time product searches (first page, "
+        "total and facets, as GET /api/products/search/ computes them) with each search backend, "
+        "plus the index rebuild and the incremental update of a saved product."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000)
+        parser.add_argument('--makers', type=int, default=500)
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per measurement; the median is reported')
+        parser.add_argument('--backends', default='fts5,database', help='Comma separated search backends')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        report = {'products': options['products']}
+        with rolled_back():
+            with timed(report, 'seed_ms'):
+                self.seed(options)
+            with timed(report, 'index_rebuild_ms'):
+                search.get_backend('fts5').rebuild()
+            report['incremental_update_ms'] = self.measure_update(options['repeat'])
+            for name in options['backends'].split(','):
+                backend = search.get_backend(name)
+                report[name] = {
+                    label: self.measure(backend, params, options['page_size'], options['repeat'])
+                    for label, params in QUERIES
+                }
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(
+            f"{report['products']} products seeded in {report['seed_ms']} ms, index rebuilt in "
+            f"{report['index_rebuild_ms']} ms, product save with index update {report['incremental_update_ms']} ms"
+        )
+        for name in options['backends'].split(','):
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for label, result in report[name].items():
+                self.stdout.write(
+                    f"  {label:10}: {result['ms']:9.3f} ms, {result['queries']} queries, {result['matches']} matches"
+                )
+
+    def seed(self, options):
+        makers = seed_users('maker', options['makers'], prefix='bench_search_maker')
+        rng = random.Random(0)
+
+        def product(i):
+            dish, style, side = rng.choice(DISHES), rng.choice(STYLES), rng.choice(SIDES)
+            return Product(
+                maker=makers[i % len(makers)],
+                name=f'{style.title()} {dish}',
+                description=f'{dish.title()} with {side}, {rng.choice(STYLES)} style',
+                price=Decimal(rng.randrange(100, 5000)) / 100,
+                stock=rng.randrange(0, 50),
+                available=rng.random() < 0.9,
+            )
+        bulk_insert(Product, (product(i) for i in range(options['products'])))
+        # Refresh planner statistics so plans reflect the seeded volume
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def measure(self, backend, params, page_size, repeat):
+        filters = search.parse_filters(params)
+        timings = []
+        for _ in range(repeat):
+            run = {}
+            with CaptureQueriesContext(connection) as context, timed(run, 'ms'):
+                matches = backend.search(Product.objects.all(), params['q'])
+                page = list(matches.filter(filters)[:page_size])
+                total = matches.filter(filters).count()
+                search.facets(matches)
+            timings.append(run['ms'])
+        return {'ms': statistics.median(timings), 'queries': len(context.captured_queries), 'matches': total, 'page': len(page)}
+
+    def measure_update(self, repeat):
+        product = Product.objects.order_by('-id').first()
+        timings = []
+        for i in range(repeat):
+            product.name = f'Renamed dish {i}'
+            run = {}
+            with timed(run, 'ms'):
+                product.save()
+            timings.append(run['ms'])
+        return statistics.median(timings)
@@ -0,0 +1,93 @@
+import json
+import threading
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.checkout import place_orders
+from core.models import User, Product, Order, OutOfStock
+from core.notifications import dispatcher
+
+PREFIX = 'bench_stock'
+
+
+class Command(BaseCommand):
+    help = (
+        "Flash-sale benchmark: several threads race to buy a product with limited stock. "
+        "Verifies that exactly the available stock is sold and reports throughput per worker count. "
+        "Writes to the configured database and removes its rows afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stock', type=int, default=200)
+        parser.add_argument('--attempts', type=int, default=400, help='Purchase attempts per run')
+        parser.add_argument('--workers', default='1,2,4,8', help='Comma separated worker counts')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=PREFIX).exists():
+            raise CommandError(f"Found leftover '{PREFIX}' users; delete them before benchmarking.")
+
+        report = []
+        try:
+            for workers in [int(value) for value in options['workers'].split(',')]:
+                report.append(self.run(workers, options['stock'], options['attempts']))
+        finally:
+            dispatcher.flush()
+            User.objects.filter(username__startswith=PREFIX).delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for row in report:
+            self.stdout.write(
+                f"{row['workers']:>3} workers: {row['sold']}/{row['stock']} sold, {row['refused']} refused "
+                f"in {row['seconds']}s ({row['per_second']} attempts/s), errors={row['errors']}, "
+                f"stock_left={row['stock_left']}, oversold={row['oversold']}"
+            )
+
+    def run(self, workers, stock, attempts):
+        prefix = f'{PREFIX}_{workers}'
+        customer = User.objects.create(username=f'{prefix}_customer', role='customer')
+        maker = User.objects.create(username=f'{prefix}_maker', role='maker')
+        product = Product.objects.create(maker=maker, name='Flash sale injera', price=Decimal('2.00'), stock=stock)
+        refused, errors = [], []
+
+        def work(count):
+            try:
+                for _ in range(count):
+                    try:
+                        place_orders(customer, [(product.id, 1)])
+                    except OutOfStock:
+                        refused.append(1)
+                    except Exception as exc:
+                        errors.append(repr(exc))
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=work, args=(attempts // workers + (i < attempts % workers),))
+            for i in range(workers)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        product.refresh_from_db()
+        sold = Order.objects.filter(product=product).count()
+        return {
+            'workers': workers,
+            'stock': stock,
+            'sold': sold,
+            'refused': len(refused),
+            'errors': len(errors),
+            'stock_left': product.stock,
+            'oversold': sold + product.stock != stock or sold > stock,
+            'seconds': round(elapsed, 3),
+            'per_second': round(attempts / elapsed, 1) if elapsed else None,
+        }
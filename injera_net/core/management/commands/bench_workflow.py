@@ -0,0 +1,201 @@
+import json
+import threading
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core import rollups
+from core.benchmarking import latency_summary, seed_users, seed_products, seed_orders
+from core.models import User, Order
+from core.notifications import dispatcher
+
+PREFIX = 'bench_flow'
+PASSWORD = 'bench-Workflow-1'
+# Steps of one order's lifecycle, in the order they run
+STEPS = (
+    'auth.register', 'auth.login', 'orders.create', 'orders.accept', 'payments.process_payment',
+    'deliveries.auto_assign', 'deliveries.mark_in_transit', 'deliveries.mark_completed',
+)
+
+
+class StepFailed(Exception):
+    """A workflow request answered with an unexpected status; the rest of that workflow is skipped"""
+
+
+class Recorder:
+    """Per-endpoint latencies, query counts and statuses, shared by the worker threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def request(self, name, client, path, data=None, expect=200):
+        start = time.perf_counter()
+        try:
+            with CaptureQueriesContext(connection) as context:
+                response = client.post(path, data, format='json')
+            status = response.status_code
+        except Exception as exc:
+            response, status = None, type(exc).__name__
+        elapsed = (time.perf_counter() - start) * 1000
+        with self.lock:
+            self.statuses[name][status] += 1
+            if status == expect:
+                self.latencies[name].append(elapsed)
+                self.queries[name].append(len(context.captured_queries))
+        if status != expect:
+            raise StepFailed(f'{name}: {status}')
+        return response.json()
+
+    def report(self, seconds):
+        endpoints = {}
+        for name in STEPS:
+            queries = self.queries[name]
+            endpoints[name] = {
+                'requests': sum(self.statuses[name].values()),
+                'per_second': round(len(self.latencies[name]) / seconds, 1) if seconds else None,
+                **latency_summary(self.latencies[name]),
+                'queries_mean': round(sum(queries) / len(queries), 2) if queries else None,
+                'queries_max': max(queries, default=None),
+                'statuses': {str(status): count for status, count in self.statuses[name].items()},
+            }
+        return endpoints
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the full order lifecycle (register, login, order, accept, process_payment, "
+        "auto_assign, mark_in_transit, mark_completed) through the DRF test client from concurrent "
+        "threads on top of seeded background data, and report throughput, p50/p95/p99 latency and "
+        "query counts per endpoint. Writes to the configured database and removes its rows afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workflows', type=int, default=200, help='Customers registered, each placing --orders-per-customer orders')
+        parser.add_argument('--orders-per-customer', type=int, default=1)
+        parser.add_argument('--concurrency', type=int, default=4, help='Worker threads, each with its own clients')
+        parser.add_argument('--makers', type=int, default=10)
+        parser.add_argument('--products', type=int, default=10, help='Products per maker')
+        parser.add_argument('--customers', type=int, default=1000, help='Background customers seeded in bulk')
+        parser.add_argument('--orders', type=int, default=10000, help='Background orders seeded in bulk')
+        parser.add_argument('--fast-passwords', action='store_true',
+                            help='Hash passwords with MD5 so register/login measure the API, not PBKDF2')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=PREFIX).exists():
+            raise CommandError(f"Found leftover '{PREFIX}' users; delete them before benchmarking.")
+        hashers = ['django.contrib.auth.hashers.MD5PasswordHasher'] if options['fast_passwords'] else None
+        try:
+            makers, products, partners = self.seed(options)
+            with override_settings(**({'PASSWORD_HASHERS': hashers} if hashers else {})):
+                report = self.run(makers, products, partners, options)
+        finally:
+            dispatcher.flush()
+            User.objects.filter(username__startswith=PREFIX).delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(
+            f"{report['workflows_completed']}/{report['workflows']} workflows in {report['seconds']}s "
+            f"({report['workflows_per_second']}/s, {report['requests_per_second']} req/s) "
+            f"at concurrency {report['concurrency']} on {report['database']}"
+        )
+        for name, result in report['endpoints'].items():
+            self.stdout.write(
+                f"  {name:27} p50={result.get('p50_ms')}ms p95={result.get('p95_ms')}ms "
+                f"p99={result.get('p99_ms')}ms queries={result['queries_mean']} statuses {result['statuses']}"
+            )
+
+    def seed(self, options):
+        workflows = options['workflows'] * options['orders_per_customer']
+        customers = seed_users('customer', options['customers'], prefix=f'{PREFIX}_customer')
+        makers = seed_users('maker', options['makers'], prefix=f'{PREFIX}_maker')
+        # One partner per order, as completing a delivery does not free its partner
+        partners = seed_users('delivery_partner', workflows, prefix=f'{PREFIX}_partner')
+        User.objects.filter(pk__in=[partner.pk for partner in partners]).update(is_available=True)
+        products = seed_products(makers, options['products'])
+        seed_orders(customers, products, options['orders'])
+        # bulk_create skips the rollup signals, so record the rows explicitly
+        # to keep the rollups exact once the cleanup deletes them again
+        rollups.record_created(customers + makers + partners + list(Order.objects.filter(customer__in=customers)))
+        return makers, products, partners
+
+    def run(self, makers, products, partners, options):
+        recorder = Recorder()
+        partner_tokens = {partner.username: str(AccessToken.for_user(partner)) for partner in partners}
+        maker_tokens = {maker.id: str(AccessToken.for_user(maker)) for maker in makers}
+        completed = []
+
+        def client(token=None):
+            # The test client's default host is not in ALLOWED_HOSTS outside the test runner
+            api = APIClient(SERVER_NAME='localhost')
+            if token:
+                api.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+            return api
+
+        def workflow(number):
+            username = f'{PREFIX}_new_{number}'
+            customer = client()
+            recorder.request('auth.register', customer, '/api/auth/register/', {
+                'username': username, 'email': f'{username}@example.com',
+                'password': PASSWORD, 'password2': PASSWORD, 'role': 'customer',
+            }, expect=201)
+            tokens = recorder.request('auth.login', customer, '/api/auth/login/', {'username': username, 'password': PASSWORD})
+            customer.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+            for i in range(options['orders_per_customer']):
+                product = products[(number + i) % len(products)]
+                maker = client(maker_tokens[product.maker_id])
+                order = recorder.request('orders.create', customer, '/api/orders/', {'product': product.id, 'quantity': 1}, expect=201)
+                recorder.request('orders.accept', maker, f"/api/orders/{order['id']}/accept/")
+                # Orders do not expose their payment; looked up outside the measurements.
+                # Paying moves the order to 'paid' itself, so mark_paid would be refused
+                payment_id = Order.objects.values_list('payment', flat=True).get(pk=order['id'])
+                recorder.request('payments.process_payment', customer, f'/api/payments/{payment_id}/process_payment/')
+                assigned = recorder.request('deliveries.auto_assign', maker, '/api/deliveries/auto_assign/', {'order_id': order['id']})
+                partner = client(partner_tokens[assigned['partner']])
+                recorder.request('deliveries.mark_in_transit', partner, f"/api/deliveries/{assigned['delivery_id']}/mark_in_transit/")
+                recorder.request('deliveries.mark_completed', partner, f"/api/deliveries/{assigned['delivery_id']}/mark_completed/")
+            completed.append(number)
+
+        def work(worker):
+            try:
+                for number in range(worker, options['workflows'], options['concurrency']):
+                    try:
+                        workflow(number)
+                    except StepFailed:
+                        pass
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work, args=(worker,)) for worker in range(options['concurrency'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - start
+
+        requests = sum(sum(statuses.values()) for statuses in recorder.statuses.values())
+        return {
+            'database': connection.vendor,
+            'concurrency': options['concurrency'],
+            'workflows': options['workflows'],
+            'workflows_completed': len(completed),
+            'orders_per_customer': options['orders_per_customer'],
+            'background': {'customers': options['customers'], 'orders': options['orders'],
+                           'makers': len(makers), 'products': len(products)},
+            'seconds': round(seconds, 3),
+            'workflows_per_second': round(len(completed) / seconds, 1),
+            'requests_per_second': round(requests / seconds, 1),
+            'endpoints': recorder.report(seconds),
+        }
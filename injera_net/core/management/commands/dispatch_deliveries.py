@@ -0,0 +1,44 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.dispatch import BatchDispatcher
+from core.notifications import dispatcher
+
+
+class Command(BaseCommand):
+    help = (
+        "Assign delivery partners to paid orders in batches, minimising the total "
+        "pickup distance. Runs one batch with --once, otherwise one every --window seconds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window', type=float, default=30, help='Seconds between batches')
+        parser.add_argument('--once', action='store_true', help='Run a single batch and exit')
+        parser.add_argument('--max-orders', type=int, default=500)
+        parser.add_argument('--max-partners', type=int, default=2000)
+        parser.add_argument('--json', action='store_true', help='Print each report as JSON')
+
+    def handle(self, *args, **options):
+        batch = BatchDispatcher(max_orders=options['max_orders'], max_partners=options['max_partners'])
+        try:
+            while True:
+                self.report(batch.dispatch(), options['json'])
+                if options['once']:
+                    return
+                time.sleep(options['window'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            dispatcher.flush()
+
+    def report(self, report, as_json):
+        if as_json:
+            self.stdout.write(json.dumps(report))
+            return
+        self.stdout.write(
+            f"{report['assigned']}/{report['orders']} orders assigned to {report['partners']} available partners, "
+            f"total distance {report['total_cost_km']} km, solved in {report['solve_ms']} ms"
+            + (f", {report['lost_to_other_workers']} partners taken meanwhile" if report['lost_to_other_workers'] else '')
+        )
@@ -0,0 +1,37 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core import bulk_io
+
+
+class Command(BaseCommand):
+    help = (
+        "Write products or inventory items as CSV or JSONL, streamed from the database in constant "
+        "memory. The file can be edited and imported again with import_rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', choices=sorted(bulk_io.TABLES))
+        parser.add_argument('--output', default='-', help="File to write, '-' (default) for standard output")
+        parser.add_argument('--format', choices=bulk_io.FORMATS, default='csv')
+        parser.add_argument('--owner', help='Only the rows of this username')
+        parser.add_argument('--chunk-size', type=int, default=bulk_io.CHUNK_SIZE, help='Rows fetched per query')
+
+    def handle(self, *args, **options):
+        table = bulk_io.TABLES[options['table']]
+        queryset = table.model.objects.all()
+        if options['owner']:
+            try:
+                owner = get_user_model().objects.get(username=options['owner'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No user {options['owner']}")
+            queryset = queryset.filter(**{table.owner_field: owner})
+
+        rows = bulk_io.export_rows(queryset, table, options['format'], options['chunk_size'])
+        if options['output'] == '-':
+            for text in rows:
+                self.stdout.write(text, ending='')
+            return
+        with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+            for text in rows:
+                output.write(text)
@@ -0,0 +1,55 @@
+import json
+import sys
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core import bulk_io
+
+
+class Command(BaseCommand):
+    help = (
+        "Create and update a user's products or inventory items from a CSV or JSONL file, read "
+        "incrementally and written in chunks. Rows with an id update that row, others are created."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', choices=sorted(bulk_io.TABLES))
+        parser.add_argument('path', help="CSV or JSONL file, '-' for standard input")
+        parser.add_argument('--owner', required=True, help='Username of the maker or supplier owning the rows')
+        parser.add_argument('--format', choices=bulk_io.FORMATS, help='Default: from the file extension')
+        parser.add_argument('--chunk-size', type=int, default=bulk_io.CHUNK_SIZE, help='Rows validated and written together')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        try:
+            owner = get_user_model().objects.get(username=options['owner'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"No user {options['owner']}")
+        file_format = options['format'] or Path(options['path']).suffix.lstrip('.').lower()
+        if file_format not in bulk_io.FORMATS:
+            raise CommandError(f"Pass --format, the file extension is not one of {', '.join(bulk_io.FORMATS)}")
+
+        importer = bulk_io.Importer(bulk_io.TABLES[options['table']], owner, options['chunk_size'])
+        source = sys.stdin.buffer if options['path'] == '-' else open(options['path'], 'rb')
+        try:
+            importer.run(bulk_io.read_records(bulk_io.decoded(source), file_format))
+        except ValueError as exc:
+            self.report(importer.report, options['json'])
+            raise CommandError(str(exc))
+        finally:
+            if source is not sys.stdin.buffer:
+                source.close()
+        self.report(importer.report, options['json'])
+
+    def report(self, report, as_json):
+        if as_json:
+            self.stdout.write(json.dumps(report))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Read {report['rows']} rows: {report['created']} created, {report['updated']} updated, "
+            f"{report['failed']} failed"
+        ))
+        for error in report['errors']:
+            self.stdout.write(f"  line {error['line']}: {error['error']}")
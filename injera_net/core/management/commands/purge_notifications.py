@@ -0,0 +1,55 @@
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import retention
+
+
+class Command(BaseCommand):
+    help = (
+        "Archive and delete read notifications older than NOTIFICATION_RETENTION_DAYS, in small "
+        "transactions. Runs once with --once, otherwise every --interval seconds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, help='Retention in days (default: NOTIFICATION_RETENTION_DAYS)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0.05, help='Seconds to yield to other writers between chunks')
+        parser.add_argument('--limit', type=int, help='Stop after this many rows per run')
+        parser.add_argument('--archive-dir', help='Where to write archives (default: NOTIFICATION_ARCHIVE_DIR)')
+        parser.add_argument('--no-archive', action='store_true', help='Delete without archiving')
+        parser.add_argument('--once', action='store_true', help='Run a single purge and exit')
+        parser.add_argument('--interval', type=float, default=3600, help='Seconds between purges')
+        parser.add_argument('--json', action='store_true', help='Print each report as JSON')
+
+    def handle(self, *args, **options):
+        archive_dir = None
+        if not options['no_archive']:
+            archive_dir = options['archive_dir'] or getattr(settings, 'NOTIFICATION_ARCHIVE_DIR', None)
+        try:
+            while True:
+                report = retention.purge_read_notifications(
+                    before=retention.cutoff(options['days']),
+                    chunk_size=options['chunk_size'],
+                    archive_dir=archive_dir,
+                    pause=options['pause'],
+                    limit=options['limit'],
+                )
+                self.report(report, options['json'])
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+    def report(self, report, as_json):
+        if as_json:
+            self.stdout.write(json.dumps(report))
+            return
+        self.stdout.write(
+            f"Deleted {report['deleted']} read notifications created before {report['cutoff']} "
+            f"in {report['chunks']} chunks ({report['seconds']}s)"
+            + (f", archived to {report['archive']}" if report['archive'] else '')
+        )
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core import search
+
+
+class Command(BaseCommand):
+    help = "Repopulate the product search index from the products, e.g. after rows were bulk-inserted."
+
+    def handle(self, *args, **options):
+        count = search.get_backend().rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} products"))
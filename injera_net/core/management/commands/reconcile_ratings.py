@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+
+from core.models import Product
+from core.ratings import actual_ratings, adjust_ratings
+
+
+class Command(BaseCommand):
+    help = "Find products whose denormalized rating count or sum has drifted from their reviews and correct it."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report drifted ratings')
+
+    def handle(self, *args, **options):
+        drifted = list(
+            Product.objects.annotate(**actual_ratings())
+            .filter(~Q(rating_count=F('actual_count')) | ~Q(rating_sum=F('actual_sum')))
+            .order_by('pk').values_list('pk', 'name', 'rating_count', 'rating_sum', 'actual_count', 'actual_sum')
+        )
+        for pk, name, count, total, actual_count, actual_sum in drifted:
+            self.stdout.write(f"{name} (#{pk}): stored {count} ratings summing {total}, actual {actual_count} summing {actual_sum}")
+        if options['dry_run']:
+            self.stdout.write(f"{len(drifted)} drifted ratings")
+            return
+
+        with transaction.atomic():
+            # Re-read under lock: reviews saved since the scan have moved the counters already
+            products = Product.objects.select_for_update().filter(pk__in=[pk for pk, *_ in drifted])
+            rows = products.annotate(**actual_ratings()).values_list('pk', 'rating_count', 'rating_sum', 'actual_count', 'actual_sum')
+            adjust_ratings({pk: (actual_count - count, actual_sum - total) for pk, count, total, actual_count, actual_sum in rows})
+        self.stdout.write(self.style.SUCCESS(f"Corrected {len(drifted)} drifted ratings"))
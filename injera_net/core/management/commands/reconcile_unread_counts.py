@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from core.models import User
+from core.notifications import actual_unread_count, recount_unread
+
+
+class Command(BaseCommand):
+    help = "Find users whose denormalized unread notification count has drifted and recompute it."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--dry-run', action='store_true', help='Only report drifted counters')
+
+    def handle(self, *args, **options):
+        drifted = list(
+            User.objects.annotate(actual=actual_unread_count())
+            .exclude(unread_notifications=F('actual'))
+            .order_by('pk').values_list('pk', 'username', 'unread_notifications', 'actual')
+        )
+        for pk, username, stored, actual in drifted:
+            self.stdout.write(f"{username} (#{pk}): stored {stored}, actual {actual}")
+        if options['dry_run']:
+            self.stdout.write(f"{len(drifted)} drifted counters")
+            return
+
+        chunk_size = options['chunk_size']
+        ids = [pk for pk, *_ in drifted]
+        fixed = sum(recount_unread(ids[i:i + chunk_size]) for i in range(0, len(ids), chunk_size))
+        self.stdout.write(self.style.SUCCESS(f"Recounted {fixed} drifted counters"))
@@ -0,0 +1,264 @@
+"""
+In-process request metrics.
+
+RequestMetricsMiddleware (on when REQUEST_METRICS is True) measures every
+request: wall time, number of database queries and time spent in them, and
+the time spent serializing the response body. The figures go into
+per-view histograms held in memory by each process and exposed in the
+Prometheus text format at /api/metrics/ (admin only).
+
+Queries are counted by a database execute wrapper installed on every
+connection. It only does work while a request is being measured, and the
+current request's figures travel in a context variable, so queries the
+async views run in worker threads are counted too.
+
+Requests over REQUEST_METRICS_SLOW_MS milliseconds or REQUEST_METRICS_MAX_QUERIES
+queries are logged to the `core.metrics` logger with their SQL.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'injera_request'
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+# Statements kept for the slow request log
+MAX_LOGGED_QUERIES = 50
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestStats:
+    """What one request spent; mutated by the execute wrapper and serialization()"""
+    __slots__ = ('queries', 'db_seconds', 'serialization_seconds', 'statements')
+
+    def __init__(self, keep_statements=False):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serialization_seconds = 0.0
+        self.statements = [] if keep_statements else None
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper: times the query for the request being measured, if any"""
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        stats.queries += 1
+        stats.db_seconds += elapsed
+        if stats.statements is not None and len(stats.statements) < MAX_LOGGED_QUERIES:
+            stats.statements.append((elapsed, sql))
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    # The wrapper list outlives reconnects, so only add it once
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def serialization():
+    """Count the block as serialization time of the request being measured"""
+    stats = _current.get()
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serialization_seconds += time.perf_counter() - start
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """(upper bound, cumulative count) pairs, ending with +Inf"""
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+class ViewMetrics:
+    __slots__ = ('duration', 'queries', 'db', 'serialization', 'statuses')
+
+    def __init__(self):
+        self.duration = Histogram(SECONDS_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.db = Histogram(SECONDS_BUCKETS)
+        self.serialization = Histogram(SECONDS_BUCKETS)
+        self.statuses = {}
+
+
+# (name, help, ViewMetrics attribute) of the exposed histograms
+HISTOGRAMS = (
+    (f'{PREFIX}_duration_seconds', 'Wall time of requests', 'duration'),
+    (f'{PREFIX}_queries', 'Database queries per request', 'queries'),
+    (f'{PREFIX}_db_duration_seconds', 'Time per request spent in database queries', 'db'),
+    (f'{PREFIX}_serialization_duration_seconds', 'Time per request spent rendering the response body', 'serialization'),
+)
+
+
+class Registry:
+    """Per (view, method) metrics of this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def observe(self, view, method, status, seconds, stats):
+        with self._lock:
+            metrics = self._views.get((view, method))
+            if metrics is None:
+                metrics = self._views[(view, method)] = ViewMetrics()
+            metrics.duration.observe(seconds)
+            metrics.queries.observe(stats.queries)
+            metrics.db.observe(stats.db_seconds)
+            metrics.serialization.observe(stats.serialization_seconds)
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._views = {}
+
+    def exposition(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            views = sorted(self._views.items())
+            lines = [
+                f'# HELP {PREFIX}s_total Requests by view, method and status',
+                f'# TYPE {PREFIX}s_total counter',
+            ]
+            for (view, method), metrics in views:
+                for status, count in sorted(metrics.statuses.items()):
+                    lines.append(f'{PREFIX}s_total{{{_labels(view, method)},status="{status}"}} {count}')
+            for name, help_text, attribute in HISTOGRAMS:
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for (view, method), metrics in views:
+                    histogram = getattr(metrics, attribute)
+                    labels = _labels(view, method)
+                    for bound, total in histogram.cumulative():
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+                    lines.append(f'{name}_sum{{{labels}}} {histogram.sum:.6g}')
+                    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(view, method):
+    view = view.replace('\\', '\\\\').replace('"', '\\"')
+    return f'view="{view}",method="{method}"'
+
+
+registry = Registry()
+
+
+def view_name(request):
+    """The URL name of the matched view (its dotted path if unnamed); 'unmatched' for 404s"""
+    match = getattr(request, 'resolver_match', None)
+    return 'unmatched' if match is None else match.view_name
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_METRICS', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_seconds = getattr(settings, 'REQUEST_METRICS_SLOW_MS', None)
+        if self.slow_seconds is not None:
+            self.slow_seconds /= 1000
+        self.max_queries = getattr(settings, 'REQUEST_METRICS_MAX_QUERIES', None)
+        self.keep_statements = self.slow_seconds is not None or self.max_queries is not None
+        # Connections opened before this module was imported missed connection_created
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(None, connection)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            # A sync hook would cost the async handler a thread hop per response
+            self.process_template_response = self._aprocess_template_response
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self._acall(request)
+        stats = RequestStats(self.keep_statements)
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, time.perf_counter() - start, stats)
+        return response
+
+    async def _acall(self, request):
+        stats = RequestStats(self.keep_statements)
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, time.perf_counter() - start, stats)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns; time the rendering
+        stats = _current.get()
+        if stats is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                stats.serialization_seconds += time.perf_counter() - start
+            response.add_post_render_callback(rendered)
+        return response
+
+    async def _aprocess_template_response(self, request, response):
+        return RequestMetricsMiddleware.process_template_response(self, request, response)
+
+    def record(self, request, response, seconds, stats):
+        view = view_name(request)
+        registry.observe(view, request.method, response.status_code, seconds, stats)
+        if (
+            (self.slow_seconds is not None and seconds > self.slow_seconds)
+            or (self.max_queries is not None and stats.queries > self.max_queries)
+        ):
+            logger.warning(
+                "Slow request %s %s (%s): %.1f ms, %d queries in %.1f ms, serialization %.1f ms\n%s",
+                request.method, request.path, view, seconds * 1000, stats.queries,
+                stats.db_seconds * 1000, stats.serialization_seconds * 1000,
+                '\n'.join(f'  {elapsed * 1000:8.2f} ms  {sql}' for elapsed, sql in stats.statements),
+            )
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.7 on 2026-10-18 14:15
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_hot_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyticsRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('platform', 'Platform'), ('maker', 'Maker'), ('product', 'Product'), ('customer', 'Customer'), ('delivery_partner', 'Delivery Partner')], max_length=20)),
+                ('key', models.BigIntegerField(default=0)),
+                ('day', models.DateField(default=datetime.date(1, 1, 1))),
+                ('parent_key', models.BigIntegerField(default=0)),
+                ('label', models.CharField(blank=True, max_length=100)),
+                ('users', models.IntegerField(default=0)),
+                ('orders', models.IntegerField(default=0)),
+                ('order_value', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('pending_orders', models.IntegerField(default=0)),
+                ('delivered_orders', models.IntegerField(default=0)),
+                ('delivered_revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('paid_revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('deliveries', models.IntegerField(default=0)),
+                ('completed_deliveries', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['scope', 'parent_key', '-orders'], name='rollup_top_products_idx')],
+                'constraints': [models.UniqueConstraint(fields=('scope', 'key', 'day'), name='rollup_bucket_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-18 14:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_notification_retention_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='analyticsrollup',
+            name='rollup_top_products_idx',
+        ),
+        migrations.AddIndex(
+            model_name='analyticsrollup',
+            index=models.Index(fields=['scope', 'parent_key', 'day'], name='rollup_maker_products_idx'),
+        ),
+    ]
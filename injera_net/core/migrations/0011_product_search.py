@@ -0,0 +1,65 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+import core.models
+
+# Term prefixes of 2 and 3 characters are indexed too, so the short prefixes
+# of search-as-you-type queries don't scan the whole vocabulary
+CREATE_INDEX = [
+    """CREATE VIRTUAL TABLE core_product_search USING fts5(
+        name, description, maker, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )""",
+    # Terms of the index, for typo correction
+    "CREATE VIRTUAL TABLE core_product_search_vocab USING fts5vocab(core_product_search, row)",
+    # bm25 column weights of the `rank` column: name, description, maker
+    "INSERT INTO core_product_search(core_product_search, rank) VALUES ('rank', 'bm25(10.0, 1.0, 4.0)')",
+    """INSERT INTO core_product_search(rowid, name, description, maker)
+        SELECT p.id, p.name, p.description, u.username
+        FROM core_product p JOIN core_user u ON u.id = p.maker_id""",
+]
+
+
+def create_index(apps, schema_editor):
+    # Other databases use the 'database' search backend, which needs no index
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if not cursor.fetchone()[0]:
+            return
+        for statement in CREATE_INDEX:
+            cursor.execute(statement)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS core_product_search_vocab")
+            cursor.execute("DROP TABLE IF EXISTS core_product_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_rollup_day_buckets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchEntry',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='core.product')),
+                ('name', models.TextField()),
+                ('description', models.TextField()),
+                ('maker', models.TextField()),
+                ('document', core.models.FullTextField(db_column='core_product_search')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'core_product_search',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -1,7 +1,62 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
 from django.utils import timezone
+from datetime import date
+
+from .transitions import StateMachine, TransitionRefused
+from .ratings import adjust_ratings
+from .notifications import dispatch_notification, dispatch_notifications, adjust_unread_counts
+
+
+class LoadedStateMixin:
+    """Remembers the values of `tracked_fields` as they were loaded from the database"""
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_state = instance.tracked_state()
+        return instance
+
+    def tracked_state(self):
+        # Deferred fields are absent from __dict__ and stay untracked
+        return {name: self.__dict__[name] for name in self.tracked_fields if name in self.__dict__}
+
+
+def _restore(instance, status, loaded):
+    """Undo in memory the transitions of a rolled back transaction: `status` and `_loaded_state` as they were"""
+    instance.status = status
+    if loaded is not None:
+        instance._loaded_state = loaded
+
+
+class StoredStateMixin(LoadedStateMixin):
+    """
+    LoadedStateMixin whose save() first re-reads the tracked fields from the
+    row, locked until the save commits. Handlers diffing against
+    `_loaded_state` (core.rollups) then see what the row held, not what a
+    stale instance loaded, so two instances saving the same change count it once.
+    """
+
+    def lock(self):
+        """Lock the row until the transaction ends and take its stored tracked fields, in place"""
+        stored = type(self)._base_manager.select_for_update().filter(pk=self.pk).values(*self.tracked_fields).get()
+        self.__dict__.update(stored)
+        self._loaded_state = stored
+
+    def save(self, *args, **kwargs):
+        if self._state.adding or self.pk is None:
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            stored = (
+                type(self)._base_manager.select_for_update().filter(pk=self.pk)
+                .values(*self.tracked_fields).first()
+            )
+            if stored is not None:
+                self._loaded_state = stored
+            return super().save(*args, **kwargs)
 
 # USER MODEL
 
@@ -20,6 +75,16 @@ class User(AbstractUser):
     
     is_available = models.BooleanField(default=True)
     current_location = models.CharField(max_length=100, blank=True)  # Simulated location
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    # Denormalized count of unread notifications, maintained by Notification and core.notifications
+    unread_notifications = models.PositiveIntegerField(default=0)
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Partner assignment only ever looks for available users of a role
+            models.Index(fields=['role'], condition=models.Q(is_available=True), name='user_available_role_idx'),
+        ]
     
     def get_available_delivery_partners(self):
         """Get available delivery partners for assignment"""
@@ -44,14 +109,97 @@ class Product(models.Model):
     stock = models.PositiveIntegerField(default=0)
     available = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Maintained by core.ratings as reviews come and go
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_average = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='product_created_id_idx'),
+            models.Index(fields=['-rating_average', '-rating_count', '-id'], name='product_rating_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} - {self.maker.username}"
 
+    @classmethod
+    def reserve_stock(cls, product_id, quantity):
+        """Take `quantity` units in one conditional UPDATE; raises OutOfStock if there aren't enough"""
+        # The WHERE clause makes the check and the decrement atomic, so
+        # concurrent orders can never push stock below zero
+        if not cls.objects.filter(
+            pk=product_id, available=True, stock__gte=quantity
+        ).update(stock=F('stock') - quantity):
+            raise OutOfStock(product_id)
+        cls.stock_changed(product_id)
+
+    @classmethod
+    def release_stock(cls, product_id, quantity):
+        """Give back units reserved by a cancelled order"""
+        cls.objects.filter(pk=product_id).update(stock=F('stock') + quantity)
+        cls.stock_changed(product_id)
+
+    @classmethod
+    def release_stocks(cls, quantities):
+        """Give back {product_id: quantity} reserved by several cancelled orders"""
+        for product_id in sorted(quantities):
+            cls.objects.filter(pk=product_id).update(stock=F('stock') + quantities[product_id])
+        from .catalog_cache import products_changed
+        products_changed(list(quantities))
+
+    @classmethod
+    def stock_changed(cls, product_id):
+        # Queryset updates send no post_save, so invalidate the catalog cache here
+        from .catalog_cache import products_changed
+        products_changed([product_id])
+
+
+# PRODUCT SEARCH INDEX MODEL
+
+class FullTextField(models.TextField):
+    """The hidden column named after an FTS5 table; `<field>__match=<query>` runs a full-text query"""
+
+
+@FullTextField.register_lookup
+class FullTextMatch(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', [*lhs_params, *rhs_params]
+
+
+class ProductSearchEntry(models.Model):
+    """A product's row in the SQLite FTS5 index; written by core.search, never saved directly"""
+    product = models.OneToOneField(
+        Product,
+        primary_key=True,
+        db_column='rowid',
+        on_delete=models.DO_NOTHING,
+        related_name='search_entry'
+    )
+    name = models.TextField()
+    description = models.TextField()
+    maker = models.TextField()  # the maker's username
+    document = FullTextField(db_column='core_product_search')
+    rank = models.FloatField()  # bm25 relevance of the current match, lower is better
+
+    class Meta:
+        managed = False
+        db_table = 'core_product_search'
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_id):
+        super().__init__(f"Product #{product_id} is out of stock")
+        self.product_id = product_id
+
 
 # ORDER MODEL
 
-class Order(models.Model):
+class Order(StoredStateMixin, models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
         ('accepted', 'Accepted'),
@@ -60,17 +208,40 @@ class Order(models.Model):
         ('delivered', 'Delivered'),
         ('cancelled', 'Cancelled'),
     ]
+    tracked_fields = ('status', 'total_price', 'customer_id', 'product_id', 'quantity', 'created_at')
+    transitions = StateMachine(
+        accept=(['pending'], 'accepted'),
+        mark_paid=(['accepted'], 'paid'),
+        pay=(['pending', 'accepted'], 'paid'),
+        assign=(['pending', 'accepted', 'paid', 'in_delivery'], 'in_delivery'),
+        # Orders the assignment engine dispatched stay 'paid' until delivered
+        deliver=(['paid', 'in_delivery'], 'delivered'),
+        cancel=(['pending', 'accepted'], 'cancelled'),
+        refund=(['pending', 'accepted', 'paid', 'in_delivery', 'delivered'], 'cancelled'),
+    )
+    # Statuses whose goods have left the kitchen: cancelling them returns no stock
+    HANDED_OVER = ('delivered',)
     customer = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
         related_name='orders',
         limit_choices_to={'role': 'customer'}
     )
+    # Cart orders list their items in `lines`; product is then the first line's
+    # product and quantity the total number of units
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
+    line_count = models.PositiveIntegerField(default=0)  # 0 for single-product orders
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='order_created_id_idx'),
+            models.Index(fields=['status'], name='order_status_idx'),
+            models.Index(fields=['customer', 'created_at'], name='order_customer_created_idx'),
+        ]
 
     def __str__(self):
         return f"Order #{self.id} - {self.customer.username}"
@@ -88,133 +259,215 @@ class Order(models.Model):
         return payment
 
     def accept_order(self):
-        """Mark order as accepted by maker"""
-        if self.status == 'pending':
-            self.status = 'accepted'
-            self.save()
-            # Trigger notification
-            Notification.notify_order_accepted(self)
+        """Mark order as accepted by maker; False if it was no longer pending"""
+        if not Order.transitions.apply(self, 'accept'):
+            return False
+        Notification.notify_order_accepted(self)
+        return True
     
     def mark_delivered(self):
-        """Mark order as delivered"""
-        if self.status == 'in_delivery':
-            self.status = 'delivered'
-            self.save()
-            # Trigger notification
-            Notification.notify_order_delivered(self)
+        """Mark order as delivered; False if it was not out for delivery"""
+        if not Order.transitions.apply(self, 'deliver'):
+            return False
+        Notification.notify_order_delivered(self)
+        return True
 
     def save(self, *args, **kwargs):
-        """Override save to calculate total price automatically"""
-        if self.product and self.quantity:
+        """Price the order when it is created or its product or quantity change"""
+        # Status updates keep the agreed total instead of re-reading the product
+        loaded = getattr(self, '_loaded_state', None)
+        if self.product_id and self.quantity and not self.line_count and (
+            loaded is None
+            or loaded.get('product_id') != self.product_id
+            or loaded.get('quantity') != self.quantity
+        ):
             self.total_price = self.product.price * self.quantity
         super().save(*args, **kwargs)
 
     # ADDED MISSING METHODS WITH PROPER INDENTATION:
     def mark_paid(self):
-        """Mark order as paid"""
-        if self.status == 'accepted':
-            self.status = 'paid'
-            self.save()
-            # Auto-assign delivery
+        """Mark order as paid; False if it was not accepted"""
+        if not Order.transitions.apply(self, 'mark_paid'):
+            return False
+        # Auto-assign delivery, unless the batch dispatcher picks it up
+        if getattr(settings, 'DELIVERY_DISPATCH_MODE', 'immediate') != 'batch':
             Delivery.assign_optimal_delivery_partner(self)
+        return True
 
     def assign_for_delivery(self, delivery_partner):
-        """Assign delivery partner to order"""
-        delivery, created = Delivery.objects.get_or_create(
-            order=self,
-            defaults={'delivery_partner': delivery_partner}
-        )
-        if not created:
-            delivery.delivery_partner = delivery_partner
-            delivery.save()
-        
-        self.status = 'in_delivery'
-        self.save()
+        """Assign delivery partner to order; False if it is delivered or cancelled"""
+        if not Order.transitions.allows(self, 'assign'):
+            return False
+        with transaction.atomic():
+            delivery, created = Delivery.objects.get_or_create(
+                order=self,
+                defaults={'delivery_partner': delivery_partner}
+            )
+            if not created and delivery.delivery_partner_id != delivery_partner.id:
+                delivery.delivery_partner = delivery_partner
+                delivery.save(update_fields=['delivery_partner'])
+            if self.status == 'in_delivery':
+                return True
+            return Order.transitions.apply(self, 'assign')
 
     def cancel_order(self):
-        """Cancel order"""
-        if self.status in ['pending', 'accepted']:
-            self.status = 'cancelled'
-            self.save()
-            # Refund payment if exists
-            if hasattr(self, 'payment'):
-                self.payment.mark_failed()
+        """Cancel order; False if it was past acceptance, a concurrent call cancelled it first or it was paid meanwhile"""
+        status, loaded = self.status, getattr(self, '_loaded_state', None)
+        try:
+            with transaction.atomic():
+                if not self.release_reservation('cancel'):
+                    return False
+                # Fail its pending payment; one paid meanwhile needs a refund, not a cancel
+                payment = Payment.objects.select_for_update().filter(order_id=self.pk).first()
+                if payment is not None and not payment.mark_failed() and payment.status == 'paid':
+                    raise TransitionRefused(payment, 'fail')
+        except TransitionRefused:
+            # The cancel was rolled back with the transaction
+            _restore(self, status, loaded)
+            return False
+        return True
+
+    def release_reservation(self, transition):
+        """Cancel the order along `transition` and return its stock unless delivered; False if the order had moved on"""
+        source = self.status
+        with transaction.atomic():
+            # Only the caller that wins the status change gives the stock back
+            if not Order.transitions.apply(self, transition):
+                return False
+            if source in Order.HANDED_OVER:
+                return True
+            for product_id, quantity in self.stock_items():
+                Product.release_stock(product_id, quantity)
+        return True
+
+    def stock_items(self):
+        """(product_id, quantity) of everything this order reserved"""
+        if self.line_count:
+            return list(self.lines.values_list('product_id', 'quantity'))
+        return [(self.product_id, self.quantity)]
+
+
+# ORDER LINE MODEL
+
+class OrderLine(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='lines')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(default=1)
+    unit_price = models.DecimalField(max_digits=8, decimal_places=2)
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product.name} (Order #{self.order_id})"
+
+    @property
+    def line_total(self):
+        return self.unit_price * self.quantity
 
 
 # PAYMENT MODEL
 
-class Payment(models.Model):
+class Payment(StoredStateMixin, models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
         ('paid', 'Paid'),
         ('failed', 'Failed'),
         ('refunded', 'Refunded'),
     ]
+    tracked_fields = ('status', 'amount', 'created_at')
+    transitions = StateMachine(
+        pay=(['pending'], 'paid'),
+        fail=(['pending'], 'failed'),
+        refund=(['paid'], 'refunded'),
+    )
     order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='payment')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     amount = models.DecimalField(max_digits=8, decimal_places=2)
     transaction_id = models.CharField(max_length=50, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='payment_created_id_idx'),
+        ]
+
     def __str__(self):
         return f"Payment for Order #{self.order.id} - {self.status}"
     
     
     def process_payment(self):
-        """Process payment and update order status"""
-        if self.status == 'pending':
-            # Simulate payment processing
-            self.status = 'paid'
-            self.paid_at = timezone.now()
-            self.save()
-            
-            # Update order status
-            self.order.status = 'paid'
-            self.order.save()
-            
-            # Create notification
-            Notification.objects.create(
-                user=self.order.customer,
-                message=f"Payment for Order #{self.order.id} was successful!"
-            )
-            return True
-        return False
-    
+        """Process payment and update order status; False if it was not pending or its order was cancelled"""
+        status, loaded = self.status, getattr(self, '_loaded_state', None)
+        try:
+            with transaction.atomic():
+                # Lock the order before the payment, as cancel_order does, so the two can't deadlock
+                self.order.lock()
+                # Simulate payment processing
+                if not Payment.transitions.apply(self, 'pay'):
+                    return False
+                # An order marked paid or out for delivery already stays as it is
+                if self.order.status not in ('paid', 'in_delivery') and not Order.transitions.apply(self.order, 'pay'):
+                    raise TransitionRefused(self.order, 'pay')
+        except TransitionRefused:
+            # The payment was rolled back with the transaction
+            _restore(self, status, loaded)
+            return False
+
+        # Create notification
+        Notification.send(
+            user=self.order.customer,
+            message=f"Payment for Order #{self.order.id} was successful!"
+        )
+        return True
+
     def mark_failed(self):
-        """Mark payment as failed"""
-        if self.status == 'pending':
-            self.status = 'failed'
-            self.save()
-            
-            Notification.objects.create(
-                user=self.order.customer,
-                message=f"Payment for Order #{self.order.id} failed. Please try again."
-            )
+        """Mark payment as failed; False if it was not pending"""
+        if not Payment.transitions.apply(self, 'fail'):
+            return False
+        Notification.send(
+            user=self.order.customer,
+            message=f"Payment for Order #{self.order.id} failed. Please try again."
+        )
+        return True
     
     def process_refund(self):
-        """Process refund for order"""
-        if self.status == 'paid':
-            self.status = 'refunded'
-            self.save()
-            
-            # Update order status
-            self.order.status = 'cancelled'
-            self.order.save()
-            
-            Notification.objects.create(
-                user=self.order.customer,
-                message=f"Refund processed for Order #{self.order.id}"
-            )
+        """Process refund for order; False if it was not paid or its order could not be cancelled"""
+        status, loaded = self.status, getattr(self, '_loaded_state', None)
+        try:
+            with transaction.atomic():
+                # Re-read under lock, before the payment as in process_payment: a
+                # cached order may hold a status it has left
+                self.order.lock()
+                if not Payment.transitions.apply(self, 'refund'):
+                    return False
+                # Cancel the order and return its stock; one cancelled already gave it back
+                if self.order.status != 'cancelled' and not self.order.release_reservation('refund'):
+                    raise TransitionRefused(self.order, 'refund')
+        except TransitionRefused:
+            # The refund was rolled back with the transaction
+            _restore(self, status, loaded)
+            return False
+
+        Notification.send(
+            user=self.order.customer,
+            message=f"Refund processed for Order #{self.order.id}"
+        )
+        return True
 
 
 # DELIVERY MODEL
 
-class Delivery(models.Model):
+class Delivery(StoredStateMixin, models.Model):
     STATUS_CHOICES = [
         ('assigned', 'Assigned'),
         ('in_transit', 'In Transit'),
         ('completed', 'Completed'),
     ]
+    tracked_fields = ('status', 'delivery_partner_id', 'assigned_at')
+    transitions = StateMachine(
+        # Reassigning a delivery not yet completed restarts it
+        assign=(['assigned', 'in_transit'], 'assigned'),
+        start=(['assigned'], 'in_transit'),
+        complete=(['in_transit'], 'completed'),
+    )
     order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='delivery')
     delivery_partner = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -226,87 +479,65 @@ class Delivery(models.Model):
     assigned_at = models.DateTimeField(auto_now_add=True)
     delivered_at = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['assigned_at', 'id'], name='delivery_assigned_id_idx'),
+            models.Index(fields=['delivery_partner', 'status'], name='delivery_partner_status_idx'),
+            models.Index(fields=['delivery_partner', 'assigned_at'], name='delivery_partner_assigned_idx'),
+        ]
+
     def __str__(self):
         return f"Delivery #{self.id} - {self.status}"
     
     
     def assign_delivery_partner(self, delivery_partner):
-        """Assign a delivery partner to this delivery"""
-        if delivery_partner.role == 'delivery_partner':
-            self.delivery_partner = delivery_partner
-            self.status = 'assigned'
-            self.save()
-            
+        """Assign a delivery partner to this delivery; False if it is completed"""
+        if delivery_partner.role != 'delivery_partner':
+            return False
+        with transaction.atomic():
+            if not Delivery.transitions.apply(self, 'assign', delivery_partner=delivery_partner):
+                return False
             # Update associated order status
-            self.order.status = 'in_delivery'
-            self.order.save()
-            
-            # Create notification
-            Notification.objects.create(
-                user=delivery_partner,
-                message=f"You have been assigned to deliver Order #{self.order.id}"
-            )
+            Order.transitions.apply(self.order, 'assign')
+        
+        # Create notification
+        Notification.send(
+            user=delivery_partner,
+            message=f"You have been assigned to deliver Order #{self.order.id}"
+        )
+        return True
     
     def mark_in_transit(self):
-        """Mark delivery as in transit"""
-        if self.status == 'assigned':
-            self.status = 'in_transit'
-            self.save()
-            
-            Notification.objects.create(
-                user=self.order.customer,
-                message=f"Your order #{self.order.id} is out for delivery!"
-            )
+        """Mark delivery as in transit; False if it was not assigned"""
+        if not Delivery.transitions.apply(self, 'start'):
+            return False
+        Notification.send(
+            user=self.order.customer,
+            message=f"Your order #{self.order.id} is out for delivery!"
+        )
+        return True
     
     def mark_completed(self):
-        """Mark delivery as completed"""
-        if self.status == 'in_transit':
-            self.status = 'completed'
-            self.delivered_at = timezone.now()
-            self.save()
-            
+        """Mark delivery as completed; False if it was not in transit"""
+        with transaction.atomic():
+            if not Delivery.transitions.apply(self, 'complete', delivered_at=timezone.now()):
+                return False
             # Update order status
-            self.order.status = 'delivered'
-            self.order.save()
-            
-            Notification.objects.create(
-                user=self.order.customer,
-                message=f"Your order #{self.order.id} has been delivered!"
-            )
+            Order.transitions.apply(self.order, 'deliver')
+        
+        Notification.send(
+            user=self.order.customer,
+            message=f"Your order #{self.order.id} has been delivered!"
+        )
+        return True
 
     @classmethod
     def assign_optimal_delivery_partner(cls, order):
         """Automatically assign the best available delivery partner"""
-        available_partners = User.objects.filter(
-            role='delivery_partner',
-            is_available=True
-        )
-        
-        if available_partners.exists():
-            # Simple round-robin assignment (basic optimization)
-            partner = available_partners.first()
-            delivery = cls.objects.create(
-                order=order,
-                delivery_partner=partner,
-                status='assigned'
-            )
-            
-            # Mark partner as busy
-            partner.is_available = False
-            partner.save()
-            
-            # Create notifications
-            Notification.objects.create(
-                user=partner,
-                message=f"New delivery assigned: Order #{order.id}"
-            )
-            Notification.objects.create(
-                user=order.customer,
-                message=f"Delivery partner assigned to your order #{order.id}"
-            )
-            
-            return delivery
-        return None
+        # Imported here: the assignment engine itself builds on these models
+        from .assignment import get_engine
+        deliveries = get_engine().assign([order])
+        return deliveries[0] if deliveries else None
 
 
 # INVENTORY MODEL
@@ -342,7 +573,9 @@ class Inventory(models.Model):
 
 # NOTIFICATION MODEL
 
-class Notification(models.Model):
+class Notification(LoadedStateMixin, models.Model):
+    tracked_fields = ('is_read',)
+
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
@@ -352,13 +585,22 @@ class Notification(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='notif_user_created_id_idx'),
+            # Only unread rows are ever counted or bulk-updated
+            models.Index(fields=['user'], condition=models.Q(is_read=False), name='notif_user_unread_idx'),
+            # Retention purges read rows oldest first
+            models.Index(fields=['created_at', 'id'], condition=models.Q(is_read=True), name='notif_read_created_idx'),
+        ]
+
     def __str__(self):
         return f"Notification for {self.user.username}"
 
     @classmethod
     def notify_order_created(cls, order):
         """Notify maker when new order is created"""
-        cls.objects.create(
+        cls.send(
             user=order.product.maker,  # Fixed: order.maker -> order.product.maker
             message=f"You have a new order #{order.id} from {order.customer.username}"
         )
@@ -366,15 +608,20 @@ class Notification(models.Model):
     @classmethod
     def notify_order_accepted(cls, order):
         """Notify customer when order is accepted"""
-        cls.objects.create(
-            user=order.customer,
-            message=f"Your order #{order.id} has been accepted and is being prepared!"
+        cls.notify_orders_accepted([order])
+
+    @classmethod
+    def notify_orders_accepted(cls, orders):
+        """Notify the customers of accepted orders, in one batch"""
+        cls.send_many(
+            (order.customer_id, f"Your order #{order.id} has been accepted and is being prepared!")
+            for order in orders
         )
     
     @classmethod
     def notify_order_delivered(cls, order):
         """Notify customer when order is delivered"""
-        cls.objects.create(
+        cls.send(
             user=order.customer,
             message=f"Your order #{order.id} has been delivered. Enjoy your meal!"
         )
@@ -382,15 +629,51 @@ class Notification(models.Model):
     @classmethod
     def notify_low_stock(cls, inventory):
         """Notify maker when inventory is low"""
-        cls.objects.create(
+        cls.send(
             user=inventory.owner,
             message=f"Your {inventory.item_name} is running low! Current stock: {inventory.quantity}"
         )
 
+    @classmethod
+    def send(cls, user, message):
+        """Queue a notification; written in batches by core.notifications"""
+        dispatch_notification(user, message)
+
+    @classmethod
+    def send_many(cls, notifications):
+        """Queue (user, message) pairs; written together by core.notifications"""
+        dispatch_notifications(notifications)
+
+    def save(self, *args, **kwargs):
+        """Save, moving the owner's unread counter when the notification is created or (un)read"""
+        adding = self._state.adding
+        was_read = getattr(self, '_loaded_state', {}).get('is_read', self.is_read)
+        with transaction.atomic():
+            if not adding and was_read != self.is_read:
+                # Compare-and-set: of two concurrent saves only one moves the counter
+                if Notification.objects.filter(pk=self.pk, is_read=was_read).update(is_read=self.is_read):
+                    adjust_unread_counts({self.user_id: 1 if was_read else -1})
+            super().save(*args, **kwargs)
+            if adding and not self.is_read:
+                adjust_unread_counts({self.user_id: 1})
+        self._loaded_state = self.tracked_state()
+
     def mark_as_read(self):
         """Mark notification as read"""
         self.is_read = True
         self.save()
+        from .streams import unread_changed
+        unread_changed([self.user_id])
+
+    @classmethod
+    def mark_all_read(cls, user_id):
+        """Mark every unread notification of the user as read; returns how many were"""
+        with transaction.atomic():
+            marked = cls.objects.filter(user_id=user_id, is_read=False).update(is_read=True)
+            adjust_unread_counts({user_id: -marked})
+        from .streams import unread_changed
+        unread_changed([user_id])
+        return marked
 
 
 # REVIEW MODEL
@@ -407,5 +690,84 @@ class Review(models.Model):
     comment = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='review_created_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"Review by {self.customer.username} - {self.rating}/5"
+
+    def save(self, *args, **kwargs):
+        """Save, moving the product's rating count and sum along with the review"""
+        with transaction.atomic():
+            deltas = {}
+            if not self._state.adding:
+                # Read the stored rating under lock, so concurrent edits each move it once
+                old = Review.objects.select_for_update().filter(pk=self.pk).values('product_id', 'rating').first()
+                if old is not None:
+                    deltas[old['product_id']] = (-1, -old['rating'])
+            super().save(*args, **kwargs)
+            count, total = deltas.get(self.product_id, (0, 0))
+            deltas[self.product_id] = (count + 1, total + self.rating)
+            adjust_ratings(deltas)
+
+
+# ANALYTICS ROLLUP MODEL
+
+class AnalyticsRollup(models.Model):
+    """Pre-aggregated counters read by AnalyticsViewSet, maintained by core.rollups"""
+    SCOPE_CHOICES = [
+        ('platform', 'Platform'),
+        ('maker', 'Maker'),
+        ('product', 'Product'),
+        ('customer', 'Customer'),
+        ('delivery_partner', 'Delivery Partner'),
+    ]
+    # `day` of the all-time bucket; every other row holds a single day
+    ALL_TIME = date.min
+
+    scope = models.CharField(max_length=20, choices=SCOPE_CHOICES)
+    key = models.BigIntegerField(default=0)  # id of the user/product, 0 for platform
+    day = models.DateField(default=ALL_TIME)
+    parent_key = models.BigIntegerField(default=0)  # maker id of product rows
+    label = models.CharField(max_length=100, blank=True)  # product name of product rows
+
+    users = models.IntegerField(default=0)
+    orders = models.IntegerField(default=0)
+    order_value = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    pending_orders = models.IntegerField(default=0)
+    delivered_orders = models.IntegerField(default=0)
+    delivered_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    paid_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    deliveries = models.IntegerField(default=0)
+    completed_deliveries = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key', 'day'], name='rollup_bucket_unique'),
+        ]
+        indexes = [
+            # A maker's product buckets, all-time or over a range of days
+            models.Index(fields=['scope', 'parent_key', 'day'], name='rollup_maker_products_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} #{self.key} ({self.day})"
+
+
+# TOKEN REVOCATION MODEL
+
+class TokenRevocation(models.Model):
+    """
+    A revoked token or login session (`jti`), or, with an empty `jti`, every
+    token of `user` issued up to `created_at`. Kept until `expires_at`, when
+    the tokens it revokes have expired anyway. Read by core.revocation.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='token_revocations')
+    jti = models.CharField(max_length=255, blank=True, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    expires_at = models.DateTimeField(db_index=True)
+
     def __str__(self):
-        return f"Review by {self.customer.username} - {self.rating}/5"
\ No newline at end of file
+        return f"Revocation of {self.jti or 'all tokens'} of user #{self.user_id}"
@@ -0,0 +1,205 @@
+"""
+Batched, asynchronous notification writes.
+
+Workflow methods hand notifications to `dispatch_notification`, which queues
+them once the surrounding transaction commits. A background thread drains
+the queue and writes whole batches with a single bulk_create, so requests no
+longer pay for notification INSERTs. A batch whose write fails (a lock
+timeout, a dropped connection) is retried NOTIFICATION_WRITE_RETRIES times
+with a doubling delay before its notifications are given up on and logged.
+Pending notifications are flushed when the process exits. Set NOTIFICATION_DISPATCH_MODE = 'sync' to write inline
+(e.g. in tests or management scripts).
+
+Every user also carries a denormalized count of unread notifications
+(User.unread_notifications), so the unread badge is a primary-key lookup.
+All writes that create, read or delete notifications adjust it in the same
+transaction; `recount_unread` (and the reconcile_unread_counts command)
+recomputes it from the notifications themselves.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, OuterRef, Subquery, QuerySet
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationDispatcher:
+    def __init__(self, batch_size=500, flush_interval=0.5, retries=3, retry_delay=0.2):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._pending = []
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._closing = False
+
+    def enqueue(self, user_id, message):
+        self.enqueue_many([(user_id, message)])
+
+    def enqueue_many(self, notifications):
+        with self._condition:
+            self._pending.extend(notifications)
+            if self._thread is None or not self._thread.is_alive():
+                self._start()
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify()
+
+    def flush(self):
+        """Write everything queued so far from the calling thread"""
+        while True:
+            batch = self._take()
+            if not batch:
+                return
+            self._write(batch)
+
+    def shutdown(self, timeout=5):
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    def _start(self):
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name='notification-dispatcher', daemon=True)
+        self._thread.start()
+
+    def _take(self):
+        with self._condition:
+            batch = self._pending[:self.batch_size]
+            del self._pending[:self.batch_size]
+            return batch
+
+    def _run(self):
+        try:
+            while True:
+                with self._condition:
+                    if not self._pending and not self._closing:
+                        self._condition.wait(self.flush_interval)
+                    if self._closing:
+                        # shutdown() writes whatever is left
+                        return
+                self.flush()
+        finally:
+            connection.close()
+
+    def _write(self, batch):
+        Notification = apps.get_model('core', 'Notification')
+        # Coalesce identical notifications queued in the same batch
+        unique = dict.fromkeys(batch)
+        with self._write_lock:
+            for attempt in range(self.retries + 1):
+                rows = [Notification(user_id=user_id, message=message) for user_id, message in unique]
+                try:
+                    with transaction.atomic():
+                        Notification.objects.bulk_create(rows, batch_size=self.batch_size)
+                        # bulk_create bypasses Notification.save
+                        new_unread = defaultdict(int)
+                        for row in rows:
+                            new_unread[row.user_id] += 1
+                        adjust_unread_counts(new_unread)
+                    break
+                except Exception:
+                    if attempt == self.retries:
+                        logger.exception("Dropped %d notifications after %d attempts", len(rows), attempt + 1)
+                        return
+                    logger.warning("Writing %d notifications failed, retrying", len(rows), exc_info=True)
+                    if not connection.in_atomic_block:
+                        # Reconnect if the failure broke the connection
+                        connection.close_if_unusable_or_obsolete()
+                    time.sleep(self.retry_delay * 2 ** attempt)
+        # Imported here: core.streams pulls in DRF/JWT, which need the app registry
+        from .streams import publish_created
+        publish_created(rows)
+
+
+dispatcher = NotificationDispatcher(
+    batch_size=getattr(settings, 'NOTIFICATION_BATCH_SIZE', 500),
+    flush_interval=getattr(settings, 'NOTIFICATION_FLUSH_INTERVAL', 0.5),
+    retries=getattr(settings, 'NOTIFICATION_WRITE_RETRIES', 3),
+)
+atexit.register(dispatcher.shutdown)
+
+
+def dispatch_notification(user, message):
+    """Queue a notification for `user` (a user or user id), or write it right away in sync mode"""
+    user_id = getattr(user, 'pk', user)
+    if getattr(settings, 'NOTIFICATION_DISPATCH_MODE', 'async') == 'sync':
+        notification = apps.get_model('core', 'Notification').objects.create(user_id=user_id, message=message)
+        from .streams import publish_created
+        transaction.on_commit(lambda: publish_created([notification]))
+        return
+    transaction.on_commit(lambda: dispatcher.enqueue(user_id, message))
+
+
+def dispatch_notifications(notifications):
+    """Queue (user, message) pairs together, or write them with a single INSERT in sync mode"""
+    notifications = [(getattr(user, 'pk', user), message) for user, message in notifications]
+    if not notifications:
+        return
+    if getattr(settings, 'NOTIFICATION_DISPATCH_MODE', 'async') == 'sync':
+        Notification = apps.get_model('core', 'Notification')
+        with transaction.atomic():
+            rows = Notification.objects.bulk_create([
+                Notification(user_id=user_id, message=message) for user_id, message in notifications
+            ])
+            # bulk_create bypasses Notification.save
+            new_unread = defaultdict(int)
+            for user_id, _ in notifications:
+                new_unread[user_id] += 1
+            adjust_unread_counts(new_unread)
+        from .streams import publish_created
+        transaction.on_commit(lambda: publish_created(rows))
+        return
+    transaction.on_commit(lambda: dispatcher.enqueue_many(notifications))
+
+
+def adjust_unread_counts(deltas):
+    """Add {user_id: delta} to the users' unread counters, one UPDATE per distinct delta"""
+    by_delta = defaultdict(list)
+    for user_id, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(user_id)
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    for delta, user_ids in by_delta.items():
+        User.objects.filter(pk__in=user_ids).update(unread_notifications=F('unread_notifications') + delta)
+
+
+def actual_unread_count():
+    """Subquery counting the unread notifications of the outer user row"""
+    Notification = apps.get_model('core', 'Notification')
+    return Coalesce(Subquery(
+        Notification.objects.filter(user=OuterRef('pk'), is_read=False)
+        .order_by().values('user').annotate(n=Count('id')).values('n')
+    ), 0)
+
+
+def recount_unread(user_ids):
+    """Recompute the unread counters of `user_ids` from their notifications; returns the rows updated"""
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    with transaction.atomic():
+        # Lock the users first: writers bump the counter after inserting, so a
+        # writer that got here earlier has committed by the time we count
+        user_ids = list(User.objects.select_for_update().filter(pk__in=user_ids).values_list('pk', flat=True))
+        return User.objects.filter(pk__in=user_ids).update(unread_notifications=actual_unread_count())
+
+
+@receiver(post_delete, sender='core.Notification')
+def notification_deleted(sender, instance, origin=None, **kwargs):
+    # Deleting the user drops the counter along with the notifications
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if not instance.is_read and origin_model is not apps.get_model(settings.AUTH_USER_MODEL):
+        adjust_unread_counts({instance.user_id: -1})
@@ -0,0 +1,163 @@
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, Cursor, PageNumberPagination, _reverse_ordering
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Keyset pagination over a composite, unique ordering such as
+    ('-created_at', '-id').
+
+    DRF's CursorPagination only filters on the first ordering field and falls
+    back to OFFSET for ties. Here every field of the ordering is part of the
+    cursor, so each page is a single indexed range scan no matter how deep the
+    client pages, and rows inserted while paging never shift later pages.
+    Views can override the ordering with a `cursor_ordering` attribute.
+    """
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'PAGINATION_MAX_PAGE_SIZE', 200)
+    position_separator = '|'
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'cursor_ordering', self.ordering)
+        if isinstance(ordering, str):
+            return (ordering,)
+        return tuple(ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self._page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self._set_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset for async views, fetching the page with the async ORM"""
+        queryset = self._page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self._set_page([row async for row in queryset.aiterator(chunk_size=self.page_size + 1)])
+
+    def _page_queryset(self, queryset, request, view):
+        """The query for the requested page, plus one row to tell whether another page follows"""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            self.reverse, self.current_position = False, None
+        else:
+            self.reverse, self.current_position = self.cursor.reverse, self.cursor.position
+
+        if self.reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if self.current_position is not None:
+            values = self._decode_position(queryset.model, self.current_position)
+            queryset = queryset.filter(self._keyset_filter(values, self.reverse))
+
+        return queryset[:self.page_size + 1]
+
+    def _set_page(self, results):
+        reverse, current_position = self.reverse, self.current_position
+        self.page = results[:self.page_size]
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = current_position is not None
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = current_position is not None
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = self.next_position
+        if self.page:
+            position = self._get_position_from_instance(self.page[-1], self.ordering)
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = self.previous_position
+        if self.page:
+            position = self._get_position_from_instance(self.page[0], self.ordering)
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def _keyset_filter(self, values, reverse):
+        """Build the lexicographic `(a, b) < (x, y)` condition for the ordering"""
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            attr = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') != reverse else 'gt'
+            condition |= Q(**equal, **{f'{attr}__{lookup}': value})
+            equal[attr] = value
+        return condition
+
+    def _decode_position(self, model, position):
+        parts = position.split(self.position_separator)
+        if len(parts) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        values = []
+        try:
+            for field, part in zip(self.ordering, parts):
+                model_field = model._meta.get_field(field.lstrip('-'))
+                values.append(model_field.to_python(part))
+        except (FieldDoesNotExist, ValidationError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def _get_position_from_instance(self, instance, ordering):
+        parts = []
+        for field in ordering:
+            attr = field.lstrip('-')
+            value = instance[attr] if isinstance(instance, dict) else getattr(instance, attr)
+            parts.append(value.isoformat() if hasattr(value, 'isoformat') else str(value))
+        return self.position_separator.join(parts)
+
+
+class SearchPagination(PageNumberPagination):
+    """
+    Numbered pages for ranked results, whose order (relevance) has no unique
+    key to continue from. Adds the search facets next to the results.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'PAGINATION_MAX_PAGE_SIZE', 200)
+
+    def get_paginated_response(self, data, facets=None):
+        response = super().get_paginated_response(data)
+        if facets is not None:
+            response.data['facets'] = facets
+        return response
@@ -0,0 +1,125 @@
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+
+
+class QueryPlan:
+    """select_related / prefetch_related / only() arguments derived from a serializer"""
+
+    def __init__(self):
+        self.select_related = set()
+        self.prefetch_related = set()
+        self.columns = set()
+        # Cleared as soon as a field reads something we can't map to a column
+        self.restrict_columns = True
+
+    def add_column(self, path):
+        self.columns.add(path)
+
+    def apply(self, queryset, restrict_columns=False, extra_columns=()):
+        if self.select_related:
+            queryset = queryset.select_related(*sorted(self.select_related))
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*sorted(self.prefetch_related))
+        if restrict_columns and self.restrict_columns:
+            queryset = queryset.only(*sorted(self.columns | set(extra_columns)))
+        return queryset
+
+
+def _join(prefix, attr):
+    return f'{prefix}__{attr}' if prefix else attr
+
+
+def _follow(plan, model, attrs, prefix, descend):
+    """
+    Walk a dotted `source` path across model relations, recording the joins it
+    needs. Returns the (model, path) reached when `descend` is set and the
+    path ends on a to-one relation, otherwise None.
+    """
+    path = prefix
+    for index, attr in enumerate(attrs):
+        last = index == len(attrs) - 1
+        try:
+            field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            # Property, method or annotation: it may touch any column
+            plan.restrict_columns = False
+            return None
+        name = _join(path, attr)
+
+        if field.many_to_many or field.one_to_many:
+            plan.prefetch_related.add(name)
+            plan.restrict_columns = False
+            return None
+
+        if field.is_relation:
+            if field.concrete:
+                plan.add_column(name)
+            if last and not descend:
+                return None
+            plan.select_related.add(name)
+            model, path = field.related_model, name
+            continue
+
+        plan.add_column(name)
+        return None
+    return model, path
+
+
+def _walk(plan, serializer, model, prefix):
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+
+        if field.source == '*':
+            if isinstance(field, serializers.BaseSerializer):
+                _walk(plan, field, model, prefix)
+            else:
+                plan.restrict_columns = False
+            continue
+
+        attrs = field.source.split('.')
+        if isinstance(field, serializers.ListSerializer):
+            # To-many relations are prefetched by _follow
+            _follow(plan, model, attrs, prefix, descend=False)
+            plan.restrict_columns = False
+            continue
+
+        nested = isinstance(field, serializers.BaseSerializer)
+        reached = _follow(plan, model, attrs, prefix, descend=nested)
+        if nested and reached is not None:
+            _walk(plan, field, *reached)
+
+
+@lru_cache(maxsize=None)
+def build_query_plan(serializer_class, model):
+    """Derive (and cache) the query plan for rendering `model` rows with `serializer_class`"""
+    plan = QueryPlan()
+    _walk(plan, serializer_class(), model, '')
+    return plan
+
+
+def plan_queryset(queryset, serializer_class, restrict_columns=False, extra_columns=()):
+    """Apply the joins and column list `serializer_class` needs to `queryset`"""
+    plan = build_query_plan(serializer_class, queryset.model)
+    return plan.apply(queryset, restrict_columns, extra_columns)
+
+
+class QueryPlanMixin:
+    """
+    Plans a viewset's queryset from its serializer so nested `source=` paths
+    are fetched with joins instead of one query per row. Column restriction
+    via only() is limited to the list action, where rows are never saved back.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action != 'list':
+            return plan_queryset(queryset, self.get_serializer_class())
+
+        extra_columns = ()
+        if self.paginator is not None and hasattr(self.paginator, 'get_ordering'):
+            ordering = self.paginator.get_ordering(self.request, queryset, self)
+            extra_columns = [field.lstrip('-') for field in ordering]
+        return plan_queryset(queryset, self.get_serializer_class(), True, extra_columns)
@@ -0,0 +1,53 @@
+"""
+Denormalized product ratings.
+
+Every product carries the number and the sum of its reviews' ratings, and
+their average for sorting. Review.save and the delete receiver below move
+them with a single UPDATE per product in the review's own transaction, so
+averages, sort=rating and top_rated never aggregate the reviews table.
+"""
+from django.apps import apps
+from django.db.models import Count, F, FloatField, OuterRef, QuerySet, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+
+def adjust_ratings(deltas):
+    """Add {product_id: (count delta, sum delta)} to the products' ratings and refresh their averages"""
+    Product = apps.get_model('core', 'Product')
+    changed = []
+    for product_id, (count, total) in sorted(deltas.items()):
+        if not count and not total:
+            continue
+        # Expressions on the right read the row before the update
+        Product.objects.filter(pk=product_id).update(
+            rating_count=F('rating_count') + count,
+            rating_sum=F('rating_sum') + total,
+            rating_average=Coalesce(
+                Cast(F('rating_sum') + total, FloatField()) / NullIf(F('rating_count') + count, 0),
+                Value(0.0),
+            ),
+        )
+        changed.append(product_id)
+    if changed:
+        from .catalog_cache import products_changed
+        products_changed(changed)
+
+
+def actual_ratings():
+    """Annotations recomputing rating_count and rating_sum of the outer product row from its reviews"""
+    Review = apps.get_model('core', 'Review')
+    reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    return {
+        'actual_count': Coalesce(Subquery(reviews.annotate(n=Count('id')).values('n')), 0),
+        'actual_sum': Coalesce(Subquery(reviews.annotate(total=Sum('rating')).values('total')), 0),
+    }
+
+
+@receiver(post_delete, sender='core.Review')
+def review_deleted(sender, instance, origin=None, **kwargs):
+    # Deleting the product drops its ratings along with the reviews
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model is not apps.get_model('core', 'Product'):
+        adjust_ratings({instance.product_id: (-1, -instance.rating)})
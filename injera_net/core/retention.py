@@ -0,0 +1,99 @@
+"""
+Retention for notifications.
+
+Read notifications older than NOTIFICATION_RETENTION_DAYS are purged in
+small chunks, each deleted in its own short transaction so the purge never
+holds locks for long and can run next to live traffic (see the
+purge_notifications command). Unread notifications are kept however old.
+
+Before a chunk is deleted its rows are appended to a gzip-compressed JSONL
+archive in NOTIFICATION_ARCHIVE_DIR, one file per run. Every chunk is a
+complete gzip member written before the delete, so an interrupted run
+leaves a readable archive and never loses rows.
+"""
+import gzip
+import json
+import os
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Notification
+
+ARCHIVE_FIELDS = ('id', 'user_id', 'message', 'created_at', 'is_read')
+
+
+def cutoff(days=None):
+    """Read notifications created before this moment are expired"""
+    if days is None:
+        days = getattr(settings, 'NOTIFICATION_RETENTION_DAYS', 30)
+    return timezone.now() - timedelta(days=days)
+
+
+def expired(before):
+    return Notification.objects.filter(is_read=True, created_at__lt=before)
+
+
+class Archive:
+    """gzip-compressed JSONL file, appended to one chunk (gzip member) at a time"""
+
+    def __init__(self, directory, started=None):
+        started = started or timezone.now()
+        self.path = Path(directory) / f"notifications-{started:%Y%m%dT%H%M%S%f}.jsonl.gz"
+        self.rows = 0
+
+    def append(self, rows):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        lines = ''.join(json.dumps(row, default=str) + '\n' for row in rows)
+        with open(self.path, 'ab') as archive:
+            archive.write(gzip.compress(lines.encode()))
+            archive.flush()
+            os.fsync(archive.fileno())
+        self.rows += len(rows)
+
+
+def read_archive(path):
+    """Yield the notification dicts stored in an archive file"""
+    with gzip.open(path, 'rt') as archive:
+        for line in archive:
+            yield json.loads(line)
+
+
+def purge_read_notifications(before=None, chunk_size=1000, archive_dir=None, pause=0.0, limit=None):
+    """
+    Delete read notifications created before `before` (default: the
+    retention cutoff), `chunk_size` rows per transaction, archiving them to
+    `archive_dir` first unless it is None. Sleeps `pause` seconds between
+    chunks and stops after `limit` rows if given. Returns a report dict.
+    """
+    before = before or cutoff()
+    archive = Archive(archive_dir) if archive_dir is not None else None
+    report = {'cutoff': before.isoformat(), 'deleted': 0, 'chunks': 0, 'archive': None}
+    start = time.perf_counter()
+
+    while limit is None or report['deleted'] < limit:
+        size = chunk_size if limit is None else min(chunk_size, limit - report['deleted'])
+        with transaction.atomic():
+            # Locked so nothing marks them unread between the archive and the delete
+            rows = list(
+                expired(before).select_for_update().order_by('created_at', 'id')
+                .values(*ARCHIVE_FIELDS)[:size]
+            )
+            if not rows:
+                break
+            if archive is not None:
+                archive.append(rows)
+            deleted = Notification.objects.filter(pk__in=[row['id'] for row in rows], is_read=True).delete()[0]
+        report['deleted'] += deleted
+        report['chunks'] += 1
+        if pause:
+            time.sleep(pause)
+
+    if archive is not None and archive.rows:
+        report['archive'] = str(archive.path)
+    report['seconds'] = round(time.perf_counter() - start, 3)
+    return report
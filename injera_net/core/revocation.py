@@ -0,0 +1,187 @@
+"""
+Token revocation.
+
+Access and refresh tokens live for a year, so logging out must revoke them.
+Revocations are rows of TokenRevocation. Each process holds them in memory
+and checks every authenticated request against them without a query:
+
+- a set of revoked ids, matched against a token's `jti` and its `sid` (the
+  jti of the refresh token a login issued, copied into every access token
+  derived from it, so revoking it ends the whole login session);
+- per user, the exact time up to which all of their tokens are revoked.
+  The login endpoints stamp `iat` to the microsecond, so logging in again
+  right after such a revocation, even within the same second, gives a
+  valid token; tokens with a whole-second `iat` issued in the revoking
+  second are revoked.
+
+The first check in a process loads the table (its only query on a request);
+from then on a background thread reads the rows created since the previous
+read (less SYNC_OVERLAP, so rows committed late are not missed) every
+TOKEN_REVOCATION_SYNC_INTERVAL seconds. Revocations made by this process
+apply as soon as they commit. Rows, and their memory copies, are dropped
+once every token they revoke has expired.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import TokenRevocation
+
+logger = logging.getLogger(__name__)
+
+# Claim holding the login session's id, set on refresh tokens and copied to their access tokens
+SESSION_CLAIM = 'sid'
+SYNC_OVERLAP = timedelta(minutes=1)
+# Expired entries are dropped from memory this often (seconds); they revoke nothing valid meanwhile
+PRUNE_INTERVAL = 3600
+# simplejwt may store the user id claim as a string
+_user_id = TokenRevocation._meta.get_field('user').to_python
+
+
+def _expiry(token):
+    """A bound on the expiry of every token `token` stands for, its session's included"""
+    issued = datetime.fromtimestamp(token.get('iat', time.time()), tz=dt_timezone.utc)
+    return issued + api_settings.REFRESH_TOKEN_LIFETIME + api_settings.ACCESS_TOKEN_LIFETIME
+
+
+class RevocationList:
+    """In-memory copy of the unexpired TokenRevocation rows"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._ids = {}  # revoked jti or sid: expiry timestamp
+        self._cutoffs = {}  # user id: (tokens issued up to this timestamp are revoked, expiry timestamp)
+        self._read_at = None  # database time of the last read
+        self._pruned = 0  # timestamp of the last pruning
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def is_revoked(self, payload):
+        """Whether the token with claims `payload` is revoked; reads no row"""
+        ids = self._ids
+        if ids and (payload.get(api_settings.JTI_CLAIM) in ids or payload.get(SESSION_CLAIM) in ids):
+            return True
+        cutoffs = self._cutoffs
+        if not cutoffs:
+            return False
+        cutoff = cutoffs.get(_user_id(payload.get(api_settings.USER_ID_CLAIM)))
+        return cutoff is not None and payload.get('iat', 0) <= cutoff[0]
+
+    @property
+    def loaded(self):
+        return self._read_at is not None
+
+    def follow(self):
+        """Load the table if this process hasn't yet, and keep the background thread reading it"""
+        if self._read_at is None:
+            with self._load_lock:
+                if self._read_at is None:
+                    self.sync()
+        if self._thread is None or not self._thread.is_alive():
+            self._start()
+
+    def sync(self):
+        """Read the rows created since the previous read, and drop the expired ones"""
+        now = timezone.now()
+        if self._read_at is None:
+            rows = TokenRevocation.objects.filter(expires_at__gt=now)
+        else:
+            rows = TokenRevocation.objects.filter(created_at__gte=self._read_at - SYNC_OVERLAP)
+        rows = list(rows.values_list('user_id', 'jti', 'created_at', 'expires_at'))
+        with self._lock:
+            self._add(rows)
+            self._prune(now.timestamp())
+            self._read_at = now
+        return len(rows)
+
+    def add(self, revocations):
+        """Apply TokenRevocation instances right away, ahead of the next read"""
+        with self._lock:
+            self._add((row.user_id, row.jti, row.created_at, row.expires_at) for row in revocations)
+
+    def clear(self):
+        with self._lock:
+            self._ids, self._cutoffs = {}, {}
+            self._read_at, self._pruned = None, 0
+
+    def __len__(self):
+        return len(self._ids) + len(self._cutoffs)
+
+    def _add(self, rows):
+        ids, cutoffs = self._ids, self._cutoffs
+        for user_id, jti, created_at, expires_at in rows:
+            if jti:
+                ids[jti] = max(ids.get(jti, 0), expires_at.timestamp())
+            else:
+                previous = cutoffs.get(user_id, (0, 0))
+                cutoffs[user_id] = (
+                    max(previous[0], created_at.timestamp()), max(previous[1], expires_at.timestamp()),
+                )
+
+    def _prune(self, now):
+        if now - self._pruned < PRUNE_INTERVAL:
+            return
+        self._pruned = now
+        self._ids = {jti: expires for jti, expires in self._ids.items() if expires > now}
+        self._cutoffs = {user_id: cutoff for user_id, cutoff in self._cutoffs.items() if cutoff[1] > now}
+
+    def stop(self, timeout=5):
+        """Stop the background thread; the next check starts it again"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name='token-revocation-sync', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        try:
+            while not self._stopping.wait(getattr(settings, 'TOKEN_REVOCATION_SYNC_INTERVAL', 5)):
+                try:
+                    self.sync()
+                except DatabaseError:
+                    # Checks go on against the current copy; the next read catches up
+                    logger.warning("Reading token revocations failed", exc_info=True)
+                    connection.close_if_unusable_or_obsolete()
+        finally:
+            connection.close()
+
+
+revocations = RevocationList()
+
+
+def _save(rows):
+    with transaction.atomic():
+        TokenRevocation.objects.filter(expires_at__lte=timezone.now()).delete()
+        rows = TokenRevocation.objects.bulk_create(rows)
+        transaction.on_commit(lambda: revocations.add(rows))
+    return rows
+
+
+def revoke_tokens(user_id, tokens):
+    """Revoke the given tokens and the login sessions they belong to"""
+    rows = {}
+    for token in tokens:
+        for jti in (token.get(api_settings.JTI_CLAIM), token.get(SESSION_CLAIM)):
+            if jti:
+                rows[jti] = TokenRevocation(user_id=user_id, jti=jti, expires_at=_expiry(token))
+    return _save(list(rows.values()))
+
+
+def revoke_all(user_id):
+    """Revoke every token issued to the user so far"""
+    return _save([TokenRevocation(
+        user_id=user_id,
+        expires_at=timezone.now() + api_settings.REFRESH_TOKEN_LIFETIME + api_settings.ACCESS_TOKEN_LIFETIME,
+    )])
@@ -0,0 +1,496 @@
+"""
+Incremental maintenance of AnalyticsRollup counters.
+
+Every tracked row (user, order, payment, delivery) contributes a fixed set of
+counter values to a few buckets, e.g. a delivered order adds 1 to
+`delivered_orders` of its customer, maker, product and platform buckets. On
+save we apply the difference between the row's new and stored contribution
+(the models re-read the stored row, locked, before saving); a status
+transition applies it only when its compare-and-set wins; on delete we
+subtract its contribution. `rebuild_rollups` recomputes the same
+contributions from scratch, so both paths always agree.
+
+Every order, payment and new user writes to the platform buckets, so on
+backends with row locks a single platform row would serialize all of those
+transactions. The platform scope is split into ROLLUP_PLATFORM_SHARDS rows
+per day instead: each write adds its platform deltas to a random shard (the
+bucket's key), a rebuild puts them all on shard 0, and reads sum the shards.
+
+Queryset .update() sends no signal, so code changing tracked rows in bulk
+must go through `StateMachine.apply_many` (whose batches are applied
+together) or `record_changed`, and `record_created` for bulk_create; any
+other bulk write leaves the counters behind until the next rebuild.
+"""
+import random
+from collections import defaultdict
+from datetime import date
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Max, Q, Sum
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .transitions import transitioned
+from .models import User, Product, Order, OrderLine, Payment, Delivery, AnalyticsRollup
+
+ALL_TIME = AnalyticsRollup.ALL_TIME
+
+
+def _day(value):
+    return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+
+
+# Contributions: {(scope, key, day): {'counter': value, ...}}
+
+def user_contribution(state):
+    counters = {'users': 1}
+    return {
+        ('platform', 0, ALL_TIME): counters,
+        ('platform', 0, _day(state['date_joined'])): counters,
+    }
+
+
+def order_contribution(state):
+    status, total = state['status'], state['total_price']
+
+    def counters(value):
+        return {
+            'orders': 1,
+            'order_value': value,
+            'pending_orders': int(status == 'pending'),
+            'delivered_orders': int(status == 'delivered'),
+            'delivered_revenue': value if status == 'delivered' else 0,
+        }
+
+    day = _day(state['created_at'])
+    contribution = {
+        ('platform', 0, ALL_TIME): counters(total),
+        ('platform', 0, day): counters(total),
+        ('customer', state['customer_id'], ALL_TIME): counters(total),
+        ('maker', state['maker_id'], ALL_TIME): counters(total),
+        ('maker', state['maker_id'], day): counters(total),
+    }
+    # A cart order counts towards each of its products with that line's value
+    for product_id, value in state.get('lines') or [(state['product_id'], total)]:
+        contribution[('product', product_id, ALL_TIME)] = counters(value)
+        contribution[('product', product_id, day)] = counters(value)
+    return contribution
+
+
+def payment_contribution(state):
+    counters = {'paid_revenue': state['amount'] if state['status'] == 'paid' else 0}
+    return {
+        ('platform', 0, ALL_TIME): counters,
+        ('platform', 0, _day(state['created_at'])): counters,
+    }
+
+
+def delivery_contribution(state):
+    counters = {'deliveries': 1, 'completed_deliveries': int(state['status'] == 'completed')}
+    partner_id = state['delivery_partner_id']
+    return {
+        ('delivery_partner', partner_id, ALL_TIME): counters,
+        ('delivery_partner', partner_id, _day(state['assigned_at'])): counters,
+    }
+
+
+def diff(old, new):
+    """Per-bucket counter deltas turning contribution `old` into `new`"""
+    deltas = defaultdict(dict)
+    for sign, contribution in ((-1, old), (1, new)):
+        for bucket, counters in contribution.items():
+            for name, value in counters.items():
+                deltas[bucket][name] = deltas[bucket].get(name, 0) + sign * value
+    return {
+        bucket: {name: value for name, value in counters.items() if value}
+        for bucket, counters in deltas.items()
+    }
+
+
+def apply(deltas, product_labels=None):
+    """Add counter deltas to their buckets, creating missing buckets"""
+    product_labels = product_labels or {}
+    shard = random.randrange(getattr(settings, 'ROLLUP_PLATFORM_SHARDS', 8))
+    for (scope, key, day), counters in deltas.items():
+        if not counters:
+            continue
+        if scope == 'platform':
+            key = shard
+        bucket = AnalyticsRollup.objects.filter(scope=scope, key=key, day=day)
+        increments = {name: F(name) + value for name, value in counters.items()}
+        if bucket.update(**increments):
+            continue
+        defaults = {}
+        if scope == 'product' and key in product_labels:
+            defaults['parent_key'], defaults['label'] = product_labels[key]
+        try:
+            with transaction.atomic():
+                AnalyticsRollup.objects.create(scope=scope, key=key, day=day, **defaults, **counters)
+        except IntegrityError:
+            # Another writer created the bucket first
+            bucket.update(**increments)
+
+
+# Signal handlers
+
+def _order_state(order, state):
+    state = dict(state)
+    if state.get('product_id') == order.product_id:
+        state['maker_id'] = order.product.maker_id
+    else:
+        state['maker_id'] = Product.objects.values_list('maker_id', flat=True).get(pk=state['product_id'])
+    if order.line_count:
+        state['lines'] = [(product_id, value) for product_id, _, value in _order_lines(order)]
+    return state
+
+
+def _order_lines(order):
+    """(product_id, product_name, line value) of a cart order, cached on the instance"""
+    if not hasattr(order, '_rollup_lines'):
+        order._rollup_lines = [
+            (product_id, name, unit_price * quantity)
+            for product_id, name, unit_price, quantity in order.lines.values_list(
+                'product_id', 'product__name', 'unit_price', 'quantity',
+            )
+        ]
+    return order._rollup_lines
+
+
+def _product_labels(order):
+    """{product_id: (maker_id, name)} for the product buckets `order` touches"""
+    labels = {order.product_id: (order.product.maker_id, order.product.name)}
+    if order.line_count:
+        # Every line of a cart order belongs to the same maker
+        for product_id, name, _ in _order_lines(order):
+            labels[product_id] = (order.product.maker_id, name)
+    return labels
+
+
+CONTRIBUTIONS = {
+    Order: lambda instance, state: order_contribution(_order_state(instance, state)),
+    Payment: lambda instance, state: payment_contribution(state),
+    Delivery: lambda instance, state: delivery_contribution(state),
+}
+
+
+def _contribution(instance, state):
+    """Contribution of `instance` in `state`, or nothing when the state is incomplete"""
+    if not all(name in state for name in instance.tracked_fields):
+        return {}
+    return CONTRIBUTIONS[type(instance)](instance, state)
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_save, sender=Payment)
+@receiver(post_save, sender=Delivery)
+def tracked_row_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    current = instance.tracked_state()
+    old = {} if created else _contribution(instance, getattr(instance, '_loaded_state', {}))
+    labels = _product_labels(instance) if sender is Order else None
+    apply(diff(old, _contribution(instance, current)), labels)
+    instance._loaded_state = current
+
+
+@receiver(transitioned, sender=Order)
+@receiver(transitioned, sender=Payment)
+@receiver(transitioned, sender=Delivery)
+def tracked_row_transitioned(sender, instance, batch=None, **kwargs):
+    # Transitions write with a queryset UPDATE, which sends no post_save
+    if batch is None:
+        tracked_row_saved(sender, instance, created=False)
+    elif instance is batch[0]:
+        # The signal comes once per row: apply the whole batch's deltas at once
+        record_changed(batch)
+
+
+def _add(deltas, contribution):
+    for bucket, counters in contribution.items():
+        for name, value in counters.items():
+            deltas[bucket][name] = deltas[bucket].get(name, 0) + value
+
+
+def record_created(instances):
+    """Account for users and tracked rows inserted with bulk_create, which sends no post_save"""
+    deltas = defaultdict(dict)
+    labels = {}
+    for instance in instances:
+        if isinstance(instance, User):
+            contribution = user_contribution({'date_joined': instance.date_joined})
+        else:
+            current = instance.tracked_state()
+            contribution = _contribution(instance, current)
+            instance._loaded_state = current
+        _add(deltas, contribution)
+        if isinstance(instance, Order):
+            labels.update(_product_labels(instance))
+    apply(deltas, labels)
+
+
+def record_changed(instances):
+    """
+    Account for tracked rows changed with queryset.update(), which sends no
+    post_save; the only supported way to change them in bulk. Load the rows
+    with select_for_update in the same transaction as the update, guard the
+    UPDATE on the loaded status, pass only the rows it changed and set the
+    new values on them first, so every change is counted exactly once.
+    """
+    deltas = defaultdict(dict)
+    labels = {}
+    for instance in instances:
+        current = instance.tracked_state()
+        _add(deltas, diff(_contribution(instance, instance._loaded_state), _contribution(instance, current)))
+        instance._loaded_state = current
+        if isinstance(instance, Order):
+            labels.update(_product_labels(instance))
+    apply(deltas, labels)
+
+
+@receiver(pre_delete, sender=Order)
+def order_deleting(sender, instance, **kwargs):
+    # The lines are gone by the time post_delete runs
+    if instance.line_count:
+        _order_lines(instance)
+
+
+@receiver(post_delete, sender=Order)
+@receiver(post_delete, sender=Payment)
+@receiver(post_delete, sender=Delivery)
+def tracked_row_deleted(sender, instance, **kwargs):
+    state = getattr(instance, '_loaded_state', None) or instance.tracked_state()
+    apply(diff(_contribution(instance, state), {}))
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        apply(user_contribution({'date_joined': instance.date_joined}))
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    apply(diff(user_contribution({'date_joined': instance.date_joined}), {}))
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        AnalyticsRollup.objects.filter(scope='product', key=instance.pk).update(
+            parent_key=instance.maker_id, label=instance.name,
+        )
+
+
+# Reads
+
+COUNTERS = (
+    'users', 'orders', 'order_value', 'pending_orders', 'delivered_orders', 'delivered_revenue',
+    'paid_revenue', 'deliveries', 'completed_deliveries',
+)
+
+
+def parse_day_range(since, until):
+    """`since`/`until` query parameters (inclusive YYYY-MM-DD dates, either optional) as dates; raises ValueError"""
+    since = date.fromisoformat(since) if since else None
+    until = date.fromisoformat(until) if until else None
+    if since and until and since > until:
+        raise ValueError("since is after until")
+    return since, until
+
+
+def _days(since=None, until=None):
+    """The all-time bucket, or the daily buckets from `since` to `until` when either is given"""
+    if since is None and until is None:
+        return Q(day=ALL_TIME)
+    days = Q(day__gt=ALL_TIME)
+    if since is not None:
+        days &= Q(day__gte=since)
+    if until is not None:
+        days &= Q(day__lte=until)
+    return days
+
+
+def _bucket(scope, key):
+    # The platform has one bucket, spread over its shards
+    return Q(scope=scope) if scope == 'platform' else Q(scope=scope, key=key)
+
+
+def _sums():
+    return {name: Sum(name) for name in COUNTERS}
+
+
+def _rollup_query(scope, key, day):
+    return AnalyticsRollup.objects.filter(_bucket(scope, key), day=day)
+
+
+def get_rollup(scope, key=0, day=ALL_TIME):
+    """The counters of one bucket; an empty (unsaved) row when nothing was recorded yet"""
+    if scope == 'platform':
+        return _totals(scope, key, _rollup_query(scope, key, day).aggregate(**_sums()), day=day)
+    rollup = _rollup_query(scope, key, day).first()
+    return rollup or AnalyticsRollup(scope=scope, key=key, day=day)
+
+
+async def aget_rollup(scope, key=0, day=ALL_TIME):
+    if scope == 'platform':
+        return _totals(scope, key, await _rollup_query(scope, key, day).aaggregate(**_sums()), day=day)
+    rollup = await _rollup_query(scope, key, day).afirst()
+    return rollup or AnalyticsRollup(scope=scope, key=key, day=day)
+
+
+def _totals_query(scope, key, since, until):
+    return AnalyticsRollup.objects.filter(_days(since, until), _bucket(scope, key))
+
+
+def _totals(scope, key, sums, **fields):
+    return AnalyticsRollup(scope=scope, key=key, **fields, **{name: value or 0 for name, value in sums.items()})
+
+
+def totals(scope, key=0, since=None, until=None):
+    """All-time counters, or counters summed over a day range, in one query (as an unsaved row)"""
+    sums = _totals_query(scope, key, since, until).aggregate(**_sums())
+    return _totals(scope, key, sums)
+
+
+async def atotals(scope, key=0, since=None, until=None):
+    sums = await _totals_query(scope, key, since, until).aaggregate(**_sums())
+    return _totals(scope, key, sums)
+
+
+def _days_query(scope, key, since):
+    today = timezone.localdate()
+    return AnalyticsRollup.objects.filter(_bucket(scope, key), day__gte=since, day__lte=today)
+
+
+def sum_days(scope, key, since, field):
+    """Sum `field` over the daily buckets from `since` to today (at most a handful of rows)"""
+    return sum(_days_query(scope, key, since).values_list(field, flat=True))
+
+
+async def asum_days(scope, key, since, field):
+    total = (await _days_query(scope, key, since).aaggregate(total=Sum(field)))['total']
+    return total or 0
+
+
+def _maker_summary_query(maker_id, since, until):
+    # The maker's bucket and its products' buckets in one pass, summed per bucket
+    return (
+        AnalyticsRollup.objects.filter(_days(since, until))
+        .filter(Q(scope='maker', key=maker_id) | Q(scope='product', parent_key=maker_id))
+        .values('scope', 'key')
+        .annotate(
+            label=Max('label'),
+            orders=Sum('orders'),
+            order_value=Sum('order_value'),
+            delivered_orders=Sum('delivered_orders'),
+            delivered_revenue=Sum('delivered_revenue'),
+        )
+        .order_by()
+    )
+
+
+def _maker_summary(maker_id, rows, limit):
+    maker = AnalyticsRollup(scope='maker', key=maker_id)
+    products = []
+    for row in rows:
+        if row['scope'] == 'maker':
+            maker.orders, maker.order_value = row['orders'], row['order_value']
+            maker.delivered_orders, maker.delivered_revenue = row['delivered_orders'], row['delivered_revenue']
+        else:
+            products.append(row)
+    products.sort(key=lambda row: (-row['orders'], row['key']))
+    return maker, [
+        {'product__name': row['label'], 'total_sold': row['orders'], 'total_revenue': row['order_value']}
+        for row in products[:limit]
+    ]
+
+
+def maker_summary(maker_id, since=None, until=None, limit=5):
+    """(maker counters, top `limit` products by orders) over all time or a day range, in one query"""
+    return _maker_summary(maker_id, _maker_summary_query(maker_id, since, until), limit)
+
+
+async def amaker_summary(maker_id, since=None, until=None, limit=5):
+    rows = [row async for row in _maker_summary_query(maker_id, since, until).aiterator()]
+    return _maker_summary(maker_id, rows, limit)
+
+
+def top_products(maker_id, limit=5, since=None, until=None):
+    return maker_summary(maker_id, since, until, limit)[1]
+
+
+# Rebuild
+
+REBUILD_SOURCES = (User, Product, Order, OrderLine, Payment, Delivery)
+
+
+def _lock_for_rebuild():
+    """
+    Keep writers out of the source tables and the rollups until the rebuild
+    commits, so no change lands between reading the rows and replacing the
+    buckets. Readers go on. SQLite needs no table locks: it serializes
+    writers, and the rebuild writes (deletes the old rows) first. On other
+    backends stop writes while rebuilding.
+    """
+    if connection.vendor != 'postgresql':
+        return
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        sources = ', '.join(quote(model._meta.db_table) for model in REBUILD_SOURCES)
+        cursor.execute(f'LOCK TABLE {sources} IN SHARE MODE')
+        cursor.execute(f'LOCK TABLE {quote(AnalyticsRollup._meta.db_table)} IN EXCLUSIVE MODE')
+
+
+def rebuild(chunk_size=2000):
+    """
+    Recompute every rollup from the source tables, replacing the current rows,
+    in one transaction that blocks writes to them until it commits
+    """
+    with transaction.atomic():
+        _lock_for_rebuild()
+        AnalyticsRollup.objects.all().delete()
+        rows = _rebuilt_rows(chunk_size)
+        AnalyticsRollup.objects.bulk_create(rows, batch_size=chunk_size)
+    return len(rows)
+
+
+def _rebuilt_rows(chunk_size):
+    totals = defaultdict(lambda: defaultdict(int))
+    labels = {}
+
+    def add(contribution):
+        for bucket, counters in contribution.items():
+            for name, value in counters.items():
+                totals[bucket][name] += value
+
+    for row in User.objects.values('date_joined').iterator(chunk_size=chunk_size):
+        add(user_contribution(row))
+    cart_lines = defaultdict(list)
+    lines = OrderLine.objects.values_list(
+        'order_id', 'product_id', 'unit_price', 'quantity', 'product__maker_id', 'product__name',
+    )
+    for order_id, product_id, unit_price, quantity, maker_id, name in lines.iterator(chunk_size=chunk_size):
+        cart_lines[order_id].append((product_id, unit_price * quantity))
+        labels[product_id] = (maker_id, name)
+    orders = Order.objects.values(
+        'id', 'status', 'total_price', 'customer_id', 'product_id', 'created_at',
+        maker_id=F('product__maker_id'), product_name=F('product__name'),
+    )
+    for row in orders.iterator(chunk_size=chunk_size):
+        row['lines'] = cart_lines.get(row['id'])
+        add(order_contribution(row))
+        labels[row['product_id']] = (row['maker_id'], row['product_name'])
+    for row in Payment.objects.values(*Payment.tracked_fields).iterator(chunk_size=chunk_size):
+        add(payment_contribution(row))
+    for row in Delivery.objects.values(*Delivery.tracked_fields).iterator(chunk_size=chunk_size):
+        add(delivery_contribution(row))
+
+    rows = []
+    for (scope, key, day), counters in totals.items():
+        parent_key, label = labels.get(key, (0, '')) if scope == 'product' else (0, '')
+        rows.append(AnalyticsRollup(
+            scope=scope, key=key, day=day, parent_key=parent_key, label=label, **counters,
+        ))
+    return rows
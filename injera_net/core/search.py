@@ -0,0 +1,311 @@
+"""
+Product search.
+
+GET /api/products/search/?q= matches products by name, description and
+maker username, best matches first, with facet counts over the matches.
+The PRODUCT_SEARCH_BACKEND setting selects how:
+
+'fts5'      The SQLite FTS5 index core_product_search (created by migration
+            0011 where SQLite has FTS5; elsewhere 'database' is used), ranked by bm25 with name matches weighted highest. Every
+            query word matches as a prefix ("inj" finds "injera"); a word
+            that is no term's prefix is replaced by the indexed terms within
+            one typo (two for words of eight letters or more) that share its
+            first letter. The index follows product saves and deletes and
+            maker renames in the same transaction; `rebuild_search_index`
+            repopulates it after bulk imports.
+'database'  Portable LIKE filters for other databases: every word must occur
+            somewhere, products whose name starts with the first word come
+            first. No index, no typo tolerance.
+"""
+import logging
+import re
+import unicodedata
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, Count, IntegerField, Q, Value, When
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import User, Product, ProductSearchEntry
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the price facet's bands; the last band is open-ended
+PRICE_BANDS = (Decimal('5'), Decimal('10'), Decimal('20'), Decimal('50'))
+MAX_MAKER_FACETS = 10
+# Query words beyond this are ignored
+MAX_TERMS = 8
+# Shorter words are only ever matched as prefixes
+MIN_TYPO_LENGTH = 4
+MAX_CORRECTIONS = 5
+CHUNK_SIZE = 500
+
+
+def terms(query):
+    """The query's words as the index tokenizes them: lowercase, without diacritics"""
+    folded = unicodedata.normalize('NFKD', query.lower())
+    folded = ''.join(char for char in folded if not unicodedata.combining(char))
+    return re.findall(r'[^\W_]+', folded)[:MAX_TERMS]
+
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance counting a swap of neighbours as one edit; limit + 1 once it exceeds `limit`"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before, previous = None, list(range(len(b) + 1))
+    for i, char in enumerate(a, 1):
+        current = [i]
+        for j, other in enumerate(b, 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != other))
+            if i > 1 and j > 1 and char == b[j - 2] and a[i - 2] == other:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+class DatabaseSearch:
+    """Search with LIKE filters on any database; keeps no index"""
+
+    def search(self, queryset, query):
+        """`queryset` narrowed to the products matching `query`, best first"""
+        words = terms(query)
+        if not words:
+            return queryset.none()
+        for word in words:
+            queryset = queryset.filter(
+                Q(name__icontains=word) | Q(description__icontains=word) | Q(maker__username__icontains=word)
+            )
+        return queryset.annotate(search_rank=Case(
+            When(name__istartswith=words[0], then=Value(0)),
+            When(name__icontains=words[0], then=Value(1)),
+            default=Value(2),
+            output_field=IntegerField(),
+        )).order_by('search_rank', 'id')
+
+    def reindex(self, product_ids):
+        pass
+
+    def remove(self, product_ids):
+        pass
+
+    def maker_renamed(self, maker):
+        return False
+
+    def rebuild(self):
+        return 0
+
+
+class Fts5Search(DatabaseSearch):
+    """Search the SQLite FTS5 index"""
+    table = ProductSearchEntry._meta.db_table
+    vocabulary = f'{ProductSearchEntry._meta.db_table}_vocab'
+
+    def search(self, queryset, query):
+        words = terms(query)
+        if not words:
+            return queryset.none()
+        with connection.cursor() as cursor:
+            expression = ' AND '.join(self._match(cursor, word) for word in words)
+        return queryset.filter(search_entry__document__match=expression).order_by('search_entry__rank', 'id')
+
+    def _match(self, cursor, word):
+        """The FTS5 query for one word: a prefix, or else its likely corrections"""
+        if len(word) < MIN_TYPO_LENGTH or self._is_prefix(cursor, word):
+            return f'"{word}"*'
+        corrections = self._corrections(cursor, word)
+        return '(' + ' OR '.join([f'"{word}"*'] + [f'"{term}"' for term in corrections]) + ')'
+
+    def _is_prefix(self, cursor, word):
+        cursor.execute(
+            f'SELECT 1 FROM {self.vocabulary} WHERE term >= %s AND term < %s LIMIT 1',
+            [word, word + '\U0010ffff'],
+        )
+        return cursor.fetchone() is not None
+
+    def _corrections(self, cursor, word):
+        """Indexed terms within the typo limit of `word`, closest and most frequent first"""
+        limit = 1 if len(word) < 8 else 2
+        # Only terms with the same first letter, so the scan is one range of the vocabulary
+        cursor.execute(
+            f'SELECT term, doc FROM {self.vocabulary} WHERE term >= %s AND term < %s AND length(term) BETWEEN %s AND %s',
+            [word[0], chr(ord(word[0]) + 1), len(word) - limit, len(word) + limit],
+        )
+        scored = []
+        for term, documents in cursor.fetchall():
+            distance = edit_distance(word, term, limit)
+            if distance <= limit:
+                scored.append((distance, -documents, term))
+        return [term for _, _, term in sorted(scored)[:MAX_CORRECTIONS]]
+
+    def reindex(self, product_ids):
+        """(Re)write the index rows of the given products from their current state"""
+        with connection.cursor() as cursor:
+            for chunk in _chunks(product_ids):
+                placeholders = ', '.join(['%s'] * len(chunk))
+                cursor.execute(f'DELETE FROM {self.table} WHERE rowid IN ({placeholders})', chunk)
+                cursor.execute(self._select_into(f'WHERE p.id IN ({placeholders})'), chunk)
+
+    def remove(self, product_ids):
+        with connection.cursor() as cursor:
+            for chunk in _chunks(product_ids):
+                placeholders = ', '.join(['%s'] * len(chunk))
+                cursor.execute(f'DELETE FROM {self.table} WHERE rowid IN ({placeholders})', chunk)
+
+    def maker_renamed(self, maker):
+        """Follow a maker's new username; returns whether any index row changed"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {self.table} SET maker = %s '
+                f'WHERE rowid IN (SELECT id FROM {Product._meta.db_table} WHERE maker_id = %s) AND maker != %s',
+                [maker.username, maker.pk, maker.username],
+            )
+            return cursor.rowcount > 0
+
+    def rebuild(self):
+        """Repopulate the whole index; returns the number of products indexed"""
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.execute(self._select_into(''))
+            count = cursor.rowcount
+            # Merge the index segments written above into one b-tree
+            cursor.execute(f"INSERT INTO {self.table}({self.table}) VALUES ('optimize')")
+        return count
+
+    def _select_into(self, where):
+        return (
+            f'INSERT INTO {self.table}(rowid, name, description, maker) '
+            f'SELECT p.id, p.name, p.description, u.username '
+            f'FROM {Product._meta.db_table} p JOIN {User._meta.db_table} u ON u.id = p.maker_id {where}'
+        )
+
+
+BACKENDS = {
+    'fts5': Fts5Search(),
+    'database': DatabaseSearch(),
+}
+
+
+# {(database alias, name): whether it has the FTS5 index}
+_fts5_databases = {}
+
+
+def fts5_available():
+    """Whether the database has the FTS5 index: SQLite built with FTS5, which migration 0011 then created"""
+    key = (connection.alias, connection.settings_dict['NAME'])
+    if key not in _fts5_databases:
+        available = False
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT sqlite_compileoption_used('ENABLE_FTS5') "
+                    "AND EXISTS (SELECT 1 FROM sqlite_master WHERE name = %s)",
+                    [Fts5Search.table],
+                )
+                available = bool(cursor.fetchone()[0])
+        if not available:
+            logger.warning("%s has no FTS5 product index; searching with the 'database' backend", connection.vendor)
+        _fts5_databases[key] = available
+    return _fts5_databases[key]
+
+
+def get_backend(name=None):
+    """The named or configured backend; 'fts5' falls back to 'database' where the index can't exist"""
+    name = name or getattr(settings, 'PRODUCT_SEARCH_BACKEND', 'fts5')
+    if name == 'fts5' and not fts5_available():
+        name = 'database'
+    return BACKENDS[name]
+
+
+def parse_filters(params):
+    """Product filters from the query parameters `available`, `min_price`, `max_price` and `maker`; raises ValueError"""
+    filters = Q()
+    available = params.get('available')
+    if available is not None:
+        if available not in ('true', 'false'):
+            raise ValueError('available must be true or false')
+        filters &= Q(available=available == 'true')
+    for param, lookup in (('min_price', 'price__gte'), ('max_price', 'price__lt')):
+        if params.get(param) is not None:
+            try:
+                filters &= Q(**{lookup: Decimal(params[param])})
+            except InvalidOperation:
+                raise ValueError(f'{param} must be a number')
+    if params.get('maker') is not None:
+        try:
+            filters &= Q(maker_id=int(params['maker']))
+        except ValueError:
+            raise ValueError('maker must be a user id')
+    return filters
+
+
+def _bands():
+    """(label, min, max, condition) of the price facet's bands"""
+    bands, low = [], None
+    for high in PRICE_BANDS + (None,):
+        condition = Q()
+        if low is not None:
+            condition &= Q(price__gte=low)
+        if high is not None:
+            condition &= Q(price__lt=high)
+        label = f'{low or 0}-{high}' if high is not None else f'{low}+'
+        bands.append((label, low, high, condition))
+        low = high
+    return bands
+
+
+def facets(matches):
+    """Counts of the matching products by availability, price band and maker (the most frequent makers)"""
+    matches = matches.order_by()
+    bands = _bands()
+    counts = matches.aggregate(
+        available_true=Count('id', filter=Q(available=True)),
+        available_false=Count('id', filter=Q(available=False)),
+        **{f'band_{i}': Count('id', filter=condition) for i, (_, _, _, condition) in enumerate(bands)},
+    )
+    makers = (
+        matches.values('maker_id', 'maker__username').annotate(count=Count('id'))
+        .order_by('-count', 'maker_id')[:MAX_MAKER_FACETS]
+    )
+    return {
+        'available': {'true': counts['available_true'], 'false': counts['available_false']},
+        'price': [
+            {'band': label, 'min': low, 'max': high, 'count': counts[f'band_{i}']}
+            for i, (label, low, high, _) in enumerate(bands)
+        ],
+        'maker': [
+            {'id': row['maker_id'], 'username': row['maker__username'], 'count': row['count']}
+            for row in makers
+        ],
+    }
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        get_backend().reindex([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    get_backend().remove([instance.pk])
+
+
+@receiver(post_save, sender=User)
+def maker_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # A new maker has no products yet, and logins only save last_login
+    if raw or created or instance.role != 'maker' or (update_fields is not None and 'username' not in update_fields):
+        return
+    if get_backend().maker_renamed(instance):
+        from .catalog_cache import products_changed
+        products_changed([])
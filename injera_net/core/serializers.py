@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
-from .models import Product, Order, Payment, Delivery, Inventory, Notification, Review
+from .models import Product, Order, OrderLine, Payment, Delivery, Inventory, Notification, Review
 
 User = get_user_model()
 
@@ -33,15 +33,23 @@ class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = '__all__'
+        # Maintained from the reviews
+        read_only_fields = ('rating_count', 'rating_sum', 'rating_average')
+
+class OrderLineSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrderLine
+        fields = ['id', 'product', 'quantity', 'unit_price']
 
 class OrderSerializer(serializers.ModelSerializer):
     customer_username = serializers.CharField(source='customer.username', read_only=True)
     product_name = serializers.CharField(source='product.name', read_only=True)
+    lines = OrderLineSerializer(many=True, read_only=True)
     
     class Meta:
         model = Order
         fields = '__all__'
-        read_only_fields = ('created_at', 'total_price')
+        read_only_fields = ('customer', 'status', 'created_at', 'total_price', 'line_count')
 
 class PaymentSerializer(serializers.ModelSerializer):
     order_details = OrderSerializer(source='order', read_only=True)
@@ -50,7 +58,7 @@ class PaymentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Payment
         fields = '__all__'
-        read_only_fields = ('created_at', 'amount')
+        read_only_fields = ('status', 'created_at', 'amount')
 
 
 
@@ -61,7 +69,7 @@ class DeliverySerializer(serializers.ModelSerializer):
     class Meta:
         model = Delivery
         fields = '__all__'
-        read_only_fields = ('assigned_at',)
+        read_only_fields = ('status', 'assigned_at')
 
 class InventorySerializer(serializers.ModelSerializer):
     owner_username = serializers.CharField(source='owner.username', read_only=True)
@@ -83,6 +91,8 @@ class NotificationSerializer(serializers.ModelSerializer):
 class ReviewSerializer(serializers.ModelSerializer):
     customer_username = serializers.CharField(source='customer.username', read_only=True)
     product_name = serializers.CharField(source='product.name', read_only=True)
+    product_rating_count = serializers.IntegerField(source='product.rating_count', read_only=True)
+    product_rating_average = serializers.FloatField(source='product.rating_average', read_only=True)
     
     class Meta:
         model = Review
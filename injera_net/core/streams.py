@@ -0,0 +1,212 @@
+"""
+Server-sent event stream of a user's notifications.
+
+`GET /api/notifications/stream/` keeps the response open and pushes an event
+for every new notification and every change of the unread count, replacing
+client polling. It is served by the ASGI application in injera_net/asgi.py
+(not under WSGI/runserver): each connection is an asyncio task parked on a
+queue, so one worker holds thousands of idle streams.
+
+Events travel through an in-process hub: writers (the notification
+dispatcher, mark-as-read) publish after commit and the hub hands events to the
+event loops that own the subscribers. Every worker process only sees its own
+writes, so run the dispatcher in the same process as the streams or put a
+shared broker behind `hub.publish`.
+"""
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+from .authentication import ClaimsJWTAuthentication
+
+logger = logging.getLogger(__name__)
+
+STREAM_PATH = '/api/notifications/stream/'
+# Events buffered for a slow client before new ones are dropped
+QUEUE_SIZE = 100
+
+
+class NotificationHub:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, user_id):
+        """Register a queue for `user_id` on the running event loop"""
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(QUEUE_SIZE))
+        with self._lock:
+            self._subscribers[user_id].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, user_id, subscriber):
+        with self._lock:
+            self._subscribers[user_id].discard(subscriber)
+            if not self._subscribers[user_id]:
+                del self._subscribers[user_id]
+
+    def subscribed(self, user_ids):
+        """The subset of `user_ids` with at least one open stream"""
+        with self._lock:
+            return {user_id for user_id in user_ids if user_id in self._subscribers}
+
+    def connections(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(self, user_id, event):
+        """Hand `event` to every stream of `user_id`; safe to call from any thread"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_put, queue, event)
+            except RuntimeError:
+                # The subscriber's loop has shut down
+                pass
+
+
+def _put(queue, event):
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        logger.warning("Notification stream queue full, dropping %s event", event['type'])
+
+
+hub = NotificationHub()
+
+
+def _unread_counts(user_ids):
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    return dict(User.objects.filter(pk__in=user_ids).values_list('pk', 'unread_notifications'))
+
+
+def publish_unread(user_ids):
+    """Push the current unread count to the connected users among `user_ids`"""
+    user_ids = hub.subscribed(set(user_ids))
+    if user_ids:
+        for user_id, count in _unread_counts(user_ids).items():
+            hub.publish(user_id, {'type': 'unread', 'unread_count': count})
+
+
+def publish_created(notifications):
+    """Push freshly written notifications, and the new unread counts, to connected users"""
+    connected = hub.subscribed({notification.user_id for notification in notifications})
+    if not connected:
+        return
+    for notification in notifications:
+        if notification.user_id in connected:
+            hub.publish(notification.user_id, {
+                'type': 'notification',
+                'id': notification.pk,
+                'message': notification.message,
+                'created_at': notification.created_at.isoformat(),
+            })
+    publish_unread(connected)
+
+
+def unread_changed(user_ids):
+    """Publish new unread counts once the current transaction commits"""
+    user_ids = set(user_ids)
+    if hub.subscribed(user_ids):
+        transaction.on_commit(lambda: publish_unread(user_ids))
+
+
+def _format(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+def _authenticate(headers, query_string):
+    """User id from a `?token=` access token (EventSource can't set headers) or an Authorization: Bearer header"""
+    token = parse_qs(query_string.decode()).get('token', [None])[0]
+    if token is None:
+        scheme, _, token = headers.get(b'authorization', b'').decode().partition(' ')
+        if scheme.lower() != 'bearer':
+            return None
+    authenticator = ClaimsJWTAuthentication()
+    try:
+        return authenticator.get_user(authenticator.get_validated_token(token)).pk
+    except (AuthenticationFailed, InvalidToken, TokenError):
+        return None
+
+
+def _release_connection():
+    # Streams stay open for hours: don't hold a database connection meanwhile
+    # (unless it belongs to a caller's transaction, as in tests)
+    if not connection.in_atomic_block:
+        connection.close()
+
+
+def _unread_count(user_id):
+    try:
+        User = apps.get_model(settings.AUTH_USER_MODEL)
+        return User.objects.values_list('unread_notifications', flat=True).get(pk=user_id)
+    finally:
+        _release_connection()
+
+
+class NotificationStreamRouter:
+    """
+    ASGI application serving STREAM_PATH itself and everything else through
+    Django. Django's handler pins a thread to every request for its sync
+    middleware, which long-lived streams can't afford; here a stream is just a
+    task waiting on its queue.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == STREAM_PATH:
+            return await self.stream(scope, receive, send)
+        return await self.application(scope, receive, send)
+
+    async def stream(self, scope, receive, send):
+        message = await receive()
+        while message['type'] == 'http.request' and message.get('more_body'):
+            message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+        user_id = await sync_to_async(_authenticate)(dict(scope['headers']), scope['query_string'])
+        if user_id is None:
+            await sync_to_async(_release_connection)()
+            await send({'type': 'http.response.start', 'status': 401, 'headers': [(b'content-type', b'application/json')]})
+            await send({'type': 'http.response.body', 'body': json.dumps({'error': 'Authentication required'}).encode()})
+            return
+
+        # Subscribe before counting so no change can slip in between
+        subscriber = hub.subscribe(user_id)
+        _, queue = subscriber
+        heartbeat = getattr(settings, 'NOTIFICATION_STREAM_HEARTBEAT', 15)
+        disconnected = asyncio.ensure_future(receive())
+        try:
+            unread = await sync_to_async(_unread_count)(user_id)
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ]})
+            chunk = _format({'type': 'unread', 'unread_count': unread})
+            while True:
+                await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+                getter = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({getter, disconnected}, timeout=heartbeat, return_when=asyncio.FIRST_COMPLETED)
+                if getter not in done:
+                    getter.cancel()
+                if disconnected in done:
+                    return
+                # Comment line: keeps proxies from closing an idle stream
+                chunk = _format(getter.result()) if getter in done else ': keepalive\n\n'
+        finally:
+            hub.unsubscribe(user_id, subscriber)
+            disconnected.cancel()
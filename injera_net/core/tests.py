@@ -1,3 +1,1895 @@
-from django.test import TestCase
+import asyncio
+import io
+import itertools
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import User, Product, Order, Payment, Delivery, Inventory, Notification, Review, AnalyticsRollup, OutOfStock, TokenRevocation
+from . import rollups
+from .authentication import ClaimsAccessToken, ClaimsJWTAuthentication, user_cache
+from . import revocation
+from .revocation import RevocationList, revocations
+from .notifications import NotificationDispatcher
+from .assignment import AssignmentEngine, NearestPartnerEngine
+from .geo import PartnerGridIndex, haversine_km, locator
+from .dispatch import BatchDispatcher, hungarian
+from .checkout import place_orders, checkout_cart
+from . import bulk_io
+from . import async_views, catalog_cache, metrics, search
+from .transitions import transitioned
+from .retention import cutoff, purge_read_notifications, read_archive
+from .streams import NotificationStreamRouter, hub, publish_created
+
+
+def setUpModule():
+    # The tests' transactions would lock out background reads of the revocation
+    # table; they load the global list explicitly (reset_revocations) instead
+    patcher = mock.patch.object(revocations, '_start')
+    patcher.start()
+    unittest.addModuleCleanup(patcher.stop)
+
+
+def reset_revocations():
+    """Forget revocations other tests left in memory and load the (empty) table, so checks run no query"""
+    revocations.clear()
+    revocations.sync()
+
+
+def use_token(client, user):
+    """Authenticate the client's requests with an access token of `user`, as a real client would"""
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {ClaimsAccessToken.for_user(user)}')
+
+
+def rollup_buckets(fields):
+    """{(scope, key, day): values of `fields`} of the stored rollups, the platform's shards summed as reads do"""
+    buckets = {}
+    for row in AnalyticsRollup.objects.all():
+        bucket = (row.scope, 0 if row.scope == 'platform' else row.key, row.day)
+        values = [getattr(row, field) for field in fields]
+        buckets[bucket] = [a + b for a, b in zip(buckets[bucket], values)] if bucket in buckets else values
+    return buckets
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user(username='customer', password='pass', role='customer')
+        self.maker = User.objects.create_user(username='maker', password='pass', role='maker')
+        self.product = Product.objects.create(maker=self.maker, name='Injera', price=Decimal('2.50'), stock=100)
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def create_orders(self, count):
+        return [Order.objects.create(customer=self.customer, product=self.product) for _ in range(count)]
+
+    def test_pages_walk_newest_first_without_gaps(self):
+        orders = self.create_orders(7)
+        seen = []
+        url = '/api/orders/?page_size=3'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(row['id'] for row in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, [order.id for order in reversed(orders)])
+
+    def test_inserts_while_paging_do_not_shift_pages(self):
+        orders = self.create_orders(6)
+        first = self.client.get('/api/orders/?page_size=3')
+        self.create_orders(5)
+        second = self.client.get(first.data['next'])
+        self.assertEqual(
+            [row['id'] for row in second.data['results']],
+            [order.id for order in reversed(orders[:3])],
+        )
+
+    def test_previous_link_returns_to_first_page(self):
+        self.create_orders(5)
+        first = self.client.get('/api/orders/?page_size=2')
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(back.data['results'], first.data['results'])
+
+    def test_page_size_is_capped(self):
+        self.create_orders(3)
+        response = self.client.get('/api/orders/?page_size=100000')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_invalid_cursor_is_404(self):
+        response = self.client.get('/api/orders/?cursor=bogus')
+        self.assertEqual(response.status_code, 404)
+
+
+class ListQueryCountTests(TestCase):
+    """List endpoints must issue a fixed number of queries however many rows they return"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='staff', password='pass', role='customer', is_staff=True)
+        self.maker = User.objects.create_user(username='maker', password='pass', role='maker')
+        self.client = APIClient()
+        reset_revocations()
+        use_token(self.client, self.user)
+        self.seeded = 0
+        cache.clear()
+
+    def seed(self, count):
+        # Run the on-commit catalog cache invalidation as a real commit would
+        with self.captureOnCommitCallbacks(execute=True):
+            self._seed(count)
+
+    def _seed(self, count):
+        for _ in range(count):
+            self.seeded += 1
+            partner = User.objects.create_user(username=f'partner{self.seeded}', role='delivery_partner')
+            product = Product.objects.create(maker=self.maker, name=f'Dish {self.seeded}', price=Decimal('3.00'))
+            order = Order.objects.create(customer=self.user, product=product)
+            Payment.objects.create(order=order, amount=order.total_price)
+            Delivery.objects.create(order=order, delivery_partner=partner)
+            Inventory.objects.create(owner=self.maker, item_name=f'Teff {self.seeded}')
+            Notification.objects.create(user=self.user, message='Hello')
+            Review.objects.create(customer=self.user, product=product)
+
+    def count_list_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_list_query_count_does_not_grow_with_rows(self):
+        urls = [
+            '/api/users/', '/api/products/', '/api/orders/', '/api/payments/',
+            '/api/deliveries/', '/api/inventory/', '/api/notifications/', '/api/reviews/',
+        ]
+        self.seed(2)
+        small = {url: self.count_list_queries(url) for url in urls}
+        self.seed(6)
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.count_list_queries(url), small[url])
+
+
+class AnalyticsRollupTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', role='admin')
+        self.customer = User.objects.create_user(username='customer', role='customer')
+        self.maker = User.objects.create_user(username='maker', role='maker')
+        self.partner = User.objects.create_user(username='partner', role='delivery_partner')
+        self.injera = Product.objects.create(maker=self.maker, name='Injera', price=Decimal('2.00'))
+        self.wot = Product.objects.create(maker=self.maker, name='Doro wot', price=Decimal('5.00'))
+        self.client = APIClient()
+        reset_revocations()
+
+    def run_workflow(self):
+        delivered = Order.objects.create(customer=self.customer, product=self.wot, quantity=2)
+        delivered.create_payment_record()
+        delivered.accept_order()
+        delivered.payment.process_payment()
+        delivery = Delivery.objects.create(order=delivered, delivery_partner=self.partner)
+        delivery.mark_in_transit()
+        delivery.mark_completed()
+
+        cancelled = Order.objects.create(customer=self.customer, product=self.injera)
+        cancelled.create_payment_record()
+        cancelled.cancel_order()
+        Order.objects.create(customer=self.customer, product=self.injera, quantity=3)
+
+    @override_settings(ROLLUP_PLATFORM_SHARDS=4)
+    def test_platform_writes_spread_over_shards_and_reads_sum_them(self):
+        shards = itertools.cycle(range(4))
+        with mock.patch('core.rollups.random.randrange', side_effect=lambda count: next(shards)):
+            for _ in range(4):
+                Order.objects.create(customer=self.customer, product=self.injera)
+        # setUp's users landed on shards of their own
+        platform = AnalyticsRollup.objects.filter(scope='platform', day=rollups.ALL_TIME, orders__gt=0)
+        self.assertEqual(sorted(platform.values_list('key', 'orders')), [(0, 1), (1, 1), (2, 1), (3, 1)])
+        self.assertEqual(rollups.get_rollup('platform').orders, 4)
+        self.assertEqual(rollups.totals('platform').orders, 4)
+        self.assertEqual(rollups.totals('platform', since=timezone.localdate()).orders, 4)
+
+        # A rebuild puts the platform back on one shard
+        rollups.rebuild()
+        self.assertEqual(list(platform.values_list('key', 'orders')), [(0, 4)])
+        self.assertEqual(rollups.get_rollup('platform').orders, 4)
+
+    def test_stale_instances_count_a_change_once(self):
+        Order.objects.create(customer=self.customer, product=self.injera)
+        first, second = Order.objects.get(), Order.objects.get()
+        for order in (first, second):
+            order.status = 'accepted'
+            order.save()
+        platform = rollups.get_rollup('platform')
+        self.assertEqual((platform.orders, platform.pending_orders), (1, 0))
+
+    def test_incremental_rollups_match_rebuild(self):
+        self.run_workflow()
+        Order.objects.filter(status='cancelled').get().delete()
+        fields = ['users', 'orders', 'order_value', 'pending_orders', 'delivered_orders',
+                  'delivered_revenue', 'paid_revenue', 'deliveries', 'completed_deliveries']
+        incremental = rollup_buckets(fields)
+        rollups.rebuild()
+        rebuilt = rollup_buckets(fields)
+        self.assertEqual(set(incremental), set(rebuilt))
+        for bucket, values in rebuilt.items():
+            self.assertEqual(incremental[bucket], values, bucket)
+
+    def test_endpoints_read_rollups(self):
+        self.run_workflow()
+        use_token(self.client, self.admin)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/analytics/dashboard_stats/')
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(response.json(), {
+            'total_users': 4, 'total_orders': 3, 'total_revenue': 10.0, 'pending_orders': 1,
+        })
+
+        use_token(self.client, self.maker)
+        response = self.client.get('/api/analytics/maker_analytics/')
+        self.assertEqual(response.json()['total_sales'], 1)
+        self.assertEqual(response.json()['total_earnings'], 10.0)
+        self.assertEqual(
+            [(row['product__name'], row['total_sold']) for row in response.json()['top_products']],
+            [('Injera', 2), ('Doro wot', 1)],
+        )
+
+        use_token(self.client, self.partner)
+        response = self.client.get('/api/analytics/delivery_analytics/')
+        self.assertEqual(response.json()['total_deliveries'], 1)
+        self.assertEqual(response.json()['weekly_deliveries'], 1)
+        self.assertEqual(response.json()['completion_rate'], 100.0)
+
+    def test_date_range_sums_daily_buckets(self):
+        self.run_workflow()
+        old = Order.objects.create(customer=self.customer, product=self.wot)
+        old.created_at = timezone.now() - timedelta(days=10)
+        old.save()
+        today = timezone.localdate()
+
+        def get(url, **params):
+            return self.client.get(url, params).json()
+
+        use_token(self.client, self.admin)
+        self.assertEqual(get('/api/analytics/dashboard_stats/')['total_orders'], 4)
+        self.assertEqual(get('/api/analytics/dashboard_stats/', since=today - timedelta(days=2))['total_orders'], 3)
+        self.assertEqual(get('/api/analytics/dashboard_stats/', until=today - timedelta(days=5)), {
+            'total_users': 0, 'total_orders': 1, 'total_revenue': 0.0, 'pending_orders': 1,
+        })
+
+        use_token(self.client, self.maker)
+        with CaptureQueriesContext(connection) as context:
+            recent = get('/api/analytics/maker_analytics/', since=today - timedelta(days=2), until=today)
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(
+            [(row['product__name'], row['total_sold']) for row in recent['top_products']],
+            [('Injera', 2), ('Doro wot', 1)],
+        )
+        earlier = get('/api/analytics/maker_analytics/', until=today - timedelta(days=5))
+        self.assertEqual((earlier['total_sales'], earlier['top_products'][0]['product__name']), (0, 'Doro wot'))
+
+        for params in ({'since': 'yesterday'}, {'since': today, 'until': today - timedelta(days=1)}):
+            self.assertEqual(self.client.get('/api/analytics/maker_analytics/', params).status_code, 400)
+
+
+class NotificationDispatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='customer', role='customer')
+
+    @override_settings(NOTIFICATION_DISPATCH_MODE='sync')
+    def test_sync_mode_writes_inline(self):
+        Notification.send(self.user, 'Hello')
+        self.assertEqual(Notification.objects.filter(user=self.user).count(), 1)
+
+    def test_async_mode_queues_after_commit_and_writes_one_batch(self):
+        dispatcher = NotificationDispatcher(batch_size=1000, flush_interval=60)
+        # No writer thread: the batch is written by shutdown() on this connection, not racing it
+        with mock.patch('core.notifications.dispatcher', dispatcher), mock.patch.object(dispatcher, '_start'):
+            with self.captureOnCommitCallbacks(execute=True):
+                Notification.send(self.user, 'Order accepted')
+                Notification.send(self.user, 'Order accepted')
+                Notification.send(self.user, 'Order paid')
+                self.assertEqual(dispatcher._pending, [])
+            self.assertEqual(Notification.objects.count(), 0)
+
+            with CaptureQueriesContext(connection) as context:
+                dispatcher.shutdown()
+        inserts = [query for query in context.captured_queries if query['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(
+            sorted(Notification.objects.values_list('message', flat=True)),
+            ['Order accepted', 'Order paid'],
+        )
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.unread_notifications, 2)
+
+    def write_failing(self, failures, retries):
+        """Write one notification through a dispatcher whose first `failures` INSERTs fail"""
+        dispatcher = NotificationDispatcher(retries=retries, retry_delay=0)
+        create = Notification.objects.bulk_create
+        calls = []
+
+        def flaky(*args, **kwargs):
+            calls.append(1)
+            if len(calls) <= failures:
+                raise OperationalError('database is locked')
+            return create(*args, **kwargs)
+
+        with mock.patch.object(dispatcher, '_start'), mock.patch.object(Notification.objects, 'bulk_create', flaky):
+            dispatcher.enqueue(self.user.pk, 'Order paid')
+            dispatcher.shutdown()
+        return len(calls)
+
+    def test_failed_batches_are_retried(self):
+        with self.assertLogs('core.notifications', 'WARNING'):
+            self.assertEqual(self.write_failing(failures=2, retries=3), 3)
+        self.assertEqual(Notification.objects.filter(user=self.user).count(), 1)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.unread_notifications, 1)
+
+    def test_batches_are_dropped_once_the_retries_are_used_up(self):
+        with self.assertLogs('core.notifications', 'ERROR'):
+            self.assertEqual(self.write_failing(failures=5, retries=2), 3)
+        self.assertFalse(Notification.objects.exists())
+
+
+@override_settings(NOTIFICATION_DISPATCH_MODE='sync')
+class UnreadCounterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='customer', role='customer')
+        reset_revocations()
+
+    def unread(self):
+        return User.objects.get(pk=self.user.pk).unread_notifications
+
+    def actual(self):
+        return Notification.objects.filter(user=self.user, is_read=False).count()
+
+    def test_counter_follows_create_read_and_delete(self):
+        for message in ('Accepted', 'Paid', 'Delivered'):
+            Notification.send(self.user, message)
+        self.assertEqual(self.unread(), 3)
+
+        notification = Notification.objects.filter(user=self.user).first()
+        notification.mark_as_read()
+        notification.mark_as_read()
+        self.assertEqual(self.unread(), 2)
+
+        notification.is_read = False
+        notification.save()
+        self.assertEqual(self.unread(), 3)
+
+        notification.delete()
+        self.assertEqual(self.unread(), 2)
+
+        self.assertEqual(Notification.mark_all_read(self.user.id), 2)
+        self.assertEqual(self.unread(), 0)
+        self.assertEqual(self.actual(), 0)
+
+    def test_stale_copies_only_decrement_once(self):
+        Notification.send(self.user, 'Paid')
+        first = Notification.objects.get(user=self.user)
+        second = Notification.objects.get(user=self.user)
+        first.mark_as_read()
+        second.mark_as_read()
+        self.assertEqual(self.unread(), 0)
+
+    def test_badge_endpoint_is_one_lookup(self):
+        Notification.send(self.user, 'Paid')
+        client = APIClient()
+        use_token(client, self.user)
+        with self.assertNumQueries(1):
+            response = client.get('/api/notifications/unread/')
+        self.assertEqual(response.json(), {'unread_count': 1})
+
+        response = client.post('/api/notifications/mark_all_read/')
+        self.assertEqual(response.json(), {'status': 'Marked 1 notifications as read'})
+        self.assertEqual(client.get('/api/notifications/unread/').json(), {'unread_count': 0})
+
+    def test_reconcile_command_repairs_drift(self):
+        Notification.send(self.user, 'Paid')
+        User.objects.filter(pk=self.user.pk).update(unread_notifications=7)
+        out = io.StringIO()
+        call_command('reconcile_unread_counts', stdout=out)
+        self.assertIn('stored 7, actual 1', out.getvalue())
+        self.assertEqual(self.unread(), 1)
+
+
+@override_settings(NOTIFICATION_DISPATCH_MODE='sync')
+class NotificationRetentionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='customer', role='customer')
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir)
+
+    def notification(self, days_old, is_read):
+        notification = Notification.objects.create(user=self.user, message=f'{days_old} days, read={is_read}', is_read=is_read)
+        Notification.objects.filter(pk=notification.pk).update(created_at=timezone.now() - timedelta(days=days_old))
+        return notification
+
+    def test_purge_archives_and_deletes_only_old_read_notifications(self):
+        old_read = [self.notification(40 + i, True) for i in range(5)]
+        old_unread = self.notification(90, False)
+        recent_read = self.notification(1, True)
+
+        report = purge_read_notifications(before=cutoff(30), chunk_size=2, archive_dir=self.archive_dir)
+
+        self.assertEqual(report['deleted'], 5)
+        self.assertEqual(report['chunks'], 3)
+        self.assertEqual(
+            set(Notification.objects.values_list('id', flat=True)),
+            {old_unread.id, recent_read.id},
+        )
+        archived = list(read_archive(report['archive']))
+        self.assertEqual(
+            [row['id'] for row in archived],
+            [notification.id for notification in reversed(old_read)],
+        )
+        self.assertEqual(archived[0]['message'], '44 days, read=True')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.unread_notifications, 1)
+
+    def test_limit_and_command(self):
+        for i in range(3):
+            self.notification(40, True)
+        report = purge_read_notifications(before=cutoff(30), limit=2)
+        self.assertEqual((report['deleted'], report['archive']), (2, None))
+
+        out = io.StringIO()
+        call_command('purge_notifications', '--once', '--days', '30', '--archive-dir', self.archive_dir, stdout=out)
+        self.assertIn('Deleted 1 read notifications', out.getvalue())
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(len(os.listdir(self.archive_dir)), 1)
+
+
+@override_settings(NOTIFICATION_DISPATCH_MODE='sync')
+class UnreadCounterConcurrencyTests(TransactionTestCase):
+    def test_concurrent_creates_and_reads_never_drift(self):
+        users = [User.objects.create_user(username=f'customer{i}', role='customer') for i in range(3)]
+        errors = []
+
+        def worker(seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(40):
+                    user = rng.choice(users)
+                    action = rng.random()
+                    while True:
+                        try:
+                            if action < 0.5:
+                                Notification.send(user, f'Message {rng.random()}')
+                            elif action < 0.85:
+                                notification = Notification.objects.filter(user=user).order_by('?').first()
+                                if notification:
+                                    notification.mark_as_read()
+                            else:
+                                Notification.mark_all_read(user.id)
+                            break
+                        except OperationalError:
+                            # SQLite serializes writers; retry the whole step
+                            continue
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        for user in users:
+            user.refresh_from_db()
+            self.assertEqual(
+                user.unread_notifications,
+                Notification.objects.filter(user=user, is_read=False).count(),
+            )
+
+
+class AssignmentEngineTests(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user(username='customer', role='customer')
+        self.maker = User.objects.create_user(username='maker', role='maker')
+        self.product = Product.objects.create(maker=self.maker, name='Injera', price=Decimal('2.00'))
+        self.partners = [
+            User.objects.create_user(username=f'partner{i}', role='delivery_partner') for i in range(2)
+        ]
+        self.engine = AssignmentEngine()
+
+    def paid_order(self):
+        return Order.objects.create(customer=self.customer, product=self.product, status='paid')
+
+    def test_claim_skips_partners_taken_by_a_concurrent_worker(self):
+        taken, free = self.partners
+        # Another worker claimed `taken` after we read the candidate list
+        User.objects.filter(id=taken.id).update(is_available=False)
+        with mock.patch.object(AssignmentEngine, 'candidates', side_effect=[[taken.id, free.id], []]):
+            self.assertEqual(self.engine.claim(2), [free.id])
+
+    def test_assign_gives_each_order_its_own_partner(self):
+        orders = [self.paid_order() for _ in range(3)]
+        deliveries = self.engine.assign(orders)
+        self.assertEqual(len(deliveries), 2)
+        self.assertEqual(
+            sorted(delivery.delivery_partner_id for delivery in deliveries),
+            sorted(partner.id for partner in self.partners),
+        )
+        self.assertFalse(User.objects.filter(role='delivery_partner', is_available=True).exists())
+        self.assertEqual(rollups.get_rollup('delivery_partner', self.partners[0].id).deliveries, 1)
+
+    def test_already_assigned_order_releases_its_partner(self):
+        order = self.paid_order()
+        self.engine.assign([order])
+        self.assertEqual(self.engine.assign([order]), [])
+        self.assertEqual(User.objects.filter(role='delivery_partner', is_available=True).count(), 1)
+
+    def test_mark_paid_uses_the_engine(self):
+        order = Order.objects.create(customer=self.customer, product=self.product, status='accepted')
+        order.mark_paid()
+        self.assertTrue(Delivery.objects.filter(order=order).exists())
+
+
+    def test_failed_delivery_creation_releases_the_partners(self):
+        with mock.patch.object(Delivery.objects, 'bulk_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.engine.assign([self.paid_order(), self.paid_order()])
+        self.assertEqual(User.objects.filter(role='delivery_partner', is_available=True).count(), 2)
+
+
+@override_settings(NOTIFICATION_DISPATCH_MODE='sync')
+class AssignmentReleaseRetryTests(TransactionTestCase):
+    def test_release_is_retried_when_it_hits_a_lock(self):
+        customer = User.objects.create_user(username='customer', role='customer')
+        maker = User.objects.create_user(username='maker', role='maker')
+        product = Product.objects.create(maker=maker, name='Injera', price=Decimal('10'), stock=5)
+        order = Order.objects.create(customer=customer, product=product, quantity=1, total_price=Decimal('10'), status='paid')
+        User.objects.create_user(username='partner', role='delivery_partner', is_available=True)
+        engine = AssignmentEngine()
+        release, calls = engine.release, []
+
+        def locked_once(partner_ids):
+            calls.append(partner_ids)
+            if len(calls) == 1:
+                raise OperationalError('database table is locked')
+            release(partner_ids)
+
+        with mock.patch.object(Delivery.objects, 'bulk_create', side_effect=RuntimeError), \
+                mock.patch('core.assignment.RELEASE_RETRY_DELAY', 0), \
+                mock.patch.object(engine, 'release', side_effect=locked_once):
+            with self.assertRaises(RuntimeError):
+                engine.assign([order])
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(User.objects.get(username='partner').is_available)
+
+
+@override_settings(NOTIFICATION_DISPATCH_MODE='sync')
+class AssignmentConcurrencyTests(TransactionTestCase):
+    def test_concurrent_assignments_never_share_a_partner(self):
+        customer = User.objects.create_user(username='customer', role='customer')
+        maker = User.objects.create_user(username='maker', role='maker')
+        product = Product.objects.create(maker=maker, name='Injera', price=Decimal('2.00'))
+        partners = [User.objects.create_user(username=f'partner{i}', role='delivery_partner') for i in range(4)]
+        orders = [Order.objects.create(customer=customer, product=product, status='paid') for _ in range(8)]
+        errors = []
+
+        def worker(order):
+            try:
+                while True:
+                    try:
+                        AssignmentEngine().assign([order])
+                        break
+                    except OperationalError:
+                        # SQLite serializes writers; retry, claimed partners were released
+                        continue
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(order,)) for order in orders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        assigned = list(Delivery.objects.values_list('delivery_partner_id', flat=True))
+        self.assertEqual(sorted(assigned), sorted(partner.id for partner in partners))
+        # Four deliveries, one per partner, and no partner left claimed without one
+        self.assertFalse(User.objects.filter(role='delivery_partner', is_available=True).exists())
+
+
+class GeoIndexTests(TestCase):
+    def test_grid_nearest_matches_brute_force(self):
+        rng = random.Random(7)
+        index = PartnerGridIndex(cell_size=0.01)
+        points = {i: (9 + rng.uniform(-0.2, 0.2), 38.7 + rng.uniform(-0.2, 0.2)) for i in range(2000)}
+        for partner_id, (lat, lon) in points.items():
+            index.add(partner_id, lat, lon)
+        for _ in range(50):
+            lat, lon = 9 + rng.uniform(-0.3, 0.3), 38.7 + rng.uniform(-0.3, 0.3)
+            expected = sorted(points, key=lambda i: haversine_km(lat, lon, *points[i]))[:5]
+            self.assertEqual([partner_id for _, partner_id in index.nearest(lat, lon, 5)], expected)
+
+    def test_removed_partners_are_not_returned(self):
+        index = PartnerGridIndex()
+        index.add(1, 9.0, 38.7)
+        index.add(2, 9.5, 38.7)
+        index.remove(1)
+        self.assertEqual([partner_id for _, partner_id in index.nearest(9.0, 38.7, 2)], [2])
+
+
+class NearestAssignmentTests(TestCase):
+    def setUp(self):
+        locator.invalidate()
+        self.customer = User.objects.create_user(username='customer', role='customer')
+        self.maker = User.objects.create_user(username='maker', role='maker', latitude=9.03, longitude=38.74)
+        self.product = Product.objects.create(maker=self.maker, name='Injera', price=Decimal('2.00'))
+        self.far = User.objects.create_user(username='far', role='delivery_partner', latitude=9.30, longitude=38.74)
+        self.near = User.objects.create_user(username='near', role='delivery_partner', latitude=9.04, longitude=38.75)
+
+    def tearDown(self):
+        locator.invalidate()
+
+    def test_nearest_partner_gets_the_order_and_leaves_the_index(self):
+        order = Order.objects.create(customer=self.customer, product=self.product, status='paid')
+        [delivery] = NearestPartnerEngine().assign([order])
+        self.assertEqual(delivery.delivery_partner_id, self.near.id)
+        self.assertEqual([partner_id for _, partner_id in locator.nearest(9.03, 38.74, 2)], [self.far.id])
+
+    def test_nearest_partners_endpoint_and_location_updates(self):
+        client = APIClient()
+        client.force_authenticate(self.near)
+        response = client.post('/api/deliveries/update_location/', {'latitude': 9.5, 'longitude': 38.74})
+        self.assertEqual(response.status_code, 200)
+
+        client.force_authenticate(self.maker)
+        response = client.get('/api/deliveries/nearest_partners/')
+        self.assertEqual([row['username'] for row in response.data], ['far', 'near'])
+
+
+class BatchDispatchTests(TestCase):
+    def setUp(self):
+        locator.invalidate()
+        self.customer = User.objects.create_user(username='customer', role='customer')
+        self.west = User.objects.create_user(username='west', role='maker', latitude=9.0, longitude=38.70)
+        self.east = User.objects.create_user(username='east', role='maker', latitude=9.0, longitude=38.80)
+        # Greedy in order: west takes middle, east gets the far partner
+        self.middle = User.objects.create_user(username='middle', role='delivery_partner', latitude=9.0, longitude=38.749)
+        self.far_west = User.objects.create_user(username='far_west', role='delivery_partner', latitude=9.0, longitude=38.60)
+
+    def tearDown(self):
+        locator.invalidate()
+
+    def paid_order(self, maker):
+        product = Product.objects.create(maker=maker, name='Injera', price=Decimal('2.00'))
+        return Order.objects.create(customer=self.customer, product=product, total_price=product.price, status='paid')
+
+    def test_hungarian_matches_brute_force(self):
+        rng = random.Random(7)
+        for _ in range(50):
+            rows, cols = rng.randint(1, 5), rng.randint(1, 5)
+            cost = [[rng.random() for _ in range(cols)] for _ in range(rows)]
+            pairs = hungarian(cost)
+            self.assertEqual(len(pairs), min(rows, cols))
+            if rows <= cols:
+                best = min(sum(cost[r][p[r]] for r in range(rows)) for p in itertools.permutations(range(cols), rows))
+            else:
+                best = min(sum(cost[p[c]][c] for c in range(cols)) for p in itertools.permutations(range(rows), cols))
+            self.assertAlmostEqual(sum(cost[r][c] for r, c in pairs), best)
+
+    @override_settings(DELIVERY_DISPATCH_MODE='batch')
+    def test_dispatch_minimises_total_distance(self):
+        west_order, east_order = self.paid_order(self.west), self.paid_order(self.east)
+        report = BatchDispatcher().dispatch()
+        self.assertEqual(report['assigned'], 2)
+        self.assertEqual(Delivery.objects.get(order=west_order).delivery_partner_id, self.far_west.id)
+        self.assertEqual(Delivery.objects.get(order=east_order).delivery_partner_id, self.middle.id)
+        self.assertFalse(User.objects.filter(role='delivery_partner', is_available=True).exists())
+        self.assertEqual(BatchDispatcher().dispatch()['orders'], 0)
+
+    @override_settings(DELIVERY_DISPATCH_MODE='batch')
+    def test_batch_mode_leaves_paid_orders_to_the_dispatcher(self):
+        order = self.paid_order(self.west)
+        order.status = 'accepted'
+        order.mark_paid()
+        self.assertFalse(Delivery.objects.filter(order=order).exists())
+
+        client = APIClient()
+        client.force_authenticate(self.west)
+        response = client.post('/api/deliveries/auto_assign/', {'batch': True}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['assigned'], 1)
+        self.assertEqual(Delivery.objects.get(order=order).delivery_partner_id, self.middle.id)
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user(username='customer', role='customer')
+        self.maker = User.objects.create_user(username='maker', role='maker')
+        self.injera = Product.objects.create(maker=self.maker, name='Injera', price=Decimal('2.00'), stock=3)
+        self.wot = Product.objects.create(maker=self.maker, name='Doro wot', price=Decimal('9.00'), stock=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def stock(self, product):
+        product.refresh_from_db()
+        return product.stock
+
+    def test_orders_reserve_stock_and_refuse_to_oversell(self):
+        response = self.client.post('/api/orders/', {'product': self.injera.id, 'quantity': 2})
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(self.stock(self.injera), 1)
+        response = self.client.post('/api/orders/', {'product': self.injera.id, 'quantity': 2})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stock(self.injera), 1)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_bulk_checkout_is_all_or_nothing(self):
+        items = [{'product': self.injera.id, 'quantity': 2}, {'product': self.wot.id, 'quantity': 2}]
+        response = self.client.post('/api/orders/bulk/', {'items': items}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((self.stock(self.injera), self.stock(self.wot)), (3, 1))
+        self.assertFalse(Order.objects.exists())
+
+        items[1]['quantity'] = 1
+        response = self.client.post('/api/orders/bulk/', {'items': items}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([row['total_price'] for row in response.data], ['4.00', '9.00'])
+        self.assertEqual((self.stock(self.injera), self.stock(self.wot)), (1, 0))
+        self.assertEqual(Payment.objects.filter(order__customer=self.customer).count(), 2)
+        self.assertEqual(rollups.get_rollup('platform', 0).orders, 2)
+
+    def test_cancel_and_refund_release_stock_once(self):
+        first, second = place_orders(self.customer, [(self.injera.id, 2), (self.wot.id, 1)])
+        stale = Order.objects.get(pk=first.pk)
+        first.cancel_order()
+        stale.cancel_order()
+        self.assertEqual(self.stock(self.injera), 3)
+
+        second.payment.status = 'paid'
+        second.payment.save()
+        second.payment.process_refund()
+        self.assertEqual(self.stock(self.wot), 1)
+        second.refresh_from_db()
+        self.assertEqual(second.status, 'cancelled')
+
+        with self.assertRaises(OutOfStock):
+            place_orders(self.customer, [(self.wot.id, 2)])
+
+    def test_status_cannot_be_patched_around_the_cancel_action(self):
+        [order] = place_orders(self.customer, [(self.injera.id, 2)])
+        response = self.client.patch(f'/api/orders/{order.id}/', {'status': 'cancelled'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'pending')
+        self.assertEqual(self.stock(self.injera), 1)
+
+        response = self.client.post(f'/api/orders/{order.id}/cancel/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock(self.injera), 3)
+
+    def test_status_changes_keep_the_agreed_price(self):
+        [order] = place_orders(self.customer, [(self.injera.id, 1)])
+        Product.objects.filter(pk=self.injera.pk).update(price=Decimal('5.00'))
+        order = Order.objects.get(pk=order.pk)
+        order.accept_order()
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Decimal('2.00'))
+
+
+@override_settings(NOTIFICATION_DISPATCH_MODE='sync')
+class CartCheckoutTests(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user(username='customer', role='customer')
+        self.bakery = User.objects.create_user(username='bakery', role='maker')
+        self.kitchen = User.objects.create_user(username='kitchen', role='maker')
+        self.injera = Product.objects.create(maker=self.bakery, name='Injera', price=Decimal('2.00'), stock=10)
+        self.wot = Product.objects.create(maker=self.kitchen, name='Doro wot', price=Decimal('9.00'), stock=5)
+        self.shiro = Product.objects.create(maker=self.kitchen, name='Shiro', price=Decimal('6.00'), stock=5)
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def test_checkout_creates_one_order_payment_and_notification_per_maker(self):
+        items = [
+            {'product': self.injera.id, 'quantity': 4, 'price': '2.00'},
+            {'product': self.wot.id, 'quantity': 1},
+            {'product': self.shiro.id, 'quantity': 2},
+        ]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post('/api/orders/checkout/', {'items': items}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [(row['product'], row['line_count'], row['total_price']) for row in response.data],
+            [(self.injera.id, 1, '8.00'), (self.wot.id, 2, '21.00')],
+        )
+        self.assertEqual(len(response.data[1]['lines']), 2)
+        self.assertEqual(Payment.objects.count(), 2)
+        self.assertEqual(Notification.objects.filter(user__in=[self.bakery, self.kitchen]).count(), 2)
+        self.assertEqual(len([q for q in context.captured_queries if 'FROM "core_product"' in q['sql'] and q['sql'].startswith('SELECT')]), 1)
+        self.injera.refresh_from_db()
+        self.assertEqual(self.injera.stock, 6)
+
+    def test_stale_price_or_missing_stock_creates_nothing(self):
+        response = self.client.post('/api/orders/checkout/', {'items': [
+            {'product': self.injera.id, 'quantity': 1, 'price': '1.50'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/orders/checkout/', {'items': [
+            {'product': self.injera.id, 'quantity': 1},
+            {'product': self.wot.id, 'quantity': 6},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.injera.refresh_from_db()
+        self.assertEqual(self.injera.stock, 10)
+
+    def test_cancel_releases_every_line_and_rollups_match_rebuild(self):
+        bakery_order, kitchen_order = checkout_cart(
+            self.customer, [(self.injera.id, 2, None), (self.wot.id, 1, None), (self.shiro.id, 3, None)],
+        )
+        kitchen_order = Order.objects.get(pk=kitchen_order.pk)
+        kitchen_order.cancel_order()
+        self.shiro.refresh_from_db()
+        self.assertEqual(self.shiro.stock, 5)
+        self.assertEqual(rollups.get_rollup('product', self.shiro.id).order_value, Decimal('18.00'))
+        self.assertEqual({row['product__name'] for row in rollups.top_products(self.kitchen.id)}, {'Doro wot', 'Shiro'})
+        Order.objects.get(pk=bakery_order.pk).delete()
+
+        fields = ['orders', 'order_value', 'pending_orders', 'delivered_orders', 'delivered_revenue', 'paid_revenue']
+        incremental = rollup_buckets(fields)
+        rollups.rebuild()
+        rebuilt = rollup_buckets(fields)
+        for bucket, values in rebuilt.items():
+            self.assertEqual(incremental.get(bucket), values, bucket)
+
+
+# One platform shard, so the query counts don't depend on whether the shard drawn has buckets yet
+@override_settings(NOTIFICATION_DISPATCH_MODE='sync', ROLLUP_PLATFORM_SHARDS=1)
+class BulkTransitionTests(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user(username='customer', role='customer')
+        self.maker = User.objects.create_user(username='maker', role='maker')
+        self.other_maker = User.objects.create_user(username='other', role='maker')
+        self.partner = User.objects.create_user(username='partner', role='delivery_partner')
+        self.injera = Product.objects.create(maker=self.maker, name='Injera', price=Decimal('2.00'), stock=100)
+        self.wot = Product.objects.create(maker=self.other_maker, name='Doro wot', price=Decimal('9.00'), stock=10)
+        self.orders = place_orders(self.customer, [(self.injera.id, 2)] * 40)
+        self.client = APIClient()
+
+    def post(self, user, path, ids):
+        self.client.force_authenticate(user)
+        response = self.client.post(path, {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return {row['id']: row['result'] for row in response.data['results']}
+
+    def assertRollupsMatchRebuild(self):
+        fields = ['orders', 'pending_orders', 'delivered_orders', 'delivered_revenue', 'paid_revenue', 'completed_deliveries']
+        incremental = rollup_buckets(fields)
+        rollups.rebuild()
+        rebuilt = rollup_buckets(fields)
+        for bucket, values in rebuilt.items():
+            self.assertEqual(incremental.get(bucket), values, bucket)
+
+    def test_accept_forty_orders_in_constant_queries(self):
+        ids = [order.id for order in self.orders]
+        self.client.force_authenticate(self.maker)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post('/api/orders/bulk_accept/', {'ids': ids}, format='json')
+        results = {row['id']: row['result'] for row in response.data['results']}
+        self.assertEqual(set(results.values()), {'accepted'})
+        self.assertEqual(Order.objects.filter(status='accepted').count(), 40)
+        self.assertEqual(len([q for q in context.captured_queries if q['sql'].startswith('UPDATE "core_order"')]), 1)
+        self.assertEqual(len([q for q in context.captured_queries if q['sql'].startswith('INSERT INTO "core_notification"')]), 1)
+        self.assertLess(len(context.captured_queries), 20)
+        self.assertEqual(Notification.objects.filter(user=self.customer, message__contains='accepted').count(), 40)
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.unread_notifications, 40)
+        self.assertEqual(rollups.get_rollup('platform').pending_orders, 0)
+        self.assertRollupsMatchRebuild()
+
+    def test_results_per_id(self):
+        [foreign] = place_orders(self.customer, [(self.wot.id, 1)])
+        self.orders[1].accept_order()
+        results = self.post(self.maker, '/api/orders/bulk_accept/', [self.orders[0].id, self.orders[1].id, foreign.id, 999999])
+        self.assertEqual(results, {
+            self.orders[0].id: 'accepted', self.orders[1].id: 'invalid_status',
+            foreign.id: 'not_authorized', 999999: 'not_found',
+        })
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.status, 'pending')
+
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.post('/api/orders/bulk_accept/', {'ids': [foreign.id]}, format='json').status_code, 403)
+        self.assertEqual(self.client.post('/api/orders/bulk_cancel/', {'ids': 'all'}, format='json').status_code, 400)
+
+    def test_cancel_returns_stock_and_fails_payments(self):
+        [cart] = checkout_cart(self.customer, [(self.injera.id, 3, None), (self.injera.id, 1, None)])
+        self.orders[0].accept_order()
+        self.orders[0].mark_paid()
+        ids = [self.orders[0].id, self.orders[1].id, self.orders[2].id, cart.id]
+        results = self.post(self.customer, '/api/orders/bulk_cancel/', ids)
+        self.assertEqual(results, {
+            self.orders[0].id: 'invalid_status', self.orders[1].id: 'cancelled',
+            self.orders[2].id: 'cancelled', cart.id: 'cancelled',
+        })
+        self.injera.refresh_from_db()
+        # 40 orders of 2 and the cart's 4 were taken; two orders of 2 and the cart come back
+        self.assertEqual(self.injera.stock, 100 - 40 * 2 - 4 + 2 * 2 + 4)
+        self.assertEqual(Payment.objects.filter(status='failed').count(), 3)
+        self.assertEqual(Notification.objects.filter(message__contains='failed').count(), 3)
+        self.assertRollupsMatchRebuild()
+
+        # The maker may cancel too; a cancelled order stays cancelled
+        results = self.post(self.maker, '/api/orders/bulk_cancel/', [self.orders[1].id, self.orders[3].id])
+        self.assertEqual(results, {self.orders[1].id: 'invalid_status', self.orders[3].id: 'cancelled'})
+
+    def test_partner_moves_deliveries_to_completed(self):
+        other_partner = User.objects.create_user(username='other_partner', role='delivery_partner')
+        deliveries = []
+        for order, partner in zip(self.orders[:4], [self.partner] * 3 + [other_partner]):
+            order.assign_for_delivery(partner)
+            deliveries.append(order.delivery)
+        ids = [delivery.id for delivery in deliveries]
+
+        results = self.post(self.partner, '/api/deliveries/bulk_mark_in_transit/', ids[:2] + ids[3:])
+        self.assertEqual(results, {ids[0]: 'in_transit', ids[1]: 'in_transit', ids[3]: 'not_authorized'})
+        results = self.post(self.partner, '/api/deliveries/bulk_mark_completed/', ids[:3])
+        self.assertEqual(results, {ids[0]: 'completed', ids[1]: 'completed', ids[2]: 'invalid_status'})
+
+        self.assertEqual(
+            list(Order.objects.filter(pk__in=[order.id for order in self.orders[:3]]).order_by('id').values_list('status', flat=True)),
+            ['delivered', 'delivered', 'in_delivery'],
+        )
+        self.assertTrue(Delivery.objects.get(pk=ids[0]).delivered_at)
+        self.assertEqual(Notification.objects.filter(message__contains='out for delivery').count(), 2)
+        self.assertEqual(Notification.objects.filter(message__contains='has been delivered!').count(), 2)
+        self.assertEqual(rollups.get_rollup('delivery_partner', self.partner.id).completed_deliveries, 2)
+        self.assertRollupsMatchRebuild()
+
+        self.client.force_authenticate(self.maker)
+        self.assertEqual(self.client.post('/api/deliveries/bulk_mark_completed/', {'ids': ids}, format='json').status_code, 403)
+
+    def test_transitioned_follows_every_bulk_move(self):
+        self.orders[0].accept_order()
+        self.orders[0].mark_paid()
+        moves = []
+
+        def receiver(sender, instance, name, source, target, batch, **kwargs):
+            moves.append((sender.__name__, instance.pk, name, source, target, len(batch)))
+
+        transitioned.connect(receiver)
+        self.addCleanup(transitioned.disconnect, receiver)
+        ids = [order.id for order in self.orders[:3]]
+        self.post(self.customer, '/api/orders/bulk_cancel/', ids)
+        cancelled = [order.id for order in self.orders[1:3]]
+        payments = list(Payment.objects.filter(order_id__in=cancelled).order_by('id').values_list('id', flat=True))
+        self.assertEqual(sorted(moves), sorted(
+            [('Order', pk, 'cancel', 'pending', 'cancelled', 2) for pk in cancelled]
+            + [('Payment', pk, 'fail', 'pending', 'failed', 2) for pk in payments]
+        ))
+        self.assertRollupsMatchRebuild()
+
+
+@override_settings(NOTIFICATION_DISPATCH_MODE='sync', DELIVERY_DISPATCH_MODE='batch')
+class StatusTransitionTests(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user(username='customer', role='customer')
+        self.maker = User.objects.create_user(username='maker', role='maker')
+        self.partner = User.objects.create_user(username='partner', role='delivery_partner')
+        self.injera = Product.objects.create(maker=self.maker, name='Injera', price=Decimal('2.00'), stock=10)
+        [self.order] = place_orders(self.customer, [(self.injera.id, 2)])
+
+    def test_only_one_of_two_stale_copies_wins(self):
+        first, second = Order.objects.get(pk=self.order.pk), Order.objects.get(pk=self.order.pk)
+        self.assertTrue(first.accept_order())
+        self.assertFalse(second.accept_order())
+        self.assertEqual(Notification.objects.filter(message__contains='accepted').count(), 1)
+
+        # The loser can't push the order back along a transition it already left
+        self.assertFalse(second.cancel_order())
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'accepted')
+        self.injera.refresh_from_db()
+        self.assertEqual(self.injera.stock, 8)
+
+    def test_writes_only_the_status(self):
+        with CaptureQueriesContext(connection) as context:
+            self.assertTrue(self.order.accept_order())
+        [update] = [q['sql'] for q in context.captured_queries if q['sql'].startswith('UPDATE "core_order"')]
+        self.assertIn('SET "status" = \'accepted\'', update)
+        self.assertIn('"core_order"."status" = \'pending\'', update)
+        self.assertNotIn('total_price', update)
+
+    def test_signal_and_rollups_follow_the_lifecycle(self):
+        received = []
+
+        def receiver(sender, name, source, target, **kwargs):
+            received.append((sender.__name__, name, source, target))
+        transitioned.connect(receiver)
+        self.addCleanup(transitioned.disconnect, receiver)
+
+        self.order.accept_order()
+        self.order.payment.process_payment()
+        self.order.assign_for_delivery(self.partner)
+        self.order.delivery.mark_in_transit()
+        self.order.delivery.mark_completed()
+        self.assertFalse(self.order.payment.mark_failed())
+        self.assertEqual(received, [
+            ('Order', 'accept', 'pending', 'accepted'),
+            ('Payment', 'pay', 'pending', 'paid'),
+            ('Order', 'pay', 'accepted', 'paid'),
+            ('Order', 'assign', 'paid', 'in_delivery'),
+            ('Delivery', 'start', 'assigned', 'in_transit'),
+            ('Delivery', 'complete', 'in_transit', 'completed'),
+            ('Order', 'deliver', 'in_delivery', 'delivered'),
+        ])
+
+        fields = ['orders', 'pending_orders', 'delivered_orders', 'delivered_revenue', 'paid_revenue', 'completed_deliveries']
+        incremental = rollup_buckets(fields)
+        self.assertEqual(rollups.get_rollup('maker', self.maker.id).delivered_revenue, Decimal('4.00'))
+        rollups.rebuild()
+        rebuilt = rollup_buckets(fields)
+        self.assertEqual(incremental, rebuilt)
+
+    def test_refund_cancels_a_paid_order_once(self):
+        payment = self.order.payment
+        stale = Payment.objects.get(pk=payment.pk)
+        self.assertTrue(payment.process_payment())
+        self.assertFalse(stale.process_payment())
+        self.assertTrue(payment.process_refund())
+        self.assertFalse(payment.process_refund())
+        self.order.refresh_from_db()
+        self.injera.refresh_from_db()
+        self.assertEqual((self.order.status, self.injera.stock), ('cancelled', 10))
+        self.assertEqual(rollups.get_rollup('platform').paid_revenue, 0)
+
+    def test_refunding_a_delivered_order_returns_no_stock(self):
+        self.order.accept_order()
+        self.order.payment.process_payment()
+        self.order.assign_for_delivery(self.partner)
+        self.order.delivery.mark_in_transit()
+        self.order.delivery.mark_completed()
+        payment = Payment.objects.get(pk=self.order.payment.pk)
+        self.assertTrue(payment.process_refund())
+        self.order.refresh_from_db()
+        self.injera.refresh_from_db()
+        self.assertEqual((self.order.status, self.injera.stock), ('cancelled', 8))
+
+    def test_payment_rolls_back_when_the_order_was_cancelled_meanwhile(self):
+        def cancel_in_between(sender, name, **kwargs):
+            if sender is Payment and name == 'pay':
+                Order.objects.filter(pk=self.order.pk).update(status='cancelled')
+        transitioned.connect(cancel_in_between)
+        self.addCleanup(transitioned.disconnect, cancel_in_between)
+
+        payment = Payment.objects.get(pk=self.order.payment.pk)
+        self.assertFalse(payment.process_payment())
+        self.assertEqual(payment.status, 'pending')
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status, 'pending')
+        self.assertFalse(Notification.objects.filter(message__contains='successful').exists())
+        self.assertEqual(rollups.get_rollup('platform').paid_revenue, 0)
+
+    def test_paid_orders_are_not_cancelled(self):
+        # As if the payment went through after the order was loaded
+        Payment.objects.filter(order=self.order).update(status='paid')
+        self.assertFalse(self.order.cancel_order())
+        self.assertEqual(self.order.status, 'pending')
+        self.order.refresh_from_db()
+        self.injera.refresh_from_db()
+        self.assertEqual((self.order.status, self.injera.stock), ('pending', 8))
+
+    def test_refund_rolls_back_when_the_order_cannot_be_cancelled(self):
+        payment = self.order.payment
+        self.assertTrue(payment.process_payment())
+        with mock.patch.object(Order, 'release_reservation', return_value=False):
+            self.assertFalse(payment.process_refund())
+        self.assertEqual(payment.status, 'paid')
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'paid')
+        self.assertEqual(rollups.get_rollup('platform').paid_revenue, Decimal('4.00'))
+        self.assertTrue(payment.process_refund())
+        self.assertEqual(rollups.get_rollup('platform').paid_revenue, 0)
+
+    def test_refused_actions_answer_409_with_the_current_status(self):
+        client = APIClient()
+        client.force_authenticate(self.maker)
+        self.assertEqual(client.post(f'/api/orders/{self.order.id}/accept/').status_code, 200)
+        response = client.post(f'/api/orders/{self.order.id}/accept/')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['status'], 'accepted')
+        response = client.post(f'/api/payments/{self.order.payment.id}/refund/')
+        self.assertEqual((response.status_code, response.data['status']), (409, 'pending'))
+
+    def test_status_is_read_only_in_the_api(self):
+        client = APIClient()
+        client.force_authenticate(self.maker)
+        response = client.patch(f'/api/payments/{self.order.payment.id}/', {'status': 'paid'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'pending')
+        self.assertEqual(Payment.objects.get(pk=self.order.payment.pk).status, 'pending')
+
+
+@override_settings(NOTIFICATION_DISPATCH_MODE='sync')
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        catalog_cache.reset_stats()
+        self.customer = User.objects.create_user(username='customer', role='customer')
+        self.maker = User.objects.create_user(username='maker', role='maker')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.injera = Product.objects.create(maker=self.maker, name='Injera', price=Decimal('2.00'), stock=5)
+            self.wot = Product.objects.create(maker=self.maker, name='Doro wot', price=Decimal('9.00'), stock=5)
+        self.client = APIClient()
+
+    def get(self, url, **headers):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, headers=headers)
+        return response, len(context.captured_queries)
+
+    def test_repeated_reads_are_served_from_cache(self):
+        response, queries = self.get('/api/products/')
+        self.assertEqual((response['X-Cache'], len(response.json()['results'])), ('MISS', 2))
+        response, queries = self.get('/api/products/')
+        self.assertEqual((response['X-Cache'], queries), ('HIT', 0))
+        self.get(f'/api/products/{self.injera.id}/')
+        response, queries = self.get(f'/api/products/{self.injera.id}/')
+        self.assertEqual((response['X-Cache'], queries, response.json()['name']), ('HIT', 0, 'Injera'))
+        self.assertEqual(catalog_cache.stats(), {'hits': 2, 'misses': 2, 'not_modified': 0})
+
+    def test_etag_returns_304_until_the_product_changes(self):
+        etag = self.get(f'/api/products/{self.injera.id}/')[0]['ETag']
+        response, queries = self.get(f'/api/products/{self.injera.id}/', if_none_match=etag)
+        self.assertEqual((response.status_code, queries), (304, 0))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.wot.price = Decimal('10.00')
+            self.wot.save()
+        # Another product changed: this one's ETag still holds, the list's doesn't
+        self.assertEqual(self.get(f'/api/products/{self.injera.id}/', if_none_match=etag)[0].status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            place_orders(self.customer, [(self.injera.id, 2)])
+        response, _ = self.get(f'/api/products/{self.injera.id}/', if_none_match=etag)
+        self.assertEqual((response.status_code, response.json()['stock']), (200, 3))
+
+    def test_list_is_invalidated_on_delete(self):
+        list_etag = self.get('/api/products/')[0]['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.wot.delete()
+        response, _ = self.get('/api/products/', if_none_match=list_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['name'] for row in response.json()['results']], ['Injera'])
+
+
+class ProductRatingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.maker = User.objects.create_user(username='maker', role='maker')
+        self.customers = [User.objects.create_user(username=f'customer{i}', role='customer') for i in range(4)]
+        self.injera, self.wot, self.tibs = [
+            Product.objects.create(maker=self.maker, name=name, price=Decimal('2.00')) for name in ('Injera', 'Doro wot', 'Tibs')
+        ]
+
+    def review(self, product, customer, rating):
+        return Review.objects.create(product=product, customer=customer, rating=rating)
+
+    def ratings(self, product):
+        product.refresh_from_db()
+        return product.rating_count, product.rating_sum, product.rating_average
+
+    def test_counters_follow_review_changes(self):
+        first = self.review(self.injera, self.customers[0], 5)
+        self.review(self.injera, self.customers[1], 2)
+        self.assertEqual(self.ratings(self.injera), (2, 7, 3.5))
+
+        stale = Review.objects.get(pk=first.pk)
+        first.rating = 3
+        first.save()
+        stale.rating = 4
+        stale.save()
+        self.assertEqual(self.ratings(self.injera), (2, 6, 3.0))
+
+        first.refresh_from_db()
+        first.product = self.wot
+        first.save()
+        self.assertEqual(self.ratings(self.injera), (1, 2, 2.0))
+        self.assertEqual(self.ratings(self.wot), (1, 4, 4.0))
+
+        first.delete()
+        self.customers[1].delete()
+        self.assertEqual(self.ratings(self.injera), (0, 0, 0.0))
+        self.assertEqual(self.ratings(self.wot), (0, 0, 0.0))
+
+        self.review(self.tibs, self.customers[2], 4)
+        Product.objects.filter(pk=self.tibs.pk).update(rating_count=7)
+        call_command('reconcile_ratings', stdout=io.StringIO())
+        self.assertEqual(self.ratings(self.tibs), (1, 4, 4.0))
+
+    def test_serializers_expose_ratings_read_only(self):
+        self.review(self.injera, self.customers[0], 4)
+        client = APIClient()
+        client.force_authenticate(self.maker)
+        response = client.patch(f'/api/products/{self.injera.id}/', {'rating_count': 100}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['rating_count'], response.data['rating_sum'], response.data['rating_average']), (1, 4, 4.0))
+
+        client.force_authenticate(self.customers[0])
+        review = client.get('/api/reviews/').data['results'][0]
+        self.assertEqual((review['product_rating_count'], review['product_rating_average']), (1, 4.0))
+
+    @override_settings(TOP_RATED_MIN_REVIEWS=2)
+    def test_top_rated_and_sort_by_rating(self):
+        for product, ratings in ((self.injera, [4, 4]), (self.wot, [5, 5, 4]), (self.tibs, [5])):
+            for customer, rating in zip(self.customers, ratings):
+                self.review(product, customer, rating)
+
+        response = APIClient().get('/api/products/top_rated/')
+        self.assertEqual([row['id'] for row in response.data['results']], [self.wot.id, self.injera.id])
+
+        response = self.client.get('/api/products/', {'sort': 'rating', 'page_size': 2})
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.tibs.id, self.wot.id])
+        response = self.client.get(response.json()['next'])
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.injera.id])
+
+        # A new review moves the product and invalidates the cached pages
+        with self.captureOnCommitCallbacks(execute=True):
+            self.review(self.tibs, self.customers[1], 1)
+        response = APIClient().get('/api/products/top_rated/')
+        self.assertEqual([row['id'] for row in response.data['results']], [self.wot.id, self.injera.id, self.tibs.id])
+
+    def test_rating_order_uses_its_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + str(Product.objects.order_by('-rating_average', '-rating_count', '-id')[:10].query))
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('product_rating_idx', plan)
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.bakery = User.objects.create_user(username='addis_bakery', role='maker')
+        self.kitchen = User.objects.create_user(username='mama_kitchen', role='maker')
+        self.injera = Product.objects.create(maker=self.bakery, name='Teff injera', description='Sour flatbread', price=Decimal('2.00'))
+        self.kitfo = Product.objects.create(maker=self.kitchen, name='Kitfo', description='Minced beef with injera on the side', price=Decimal('14.00'))
+        self.wot = Product.objects.create(maker=self.kitchen, name='Doro wot', description='Spicy chicken stew', price=Decimal('9.00'), available=False)
+
+    def ids(self, params):
+        response = APIClient().get('/api/products/search/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [row['id'] for row in response.data['results']]
+
+    def test_ranks_name_matches_first_and_matches_prefixes(self):
+        self.assertEqual(self.ids({'q': 'injera'}), [self.injera.id, self.kitfo.id])
+        self.assertEqual(self.ids({'q': 'inj'}), [self.injera.id, self.kitfo.id])
+        self.assertEqual(self.ids({'q': 'stew chick'}), [self.wot.id])
+        self.assertCountEqual(self.ids({'q': 'mama'}), [self.kitfo.id, self.wot.id])
+
+    def test_tolerates_typos(self):
+        self.assertEqual(self.ids({'q': 'injeera'}), [self.injera.id, self.kitfo.id])
+        self.assertEqual(self.ids({'q': 'flatbraed'}), [self.injera.id])
+        self.assertEqual(self.ids({'q': 'qwerty'}), [])
+
+    def test_filters_facets_and_pages(self):
+        response = APIClient().get('/api/products/search/', {'q': 'injera mama', 'page_size': 1})
+        self.assertEqual(response.data['count'], 1)
+
+        # Query syntax is not passed through to the index
+        self.assertEqual(self.ids({'q': 'kitchen OR "beef'}), [])
+        response = APIClient().get('/api/products/search/', {'q': 'mama', 'available': 'true', 'page_size': 1})
+        self.assertEqual((response.data['count'], len(response.data['results'])), (1, 1))
+        facets = response.data['facets']
+        self.assertEqual(facets['available'], {'true': 1, 'false': 1})
+        self.assertEqual([band['count'] for band in facets['price']], [0, 1, 1, 0, 0])
+        self.assertEqual(facets['maker'], [{'id': self.kitchen.id, 'username': 'mama_kitchen', 'count': 2}])
+
+        self.assertEqual(self.ids({'q': 'injera', 'min_price': '5'}), [self.kitfo.id])
+        self.assertEqual(self.ids({'q': 'injera', 'maker': self.bakery.id}), [self.injera.id])
+        self.assertEqual(APIClient().get('/api/products/search/', {'q': '  '}).status_code, 400)
+        self.assertEqual(APIClient().get('/api/products/search/', {'q': 'wot', 'min_price': 'cheap'}).status_code, 400)
+
+    def test_index_follows_saves_deletes_and_renames(self):
+        self.wot.name = 'Shiro wot'
+        self.wot.save()
+        self.assertEqual(self.ids({'q': 'shiro'}), [self.wot.id])
+        self.assertEqual(self.ids({'q': 'doro'}), [])
+
+        self.bakery.username = 'gondar_bakery'
+        self.bakery.save()
+        self.assertEqual(self.ids({'q': 'gondar'}), [self.injera.id])
+
+        self.injera.delete()
+        self.assertEqual(self.ids({'q': 'injera'}), [self.kitfo.id])
+
+        Product.objects.filter(pk=self.kitfo.pk).update(name='Tibs')
+        self.assertEqual(search.get_backend().rebuild(), 2)
+        cache.clear()
+        self.assertEqual(self.ids({'q': 'tibs'}), [self.kitfo.id])
+
+    @override_settings(PRODUCT_SEARCH_BACKEND='database')
+    def test_database_backend(self):
+        self.assertEqual(self.ids({'q': 'injera'}), [self.injera.id, self.kitfo.id])
+        self.assertEqual(self.ids({'q': 'spicy chicken'}), [self.wot.id])
+
+    def test_databases_without_the_index_fall_back_to_the_database_backend(self):
+        self.assertIs(search.get_backend(), search.BACKENDS['fts5'])
+        key = (connection.alias, connection.settings_dict['NAME'])
+        with mock.patch.dict(search._fts5_databases, {key: False}):
+            self.assertIs(search.get_backend(), search.BACKENDS['database'])
+            # Saves and searches must not touch the index that isn't there
+            with mock.patch.object(search.Fts5Search, 'reindex', side_effect=AssertionError):
+                self.wot.name = 'Shiro wot'
+                self.wot.save()
+            self.assertEqual(self.ids({'q': 'shiro'}), [self.wot.id])
+
+
+@override_settings(NOTIFICATION_DISPATCH_MODE='sync')
+class AsyncReadViewTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', role='admin', is_staff=True)
+        self.customer = User.objects.create_user(username='customer', role='customer')
+        self.maker = User.objects.create_user(username='maker', role='maker')
+        self.partner = User.objects.create_user(username='partner', role='delivery_partner')
+        products = [
+            Product.objects.create(maker=self.maker, name=f'Dish {i}', price=Decimal('3.00'), stock=10) for i in range(3)
+        ]
+        place_orders(self.customer, [(product.id, 1) for product in products])
+        for i in range(4):
+            Notification.send(self.customer, f'Message {i}')
+        self.client = APIClient()
+
+    def fetch(self, url, user=None, async_views_enabled=True, **headers):
+        """Status and JSON body of a GET, authenticated with a Bearer token"""
+        cache.clear()
+        if user is not None:
+            headers['authorization'] = f'Bearer {AccessToken.for_user(user)}'
+        with self.settings(ASYNC_READ_VIEWS=async_views_enabled):
+            with mock.patch.object(async_views, 'render', wraps=async_views.render) as render:
+                response = self.client.get(url, headers=headers)
+        self.assertEqual(render.called, async_views_enabled)
+        return response.status_code, response.json()
+
+    def assert_same_as_sync(self, url, user=None, **headers):
+        served = self.fetch(url, user, **headers)
+        self.assertEqual(served, self.fetch(url, user, async_views_enabled=False, **headers))
+        return served
+
+    def test_responses_match_the_sync_viewsets(self):
+        product = Product.objects.first()
+        for url, user in [
+            ('/api/products/', None),
+            ('/api/products/?page_size=2', self.customer),
+            (f'/api/products/{product.id}/', None),
+            ('/api/products/999999/', None),
+            ('/api/notifications/?page_size=3', self.customer),
+            ('/api/notifications/', None),
+            ('/api/notifications/unread/', self.customer),
+            ('/api/deliveries/available_partners/', self.maker),
+            ('/api/deliveries/available_partners/', self.customer),
+            ('/api/analytics/dashboard_stats/', self.admin),
+            ('/api/analytics/dashboard_stats/', self.customer),
+            ('/api/analytics/maker_analytics/', self.maker),
+            ('/api/analytics/maker_analytics/?since=2020-01-01&until=2999-12-31', self.maker),
+            ('/api/analytics/dashboard_stats/?since=2020-01-01', self.admin),
+            ('/api/analytics/dashboard_stats/?until=garbage', self.admin),
+            ('/api/analytics/customer_analytics/', self.customer),
+            ('/api/analytics/delivery_analytics/', self.partner),
+        ]:
+            with self.subTest(url=url, user=user):
+                self.assert_same_as_sync(url, user)
+
+    def test_cursor_links_and_errors_match(self):
+        status, page = self.assert_same_as_sync('/api/notifications/?page_size=3', self.customer)
+        self.assertEqual((status, len(page['results'])), (200, 3))
+        status, page = self.assert_same_as_sync(page['next'], self.customer)
+        self.assertEqual([row['message'] for row in page['results']], ['Message 0'])
+        self.assert_same_as_sync('/api/notifications/?cursor=garbage', self.customer)
+        self.assertEqual(
+            self.assert_same_as_sync('/api/notifications/unread/', authorization='Bearer garbage')[0], 401
+        )
+
+    def test_writes_still_go_to_the_viewsets(self):
+        use_token(self.client, self.maker)
+        response = self.client.post('/api/products/', {'maker': self.maker.id, 'name': 'Tibs', 'price': '8.00'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.client.get('/api/products/?page_size=1').json()['results'][0]['name'], 'Tibs')
+
+
+def timeout_after(seconds):
+    def decorator(coroutine_function):
+        async def wrapper(*args, **kwargs):
+            return await asyncio.wait_for(coroutine_function(*args, **kwargs), seconds)
+        return wrapper
+    return decorator
+
+
+@override_settings(NOTIFICATION_DISPATCH_MODE='sync')
+class NotificationStreamTests(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user(username='customer', role='customer')
+        Notification.objects.create(user=self.customer, message='Welcome')
+        self.application = NotificationStreamRouter(application=None)
+
+    async def open_stream(self, query_string):
+        """Start a stream; returns (events queue, disconnect event, task)"""
+        events, disconnect, requested = asyncio.Queue(), asyncio.Event(), []
+
+        async def receive():
+            if not requested:
+                requested.append(True)
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                await events.put(('status', message['status']))
+            elif message.get('body', b'').startswith(b'event:'):
+                await events.put(('event', json.loads(message['body'].decode().split('data: ', 1)[1])))
+
+        scope = {'type': 'http', 'path': '/api/notifications/stream/', 'headers': [], 'query_string': query_string}
+        return events, disconnect, asyncio.ensure_future(self.application(scope, receive, send))
+
+    def test_stream_pushes_new_notifications_and_unread_counts(self):
+        @timeout_after(5)
+        async def scenario():
+            events, disconnect, task = await self.open_stream(f'token={AccessToken.for_user(self.customer)}'.encode())
+            self.assertEqual(await events.get(), ('status', 200))
+            self.assertEqual(await events.get(), ('event', {'type': 'unread', 'unread_count': 1}))
+            self.assertEqual(hub.connections(), 1)
+
+            notification = await sync_to_async(Notification.objects.create)(user=self.customer, message='Order accepted')
+            await sync_to_async(publish_created)([notification])
+            _, event = await events.get()
+            self.assertEqual((event['type'], event['message']), ('notification', 'Order accepted'))
+            self.assertEqual(await events.get(), ('event', {'type': 'unread', 'unread_count': 2}))
+
+            await sync_to_async(self.mark_all_read)()
+            self.assertEqual(await events.get(), ('event', {'type': 'unread', 'unread_count': 0}))
+
+            disconnect.set()
+            await task
+            self.assertEqual(hub.connections(), 0)
+
+        async_to_sync(scenario)()
+
+    def mark_all_read(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.mark_all_read(self.customer.id)
+
+    def test_stream_requires_a_valid_token(self):
+        @timeout_after(5)
+        async def scenario():
+            events, _, task = await self.open_stream(b'token=garbage')
+            await task
+            self.assertEqual(await events.get(), ('status', 401))
+
+        async_to_sync(scenario)()
+        self.assertEqual(hub.connections(), 0)
+
+
+@override_settings(REQUEST_METRICS=True)
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        metrics.registry.reset()
+        cache.clear()
+        self.admin = User.objects.create_user(username='admin', role='admin', is_staff=True)
+        self.customer = User.objects.create_user(username='customer', role='customer')
+        maker = User.objects.create_user(username='maker', role='maker')
+        product = Product.objects.create(maker=maker, name='Injera', price=Decimal('2.00'), stock=10)
+        Order.objects.create(customer=self.customer, product=product, quantity=1)
+        self.client = APIClient()
+
+    def scrape(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_histograms_per_view_in_prometheus_format(self):
+        self.client.force_authenticate(self.customer)
+        self.client.get('/api/orders/')
+        self.client.get('/api/orders/')
+        self.client.get('/api/products/')  # async view
+        self.client.get('/api/orders/999/')
+
+        samples = self.scrape()
+        orders = 'view="order-list",method="GET"'
+        self.assertEqual(samples[f'injera_requests_total{{{orders},status="200"}}'], 2)
+        self.assertEqual(samples['injera_requests_total{view="order-detail",method="GET",status="404"}'], 1)
+        self.assertEqual(samples[f'injera_request_duration_seconds_count{{{orders}}}'], 2)
+        self.assertEqual(samples[f'injera_request_duration_seconds_bucket{{{orders},le="+Inf"}}'], 2)
+        self.assertGreater(samples[f'injera_request_queries_sum{{{orders}}}'], 0)
+        self.assertGreater(samples[f'injera_request_db_duration_seconds_sum{{{orders}}}'], 0)
+        self.assertGreater(samples[f'injera_request_serialization_duration_seconds_sum{{{orders}}}'], 0)
+        # Queries the async view runs in worker threads are counted too
+        products = 'view="core.async_views.product_list",method="GET"'
+        self.assertGreater(samples[f'injera_request_queries_sum{{{products}}}'], 0)
+        self.assertGreater(samples[f'injera_request_serialization_duration_seconds_sum{{{products}}}'], 0)
+
+    def test_metrics_are_admin_only(self):
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+    @override_settings(REQUEST_METRICS_MAX_QUERIES=1)
+    def test_logs_requests_over_the_query_budget_with_their_sql(self):
+        self.client.force_authenticate(self.customer)
+        with self.assertLogs('core.metrics', 'WARNING') as logs:
+            self.client.get('/api/orders/')
+        self.assertIn('GET /api/orders/ (order-list)', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+        with self.assertNoLogs('core.metrics', 'WARNING'):
+            self.client.get('/api/notifications/unread/')
+
+    @override_settings(REQUEST_METRICS=False)
+    def test_disabled(self):
+        self.client.force_authenticate(self.customer)
+        self.client.get('/api/orders/')
+        self.assertNotIn('order-list', metrics.registry.exposition())
+
+
+class ClaimsAuthenticationTests(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        reset_revocations()
+        self.customer = User.objects.create_user(username='customer', password='pass', role='customer')
+        self.maker = User.objects.create_user(username='maker', password='pass', role='maker')
+        self.client = APIClient()
+
+    def tearDown(self):
+        user_cache.clear()
+
+    def login(self, username):
+        response = self.client.post('/api/auth/login/', {'username': username, 'password': 'pass'})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def authenticate(self, token):
+        """request.user and the queries it took"""
+        request = RequestFactory().get('/api/orders/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        with CaptureQueriesContext(connection) as queries:
+            user, _ = ClaimsJWTAuthentication().authenticate(request)
+        return user, len(queries)
+
+    def test_login_tokens_carry_the_role_claims(self):
+        access = AccessToken(self.login('maker')['access'])
+        self.assertEqual(
+            (access['username'], access['role'], access['is_staff']), ('maker', 'maker', False)
+        )
+
+    def test_claims_authenticate_without_a_query(self):
+        user, queries = self.authenticate(self.login('maker')['access'])
+        self.assertEqual(queries, 0)
+        self.assertEqual((user, user.role, user.is_staff), (self.maker, 'maker', False))
+        # Fields not in the token are loaded on first use
+        with self.assertNumQueries(1):
+            self.assertIsNone(user.latitude)
+
+    def test_tokens_without_claims_go_through_the_user_cache(self):
+        token = AccessToken.for_user(self.customer)
+        self.assertEqual(self.authenticate(token)[1], 1)
+        user, queries = self.authenticate(token)
+        self.assertEqual((queries, user.role), (0, 'customer'))
+
+        self.customer.is_active = False
+        self.customer.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(token)
+
+    @override_settings(JWT_CLAIMS_MAX_AGE=0)
+    def test_old_claims_are_not_trusted(self):
+        token = ClaimsAccessToken.for_user(self.customer)
+        User.objects.filter(pk=self.customer.pk).update(role='maker')
+        user, queries = self.authenticate(token)
+        self.assertEqual((queries, user.role), (1, 'maker'))
+
+    def test_refresh_stamps_the_current_role(self):
+        tokens = self.login('customer')
+        self.customer.role = 'maker'
+        self.customer.save()
+        response = self.client.post('/api/auth/refresh/', {'refresh': tokens['refresh']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(AccessToken(response.data['access'])['role'], 'maker')
+
+        self.customer.is_active = False
+        self.customer.save()
+        self.assertEqual(self.client.post('/api/auth/refresh/', {'refresh': tokens['refresh']}).status_code, 401)
+
+    def test_requests_without_a_token_get_401(self):
+        response = self.client.get('/api/orders/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="api"')
+        response = self.client.get('/api/notifications/unread/')  # async view
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="api"')
+
+    def test_views_use_and_save_the_claims_user(self):
+        User.objects.create_user(username='partner', password='pass', role='delivery_partner')
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.login('partner')['access']}")
+        response = self.client.post('/api/deliveries/update_location/', {'latitude': 9.03, 'longitude': 38.74})
+        self.assertEqual(response.status_code, 200)
+        partner = User.objects.get(username='partner')
+        self.assertEqual((partner.latitude, partner.longitude, partner.role), (9.03, 38.74, 'delivery_partner'))
+        self.assertEqual(self.client.get('/api/analytics/maker_analytics/').status_code, 403)
+
+    @override_settings(ALLOWED_HOSTS=['localhost'])
+    def test_benchmark(self):
+        out = io.StringIO()
+        call_command('bench_auth', '--requests', '3', '--json', stdout=out)
+        report = json.loads(out.getvalue())
+        orders = report['orders.list']
+        self.assertEqual(orders['session+jwt']['queries_per_request'] - orders['claims']['queries_per_request'], 1)
+        self.assertEqual(orders['cached_user']['queries_per_request'], orders['claims']['queries_per_request'])
+        self.assertEqual(orders['claims']['statuses'], {'200': 3})
+        self.assertFalse(User.objects.filter(username__startswith='bench_auth').exists())
+
+
+class TokenRevocationTests(TestCase):
+    def setUp(self):
+        reset_revocations()
+        self.customer = User.objects.create_user(username='customer', password='pass', role='customer')
+        self.admin = User.objects.create_user(username='admin', password='pass', role='admin')
+        self.client = APIClient()
+
+    def tearDown(self):
+        revocations.clear()
+
+    def login(self, username):
+        response = self.client.post('/api/auth/login/', {'username': username, 'password': 'pass'})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def post(self, path, token, data=None):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(path, data or {}, format='json')
+
+    def status(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return self.client.get('/api/orders/').status_code
+
+    def test_logout_revokes_the_session_without_a_query_per_check(self):
+        tokens, other = self.login('customer'), self.login('customer')
+        self.assertEqual(self.post('/api/auth/logout/', tokens['access']).status_code, 200)
+        self.assertEqual(self.status(tokens['access']), 401)
+        # The refresh token of the session is revoked, and so are access tokens derived from it
+        self.client.credentials()
+        self.assertEqual(self.client.post('/api/auth/refresh/', {'refresh': tokens['refresh']}).status_code, 401)
+        # Another login of the same user is unaffected
+        self.assertEqual(self.status(other['access']), 200)
+
+        payload = AccessToken(tokens['access']).payload
+        with self.assertNumQueries(0):
+            self.assertTrue(revocations.is_revoked(payload))
+
+    def test_logout_rejects_another_users_refresh_token(self):
+        admin_refresh = self.login('admin')['refresh']
+        response = self.post('/api/auth/logout/', self.login('customer')['access'], {'refresh': admin_refresh})
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(TokenRevocation.objects.exists())
+
+    def test_revoke_all_revokes_earlier_tokens_only(self):
+        first, second = self.login('customer'), self.login('customer')
+        self.assertEqual(self.post('/api/auth/revoke_all/', first['access']).status_code, 200)
+        self.assertEqual((self.status(first['access']), self.status(second['access'])), (401, 401))
+        self.client.credentials()
+        self.assertEqual(self.client.post('/api/auth/refresh/', {'refresh': second['refresh']}).status_code, 401)
+
+        # Logging in again right away, most likely within the same second, gives a valid token
+        later = self.login('customer')
+        self.assertEqual(self.status(later['access']), 200)
+        self.client.credentials()
+        self.assertEqual(self.client.post('/api/auth/refresh/', {'refresh': later['refresh']}).status_code, 200)
+
+    def test_the_cutoff_is_exact(self):
+        [row] = revocation.revoke_all(self.customer.pk)
+        revocations.add([row])
+        cutoff = row.created_at
+        before, after = ClaimsAccessToken.for_user(self.customer), ClaimsAccessToken.for_user(self.customer)
+        before.set_iat(at_time=cutoff - timedelta(microseconds=10))
+        after.set_iat(at_time=cutoff + timedelta(microseconds=10))
+        self.assertEqual((revocations.is_revoked(before.payload), revocations.is_revoked(after.payload)), (True, False))
+        # Elsewhere too, from the stored row
+        elsewhere = RevocationList()
+        elsewhere.sync()
+        self.assertEqual((elsewhere.is_revoked(before.payload), elsewhere.is_revoked(after.payload)), (True, False))
+
+    def test_checks_do_not_query_once_loaded(self):
+        token = self.login('customer')['access'].encode()
+        revocations.clear()
+        with self.assertNumQueries(1):
+            ClaimsJWTAuthentication().get_validated_token(token)
+        with self.assertNumQueries(0):
+            ClaimsJWTAuthentication().get_validated_token(token)
+
+    def test_only_admins_revoke_other_users_tokens(self):
+        customer = self.login('customer')['access']
+        response = self.post('/api/auth/revoke_all/', customer, {'user': self.admin.pk})
+        self.assertEqual(response.status_code, 403)
+        response = self.post('/api/auth/revoke_all/', self.login('admin')['access'], {'user': self.customer.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.status(customer), 401)
+
+    def test_other_processes_pick_up_revocations_on_sync(self):
+        token = ClaimsAccessToken.for_user(self.customer)
+        elsewhere = RevocationList()
+        elsewhere.sync()
+        self.assertFalse(elsewhere.is_revoked(token.payload))
+
+        TokenRevocation.objects.create(user=self.customer, jti=token['jti'], expires_at=timezone.now() + timedelta(days=1))
+        self.assertEqual(elsewhere.sync(), 1)
+        self.assertTrue(elsewhere.is_revoked(token.payload))
+
+    def test_benchmark(self):
+        out = io.StringIO()
+        call_command('bench_revocation', '--revocations', '50', '--checks', '100', '--queries', '5', '--json', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['revocations'], 50)
+        self.assertGreater(report['validate_and_check_us'], 0)
+        self.assertFalse(TokenRevocation.objects.exists())
+
+
+@override_settings(TOKEN_REVOCATION_SYNC_INTERVAL=0.01)
+class RevocationSyncThreadTests(TransactionTestCase):
+    def test_a_background_thread_reads_revocations_made_elsewhere(self):
+        customer = User.objects.create_user(username='customer', role='customer')
+        token = ClaimsAccessToken.for_user(customer)
+        elsewhere = RevocationList()
+        self.addCleanup(elsewhere.stop)
+        with self.assertNumQueries(1):
+            elsewhere.follow()
+        self.assertFalse(elsewhere.is_revoked(token.payload))
+
+        TokenRevocation.objects.create(user=customer, jti=token['jti'], expires_at=timezone.now() + timedelta(days=1))
+        deadline = timezone.now() + timedelta(seconds=5)
+        while not elsewhere.is_revoked(token.payload) and timezone.now() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(elsewhere.is_revoked(token.payload))
+
+
+class BulkImportExportTests(TestCase):
+    def setUp(self):
+        self.maker = User.objects.create_user(username='maker', password='pass', role='maker')
+        self.other = User.objects.create_user(username='other', password='pass', role='maker')
+        self.customer = User.objects.create_user(username='customer', password='pass', role='customer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.maker)
+
+    def upload(self, path, body, content_type='text/csv'):
+        return self.client.post(path, body, content_type=content_type)
+
+    def download(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_import_creates_rows_and_reports_bad_lines(self):
+        response = self.upload('/api/products/import/', (
+            'name,price,stock\n'
+            'Injera,2.50,10\n'
+            'Shiro,not a price,5\n'
+            ',3.00,1\n'
+            'Kitfo,7.25,\n'
+        ))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {key: response.data[key] for key in ('rows', 'created', 'updated', 'failed')},
+            {'rows': 4, 'created': 2, 'updated': 0, 'failed': 2},
+        )
+        self.assertEqual([error['line'] for error in response.data['errors']], [3, 4])
+        products = {product.name: product for product in Product.objects.filter(maker=self.maker)}
+        self.assertEqual(set(products), {'Injera', 'Kitfo'})
+        self.assertEqual((products['Injera'].price, products['Kitfo'].stock), (Decimal('2.50'), 0))
+
+    def test_export_then_import_updates_in_place(self):
+        product = Product.objects.create(maker=self.maker, name='Injera', price=Decimal('2.50'), stock=10)
+        theirs = Product.objects.create(maker=self.other, name='Theirs', price=Decimal('1.00'))
+        exported = self.download(f'/api/products/export/?maker={self.maker.pk}')
+        self.assertEqual(exported.splitlines()[0], ','.join(bulk_io.PRODUCTS.export_fields))
+
+        edited = exported.replace('Injera', 'Teff injera') + f'{theirs.pk},Stolen,,1.00,1,True,{self.maker.pk},,0,0\n'
+        response = self.upload('/api/products/import/', edited)
+        self.assertEqual((response.data['updated'], response.data['failed']), (1, 1))
+        self.assertEqual(response.data['errors'][0]['error'], f'Row {theirs.pk} is not yours')
+        product.refresh_from_db()
+        theirs.refresh_from_db()
+        self.assertEqual((product.name, product.stock, theirs.name), ('Teff injera', 10, 'Theirs'))
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_jsonl_import_keeps_columns_left_out(self):
+        self.client.force_authenticate(User.objects.create_user(username='supplier', role='supplier'))
+        item = Inventory.objects.create(owner=User.objects.get(username='supplier'), item_name='Teff', quantity=50)
+        response = self.upload('/api/inventory/import/', (
+            f'{{"id": {item.pk}, "quantity": 40}}\n'
+            '{"item_name": "Berbere", "quantity": 8}\n'
+            '[1, 2]\n'
+        ), content_type='application/x-ndjson')
+        self.assertEqual((response.data['created'], response.data['updated'], response.data['failed']), (1, 1, 1))
+        item.refresh_from_db()
+        self.assertEqual((item.item_name, item.quantity, item.low_stock_threshold), ('Teff', 40, 5))
+
+        Inventory.objects.create(owner=self.maker, item_name='Not mine')
+        rows = [json.loads(line) for line in self.download('/api/inventory/export/?as=jsonl').splitlines()]
+        self.assertEqual([row['item_name'] for row in rows], ['Teff', 'Berbere'])
+
+    def test_rejects_unusable_files_and_other_roles(self):
+        self.assertEqual(self.upload('/api/products/import/', 'name,colour\nInjera,red\n').status_code, 400)
+        self.assertEqual(self.upload('/api/products/import/', 'name\n', content_type='text/plain').status_code, 415)
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.upload('/api/products/import/', 'name,price\nInjera,1\n').status_code, 403)
+        self.assertFalse(Product.objects.exists())
+
+    def test_commands_round_trip(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        source = os.path.join(directory, 'products.csv')
+        with open(source, 'w') as output:
+            output.write('name,price\n' + ''.join(f'Dish {i},{i}.00\n' for i in range(1, 6)))
+        out = io.StringIO()
+        call_command('import_rows', 'products', source, '--owner', 'maker', '--chunk-size', '2', '--json', stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['created'], 5)
+
+        out = io.StringIO()
+        call_command('export_rows', 'products', '--owner', 'maker', '--format', 'jsonl', stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([row['price'] for row in rows], ['1.00', '2.00', '3.00', '4.00', '5.00'])
+
+
+class BulkImportExportBenchmarkTests(TransactionTestCase):
+    def test_benchmark(self):
+        out = io.StringIO()
+        call_command('bench_bulk_io', '--rows', '50', '--chunk-size', '20', '--list-rows', '10', '--json', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual((report['created'], report['updated'], report['failed']), (50, 50, 0))
+        self.assertFalse(User.objects.filter(username__startswith='bench_bulk_io').exists())
+        self.assertFalse(Product.objects.exists())
+
+
+# Sync notifications: a dispatcher thread writing alongside the workers would lock the shared test database
+@override_settings(ALLOWED_HOSTS=['localhost'], NOTIFICATION_DISPATCH_MODE='sync')
+class WorkflowBenchmarkTests(TransactionTestCase):
+    def test_drives_every_step_and_cleans_up(self):
+        out = io.StringIO()
+        call_command(
+            'bench_workflow', '--workflows', '3', '--concurrency', '1', '--makers', '2', '--products', '2',
+            '--customers', '5', '--orders', '20', '--fast-passwords', '--json', stdout=out,
+        )
+        report = json.loads(out.getvalue())
+
+        self.assertEqual(report['workflows_completed'], 3)
+        for name, endpoint in report['endpoints'].items():
+            self.assertEqual(sum(endpoint['statuses'].values()), 3, name)
+            self.assertEqual(set(endpoint['statuses']) - {'200', '201'}, set(), name)
+            self.assertLessEqual(endpoint['p50_ms'], endpoint['p99_ms'])
+            self.assertGreater(endpoint['queries_mean'], 0)
+        self.assertFalse(User.objects.filter(username__startswith='bench_flow').exists())
+        platform = rollups.get_rollup('platform')
+        self.assertEqual((platform.users, platform.orders), (0, 0))
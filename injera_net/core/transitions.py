@@ -0,0 +1,114 @@
+"""
+Declarative status transitions.
+
+Each stateful model lists its transitions in a StateMachine: a name, the
+statuses it may start from and the status it leads to. `apply` performs one
+as a compare-and-set
+
+    UPDATE ... SET status = <target>, <changes> WHERE id = <id> AND status = <current>
+
+touching only the status and the given columns, and returns whether it won.
+Of two concurrent requests moving the same row only one wins; the loser's
+UPDATE matches no row, so nothing is written twice and no side effect runs
+twice. Callers run their side effects only when `apply` returns True.
+
+`apply_many` moves a batch of locked rows with one UPDATE guarded on the
+transition's sources, for the bulk actions.
+
+Every transition that wins sends the `transitioned` signal, once per moved
+row, the hook for anything that must follow status changes (the rollups use
+it in place of post_save, which a queryset UPDATE does not send).
+"""
+from typing import NamedTuple
+
+from django.db import transaction
+from django.dispatch import Signal
+
+# sender: the model; kwargs: instance, name, source, target, update_fields,
+# batch (the tuple of rows moved by the same apply_many UPDATE, else None)
+transitioned = Signal()
+
+
+class Transition(NamedTuple):
+    sources: tuple
+    target: str
+
+
+class StateMachine:
+    def __init__(self, field='status', **transitions):
+        self.field = field
+        self.transitions = {
+            name: Transition(tuple(sources), target) for name, (sources, target) in transitions.items()
+        }
+
+    def __getitem__(self, name):
+        return self.transitions[name]
+
+    def allows(self, instance, name):
+        return getattr(instance, self.field) in self.transitions[name].sources
+
+    def apply(self, instance, name, **changes):
+        """
+        Move `instance` along transition `name`, also setting the columns in
+        `changes`, if its row still has the status the instance holds. Returns
+        whether this call made the change; on False nothing was written.
+        """
+        transition = self.transitions[name]
+        source = getattr(instance, self.field)
+        if source not in transition.sources:
+            return False
+        model = type(instance)
+        values = {self.field: transition.target, **changes}
+        with transaction.atomic():
+            if not model._base_manager.filter(pk=instance.pk, **{self.field: source}).update(**values):
+                return False
+            for column, value in values.items():
+                setattr(instance, column, value)
+            transitioned.send(
+                sender=model, instance=instance, name=name, source=source, target=transition.target,
+                update_fields=frozenset(values), batch=None,
+            )
+        return True
+
+    def apply_many(self, instances, name, **changes):
+        """
+        Move those of `instances` whose status allows transition `name` with
+        one UPDATE guarded on its sources, also setting the columns in
+        `changes`, and return the moved ones. Load the instances with
+        select_for_update in the surrounding transaction, or concurrent
+        requests may take some of them first.
+        """
+        transition = self.transitions[name]
+        eligible = [instance for instance in instances if self.allows(instance, name)]
+        if not eligible:
+            return []
+        model = type(eligible[0])
+        values = {self.field: transition.target, **changes}
+        pks = [instance.pk for instance in eligible]
+        with transaction.atomic():
+            moved = model._base_manager.filter(pk__in=pks, **{f'{self.field}__in': transition.sources}).update(**values)
+            if moved != len(eligible):
+                # A concurrent request moved some of them after the read; only possible on
+                # backends that neither lock the rows nor serialize writers like SQLite
+                ours = set(model._base_manager.filter(pk__in=pks, **{self.field: transition.target}).values_list('pk', flat=True))
+                eligible = [instance for instance in eligible if instance.pk in ours]
+            sources = [getattr(instance, self.field) for instance in eligible]
+            for instance in eligible:
+                for column, value in values.items():
+                    setattr(instance, column, value)
+            batch = tuple(eligible)
+            for instance, source in zip(batch, sources):
+                transitioned.send(
+                    sender=model, instance=instance, name=name, source=source, target=transition.target,
+                    update_fields=frozenset(values), batch=batch,
+                )
+        return eligible
+
+
+class TransitionRefused(Exception):
+    """Raised inside a transaction to roll it back when a transition it relies on lost"""
+
+    def __init__(self, instance, name):
+        super().__init__(f"{type(instance).__name__} #{instance.pk} could not {name}")
+        self.instance = instance
+        self.name = name
@@ -1,7 +1,8 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import RegisterView, UserViewSet, ProductViewSet, OrderViewSet, PaymentViewSet, DeliveryViewSet, InventoryViewSet, NotificationViewSet, ReviewViewSet, AnalyticsViewSet
+from .views import RegisterView, LogoutView, RevokeAllTokensView, UserViewSet, ProductViewSet, OrderViewSet, PaymentViewSet, DeliveryViewSet, InventoryViewSet, NotificationViewSet, ReviewViewSet, AnalyticsViewSet, MetricsView
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from . import async_views
 
 router = DefaultRouter()
 router.register('users', UserViewSet, basename='user')
@@ -18,11 +19,25 @@ urlpatterns = [
     path('auth/register/', RegisterView.as_view(), name='register'),
     path('auth/login/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('auth/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('auth/logout/', LogoutView.as_view(), name='logout'),
+    path('auth/revoke_all/', RevokeAllTokensView.as_view(), name='revoke-all'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('orders/<int:pk>/accept/', OrderViewSet.as_view({'post': 'accept'}), name='order-accept'),
     path('orders/<int:pk>/mark_paid/', OrderViewSet.as_view({'post': 'mark_paid'}), name='order-mark-paid'),
     path('orders/<int:pk>/assign_delivery/', OrderViewSet.as_view({'post': 'assign_delivery'}), name='order-assign-delivery'),
     path('orders/<int:pk>/mark_delivered/', OrderViewSet.as_view({'post': 'mark_delivered'}), name='order-mark-delivered'),
     path('orders/<int:pk>/cancel/', OrderViewSet.as_view({'post': 'cancel'}), name='order-cancel'),
 
+    # Async GET handlers in front of the viewsets' hottest read endpoints
+    path('products/', async_views.product_list),
+    path('products/<int:pk>/', async_views.product_detail),
+    path('notifications/', async_views.notification_list),
+    path('notifications/unread/', async_views.notification_unread),
+    path('deliveries/available_partners/', async_views.available_partners),
+    path('analytics/dashboard_stats/', async_views.dashboard_stats),
+    path('analytics/maker_analytics/', async_views.maker_analytics),
+    path('analytics/customer_analytics/', async_views.customer_analytics),
+    path('analytics/delivery_analytics/', async_views.delivery_analytics),
+
     path('', include(router.urls)),
 ]
\ No newline at end of file
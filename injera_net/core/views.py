@@ -1,51 +1,246 @@
 from rest_framework import generics, viewsets, permissions
 from rest_framework.decorators import action  
 from rest_framework.response import Response  
+from rest_framework.views import APIView
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from django.conf import settings
+from django.http import HttpResponse
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from datetime import timedelta
-from django.db.models import Count, Sum, Avg
+from decimal import Decimal
+from django.db import transaction
 
-from .models import Product, Order, Payment, Delivery, Inventory, Notification, Review
+from .models import Product, Order, Payment, Delivery, Inventory, Notification, Review, OutOfStock
 from .serializers import UserSerializer, RegisterSerializer, ProductSerializer, OrderSerializer, PaymentSerializer, DeliverySerializer, InventorySerializer, NotificationSerializer, ReviewSerializer
+from .query_planning import QueryPlanMixin, plan_queryset
+from . import rollups
+from .geo import locator
+from .dispatch import BatchDispatcher
+from .checkout import place_orders, checkout_cart, CheckoutError
+from . import bulk_actions, bulk_io, catalog_cache, metrics
+from .bulk_io import BulkRowsMixin
+from .catalog_cache import CachedCatalogMixin
+from .pagination import KeysetCursorPagination, SearchPagination
+from . import search
+from . import revocation
 
 User = get_user_model()
 
+DATE_RANGE_ERROR = 'since and until must be YYYY-MM-DD dates, since not after until'
+
+# Best rated first; served by the product_rating_idx index
+RATING_ORDERING = ('-rating_average', '-rating_count', '-id')
+
+
+def product_ordering(request):
+    """The catalog's cursor ordering for `?sort=`: 'rating' or the default, newest first"""
+    if request.query_params.get('sort') == 'rating':
+        return RATING_ORDERING
+    return KeysetCursorPagination.ordering
+
 # Register new users
 class RegisterView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = RegisterSerializer
     permission_classes = [permissions.AllowAny]
 
+# Revoke the request's login session and, if given, the `refresh` token
+class LogoutView(APIView):
+    def post(self, request):
+        tokens = [request.auth] if request.auth is not None else []
+        if request.data.get('refresh'):
+            try:
+                refresh = RefreshToken(request.data['refresh'])
+            except TokenError:
+                return Response({'error': 'Invalid refresh token'}, status=400)
+            if User._meta.pk.to_python(refresh.get(jwt_settings.USER_ID_CLAIM)) != request.user.pk:
+                return Response({'error': 'Not authorized'}, status=403)
+            tokens.append(refresh)
+        revocation.revoke_tokens(request.user.pk, tokens)
+        return Response({'status': 'Logged out'})
+
+# Revoke every token issued so far to the user, or to the given `user` (Admin only)
+class RevokeAllTokensView(APIView):
+    def post(self, request):
+        try:
+            user_id = int(request.data.get('user', request.user.pk))
+        except (TypeError, ValueError):
+            return Response({'error': 'user must be a user id'}, status=400)
+        if user_id != request.user.pk:
+            if request.user.role != 'admin':
+                return Response({'error': 'Admin access required'}, status=403)
+            if not User.objects.filter(pk=user_id).exists():
+                return Response({'error': 'User not found'}, status=404)
+        revocation.revoke_all(user_id)
+        return Response({'status': 'All tokens revoked'})
+
+def bulk_transition(request, transition):
+    """Run a core.bulk_actions transition on the request's `ids` and report the result per id"""
+    try:
+        ids = bulk_actions.parse_ids(request.data.get('ids'))
+    except ValueError as exc:
+        return Response({'error': str(exc)}, status=400)
+    results = transition(request.user, ids)
+    return Response({'results': [{'id': pk, 'result': result} for pk, result in results.items()]})
+
+def transition_refused(instance):
+    """409 for a status action the row's current status (re-read, it may have just moved) doesn't allow"""
+    status = type(instance)._base_manager.filter(pk=instance.pk).values_list('status', flat=True).first()
+    return Response({'error': 'Invalid status for this action', 'status': status}, status=409)
+
+# Request metrics of this process in the Prometheus text format (Admin only)
+class MetricsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(metrics.registry.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 # List all users (Admin only)
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAdminUser]
+    cursor_ordering = ('-date_joined', '-id')
 
 # CRUD for Products
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(CachedCatalogMixin, BulkRowsMixin, QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    bulk_table = bulk_io.PRODUCTS
+    import_roles = ('maker',)
+
+    @property
+    def cursor_ordering(self):
+        if self.action == 'top_rated':
+            return RATING_ORDERING
+        return product_ordering(self.request)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'top_rated':
+            queryset = queryset.filter(rating_count__gte=getattr(settings, 'TOP_RATED_MIN_REVIEWS', 3))
+        return queryset
+
+    @action(detail=False, methods=['get'])
+    def top_rated(self, request):
+        """Products with at least TOP_RATED_MIN_REVIEWS reviews, best average rating first"""
+        return self.list(request)
 
-class OrderViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Ranked full-text search: ?q=, optional available/min_price/max_price/maker filters, page/page_size"""
+        query = request.query_params.get('q', '')
+        if not search.terms(query):
+            return Response({'error': 'q must contain at least one word'}, status=400)
+        try:
+            filters = search.parse_filters(request.query_params)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=400)
+        return self._cached_list(request, lambda: self._search(request, query, filters))
+
+    def _search(self, request, query, filters):
+        matches = search.get_backend().search(self.get_queryset(), query)
+        paginator = SearchPagination()
+        page = paginator.paginate_queryset(matches.filter(filters), request, view=self)
+        # Facets count all matches of the query, so clients can show what each filter would leave
+        return paginator.get_paginated_response(self.get_serializer(page, many=True).data, search.facets(matches))
+
+    def export_queryset(self, request):
+        """Every product, like the list; ?maker= narrows it to one maker's"""
+        queryset = super().export_queryset(request)
+        if request.query_params.get('maker', '').isdigit():
+            queryset = queryset.filter(maker_id=request.query_params['maker'])
+        return queryset
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAdminUser])
+    def cache_stats(self, request):
+        """Catalog cache hit/miss counters of this process"""
+        return Response(catalog_cache.stats())
+
+class OrderViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def create(self, request, *args, **kwargs):
+        try:
+            return super().create(request, *args, **kwargs)
+        except OutOfStock as exc:
+            return Response({'error': str(exc)}, status=400)
+
+    def update(self, request, *args, **kwargs):
+        # A plain write would skip the stock, payment and notification side
+        # effects of the transition; those go through the order's actions
+        if 'status' in request.data:
+            return Response({'error': 'status changes go through the order actions (accept, cancel, ...)'}, status=400)
+        try:
+            return super().update(request, *args, **kwargs)
+        except OutOfStock as exc:
+            return Response({'error': str(exc)}, status=400)
+
     def perform_create(self, serializer):
-        order = serializer.save(customer=self.request.user)
-        # Auto-create payment record
-        order.create_payment_record()
-        
+        with transaction.atomic():
+            Product.reserve_stock(serializer.validated_data['product'].id, serializer.validated_data.get('quantity', 1))
+            order = serializer.save(customer=self.request.user)
+            # Auto-create payment record
+            order.create_payment_record()
+
+    def perform_update(self, serializer):
+        order = serializer.instance
+        reserved = (order.product_id, order.quantity)
+        with transaction.atomic():
+            order = serializer.save()
+            # Cart orders are priced and reserved per line at checkout
+            if order.status != 'cancelled' and not order.line_count and (order.product_id, order.quantity) != reserved:
+                Product.release_stock(*reserved)
+                Product.reserve_stock(order.product_id, order.quantity)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Place several orders at once, all or nothing"""
+        try:
+            items = [(int(item['product']), int(item.get('quantity', 1))) for item in request.data.get('items', [])]
+        except (KeyError, TypeError, ValueError):
+            return Response({'error': 'items must be a list of {"product": id, "quantity": n}'}, status=400)
+        try:
+            orders = place_orders(request.user, items)
+        except (OutOfStock, CheckoutError) as exc:
+            return Response({'error': str(exc)}, status=400)
+        return Response(OrderSerializer(orders, many=True).data, status=201)
+
+    @action(detail=False, methods=['post'])
+    def checkout(self, request):
+        """Check out a whole cart: one order, payment and notification per maker"""
+        try:
+            items = [
+                (
+                    int(item['product']),
+                    int(item.get('quantity', 1)),
+                    Decimal(str(item['price'])) if item.get('price') is not None else None,
+                )
+                for item in request.data.get('items', [])
+            ]
+        except (KeyError, TypeError, ValueError, ArithmeticError):
+            return Response({'error': 'items must be a list of {"product": id, "quantity": n, "price": "x.xx"}'}, status=400)
+        try:
+            orders = checkout_cart(request.user, items)
+        except (OutOfStock, CheckoutError) as exc:
+            return Response({'error': str(exc)}, status=400)
+        orders = plan_queryset(Order.objects.filter(pk__in=[order.pk for order in orders]), OrderSerializer)
+        return Response(OrderSerializer(orders.order_by('id'), many=True).data, status=201)
+
     # ADD THESE CUSTOM ACTIONS:
     @action(detail=True, methods=['post'])
     def accept(self, request, pk=None):
         """Accept an order (maker only)"""
         order = self.get_object()
         if request.user.role == 'maker' and order.product.maker == request.user:
-            order.accept_order()
+            if not order.accept_order():
+                return transition_refused(order)
             return Response({'status': 'Order accepted'})
         return Response({'error': 'Not authorized'}, status=403)
 
@@ -54,7 +249,8 @@ class OrderViewSet(viewsets.ModelViewSet):
         """Mark order as paid"""
         order = self.get_object()
         if request.user == order.customer:
-            order.mark_paid()
+            if not order.mark_paid():
+                return transition_refused(order)
             return Response({'status': 'Order marked as paid'})
         return Response({'error': 'Not authorized'}, status=403)
 
@@ -67,7 +263,8 @@ class OrderViewSet(viewsets.ModelViewSet):
         if request.user.role in ['maker', 'admin']:
             try:
                 delivery_partner = User.objects.get(id=delivery_partner_id, role='delivery_partner')
-                order.assign_for_delivery(delivery_partner)
+                if not order.assign_for_delivery(delivery_partner):
+                    return transition_refused(order)
                 return Response({'status': 'Delivery partner assigned'})
             except User.DoesNotExist:
                 return Response({'error': 'Invalid delivery partner'}, status=400)
@@ -80,7 +277,8 @@ class OrderViewSet(viewsets.ModelViewSet):
         if (request.user.role == 'delivery_partner' and 
             hasattr(order, 'delivery') and 
             order.delivery.delivery_partner == request.user):
-            order.mark_delivered()
+            if not order.mark_delivered():
+                return transition_refused(order)
             return Response({'status': 'Order delivered'})
         return Response({'error': 'Not authorized'}, status=403)
 
@@ -88,12 +286,25 @@ class OrderViewSet(viewsets.ModelViewSet):
     def cancel(self, request, pk=None):
         """Cancel order"""
         order = self.get_object()
-        if request.user in [order.customer, order.maker]:
-            order.cancel_order()
+        if request.user in [order.customer, order.product.maker]:
+            if not order.cancel_order():
+                return transition_refused(order)
             return Response({'status': 'Order cancelled'})
         return Response({'error': 'Not authorized'}, status=403)
 
-class PaymentViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['post'])
+    def bulk_accept(self, request):
+        """Accept several orders at once (maker only): {"ids": [1, 2, ...]}"""
+        if request.user.role != 'maker':
+            return Response({'error': 'Not authorized'}, status=403)
+        return bulk_transition(request, bulk_actions.accept_orders)
+
+    @action(detail=False, methods=['post'])
+    def bulk_cancel(self, request):
+        """Cancel several orders at once: {"ids": [1, 2, ...]}"""
+        return bulk_transition(request, bulk_actions.cancel_orders)
+
+class PaymentViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -112,7 +323,8 @@ class PaymentViewSet(viewsets.ModelViewSet):
     def mark_failed(self, request, pk=None):
         payment = self.get_object()
         if request.user.role in ['admin', 'maker']:
-            payment.mark_failed()
+            if not payment.mark_failed():
+                return transition_refused(payment)
             return Response({'status': 'Payment marked as failed'})
         return Response({'error': 'Not authorized'}, status=403)
 
@@ -120,14 +332,16 @@ class PaymentViewSet(viewsets.ModelViewSet):
     def refund(self, request, pk=None):
         payment = self.get_object()
         if request.user.role in ['admin', 'maker']:
-            payment.process_refund()
+            if not payment.process_refund():
+                return transition_refused(payment)
             return Response({'status': 'Refund processed'})
         return Response({'error': 'Not authorized'}, status=403)
 
-class DeliveryViewSet(viewsets.ModelViewSet):
+class DeliveryViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Delivery.objects.all()
     serializer_class = DeliverySerializer
     permission_classes = [permissions.IsAuthenticated]
+    cursor_ordering = ('-assigned_at', '-id')
 
     @action(detail=True, methods=['post'])
     def assign_partner(self, request, pk=None):
@@ -136,7 +350,8 @@ class DeliveryViewSet(viewsets.ModelViewSet):
         if request.user.role in ['admin', 'maker']:
             try:
                 partner = User.objects.get(id=partner_id, role='delivery_partner')
-                delivery.assign_delivery_partner(partner)
+                if not delivery.assign_delivery_partner(partner):
+                    return transition_refused(delivery)
                 return Response({'status': 'Delivery partner assigned'})
             except User.DoesNotExist:
                 return Response({'error': 'Invalid delivery partner'}, status=400)
@@ -147,7 +362,8 @@ class DeliveryViewSet(viewsets.ModelViewSet):
         delivery = self.get_object()
         if (request.user.role == 'delivery_partner' and 
             delivery.delivery_partner == request.user):
-            delivery.mark_in_transit()
+            if not delivery.mark_in_transit():
+                return transition_refused(delivery)
             return Response({'status': 'Delivery in transit'})
         return Response({'error': 'Not authorized'}, status=403)
 
@@ -156,10 +372,25 @@ class DeliveryViewSet(viewsets.ModelViewSet):
         delivery = self.get_object()
         if (request.user.role == 'delivery_partner' and 
             delivery.delivery_partner == request.user):
-            delivery.mark_completed()
+            if not delivery.mark_completed():
+                return transition_refused(delivery)
             return Response({'status': 'Delivery completed'})
         return Response({'error': 'Not authorized'}, status=403)
 
+    @action(detail=False, methods=['post'])
+    def bulk_mark_in_transit(self, request):
+        """Start several deliveries at once (delivery partner only): {"ids": [1, 2, ...]}"""
+        if request.user.role != 'delivery_partner':
+            return Response({'error': 'Not authorized'}, status=403)
+        return bulk_transition(request, bulk_actions.mark_in_transit)
+
+    @action(detail=False, methods=['post'])
+    def bulk_mark_completed(self, request):
+        """Complete several deliveries at once (delivery partner only): {"ids": [1, 2, ...]}"""
+        if request.user.role != 'delivery_partner':
+            return Response({'error': 'Not authorized'}, status=403)
+        return bulk_transition(request, bulk_actions.mark_completed)
+
     @action(detail=False, methods=['get'])
     def available_partners(self, request):
         if request.user.role in ['admin', 'maker']:
@@ -171,10 +402,54 @@ class DeliveryViewSet(viewsets.ModelViewSet):
             return Response(serializer.data)
         return Response({'error': 'Not authorized'}, status=403)
 
+    @action(detail=False, methods=['get'])
+    def nearest_partners(self, request):
+        """Closest available delivery partners to ?lat=&lon= (defaults to the caller's location)"""
+        if request.user.role not in ['admin', 'maker']:
+            return Response({'error': 'Not authorized'}, status=403)
+        try:
+            lat = float(request.query_params.get('lat', request.user.latitude))
+            lon = float(request.query_params.get('lon', request.user.longitude))
+            limit = min(int(request.query_params.get('limit', 5)), 50)
+        except (TypeError, ValueError):
+            return Response({'error': 'lat and lon are required'}, status=400)
+        nearest = locator.nearest(lat, lon, k=limit)
+        partners = User.objects.in_bulk([partner_id for _, partner_id in nearest])
+        return Response([
+            {
+                'id': partner_id,
+                'username': partners[partner_id].username,
+                'latitude': partners[partner_id].latitude,
+                'longitude': partners[partner_id].longitude,
+                'distance_km': round(distance, 3),
+            }
+            for distance, partner_id in nearest if partner_id in partners
+        ])
+
+    @action(detail=False, methods=['post'])
+    def update_location(self, request):
+        """Delivery partners report their position and, optionally, availability"""
+        if request.user.role != 'delivery_partner':
+            return Response({'error': 'Not authorized'}, status=403)
+        try:
+            request.user.latitude = float(request.data['latitude'])
+            request.user.longitude = float(request.data['longitude'])
+        except (KeyError, TypeError, ValueError):
+            return Response({'error': 'latitude and longitude are required'}, status=400)
+        update_fields = ['latitude', 'longitude']
+        if 'is_available' in request.data:
+            request.user.is_available = str(request.data['is_available']).lower() in ['true', '1']
+            update_fields.append('is_available')
+        request.user.save(update_fields=update_fields)
+        return Response({'status': 'Location updated'})
+
     @action(detail=False, methods=['post'])
     def auto_assign(self, request):
         order_id = request.data.get('order_id')
         if request.user.role in ['admin', 'maker']:
+            if request.data.get('batch'):
+                # Assign every waiting paid order at once, minimising total distance
+                return Response(BatchDispatcher().dispatch())
             try:
                 order = Order.objects.get(id=order_id)
                 delivery = Delivery.assign_optimal_delivery_partner(order)
@@ -190,18 +465,29 @@ class DeliveryViewSet(viewsets.ModelViewSet):
                 return Response({'error': 'Order not found'}, status=404)
         return Response({'error': 'Not authorized'}, status=403)
 
-class InventoryViewSet(viewsets.ModelViewSet):
+class InventoryViewSet(BulkRowsMixin, QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Inventory.objects.all()
     serializer_class = InventorySerializer
     permission_classes = [permissions.IsAuthenticated]
+    # updated_at changes on every save, so page on the immutable primary key
+    cursor_ordering = ('-id',)
+    bulk_table = bulk_io.INVENTORY
+    import_roles = ('maker', 'supplier')
+
+    def export_queryset(self, request):
+        """The caller's own items; everyone's for admins"""
+        queryset = super().export_queryset(request)
+        if request.user.role != 'admin':
+            queryset = queryset.filter(owner=request.user)
+        return queryset
 
-class NotificationViewSet(viewsets.ModelViewSet):
+class NotificationViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return self.queryset.filter(user=self.request.user)
+        return super().get_queryset().filter(user=self.request.user)
 
     @action(detail=True, methods=['post'])
     def mark_read(self, request, pk=None):
@@ -213,16 +499,16 @@ class NotificationViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['post'])
     def mark_all_read(self, request):
-        notifications = Notification.objects.filter(user=request.user, is_read=False)
-        notifications.update(is_read=True)
-        return Response({'status': f'Marked {notifications.count()} notifications as read'})
+        marked = Notification.mark_all_read(request.user.id)
+        return Response({'status': f'Marked {marked} notifications as read'})
 
     @action(detail=False, methods=['get'])
     def unread(self, request):
-        unread_count = Notification.objects.filter(user=request.user, is_read=False).count()
+        # Denormalized on the user row by Notification and core.notifications
+        unread_count = User.objects.values_list('unread_notifications', flat=True).get(pk=request.user.pk)
         return Response({'unread_count': unread_count})
 
-class ReviewViewSet(viewsets.ModelViewSet):
+class ReviewViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -230,45 +516,49 @@ class ReviewViewSet(viewsets.ModelViewSet):
 class AnalyticsViewSet(viewsets.ViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
+    # Totals come from the pre-aggregated rollups maintained by core.rollups;
+    # ?since=&until= (inclusive dates) sum the daily buckets instead of all time
     @action(detail=False, methods=['get'])
     def dashboard_stats(self, request):
         if request.user.role != 'admin':
             return Response({'error': 'Admin access required'}, status=403)
-        total_users = User.objects.count()
-        total_orders = Order.objects.count()
-        total_revenue = Payment.objects.filter(status='paid').aggregate(Sum('amount'))['amount__sum'] or 0
-        pending_orders = Order.objects.filter(status='pending').count()
+        try:
+            since, until = rollups.parse_day_range(request.query_params.get('since'), request.query_params.get('until'))
+        except ValueError:
+            return Response({'error': DATE_RANGE_ERROR}, status=400)
+        platform = rollups.totals('platform', since=since, until=until)
         return Response({
-            'total_users': total_users,
-            'total_orders': total_orders,
-            'total_revenue': float(total_revenue),
-            'pending_orders': pending_orders
+            'total_users': platform.users,
+            'total_orders': platform.orders,
+            'total_revenue': float(platform.paid_revenue),
+            'pending_orders': platform.pending_orders
         })
 
     @action(detail=False, methods=['get'])
     def maker_analytics(self, request):
         if request.user.role != 'maker':
            return Response({'error': 'Maker access required'}, status=403)
-        total_sales = Order.objects.filter(product__maker=request.user, status='delivered').count()
-        total_earnings = Order.objects.filter(product__maker=request.user, status='delivered').aggregate(Sum('total_price'))['total_price__sum'] or 0
-        top_products = Order.objects.filter(product__maker=request.user).values('product__name').annotate(total_sold=Count('id'), total_revenue=Sum('total_price')).order_by('-total_sold')[:5]
+        try:
+            since, until = rollups.parse_day_range(request.query_params.get('since'), request.query_params.get('until'))
+        except ValueError:
+            return Response({'error': DATE_RANGE_ERROR}, status=400)
+        maker, top_products = rollups.maker_summary(request.user.id, since, until)
         return Response({
-            'total_sales': total_sales,
-            'total_earnings': float(total_earnings),
-            'top_products': list(top_products)
+            'total_sales': maker.delivered_orders,
+            'total_earnings': float(maker.delivered_revenue),
+            'top_products': top_products
         })
 
     @action(detail=False, methods=['get'])
     def customer_analytics(self, request):
         if request.user.role != 'customer':
             return Response({'error': 'Customer access required'}, status=403)
-        total_orders = Order.objects.filter(customer=request.user).count()
-        total_spent = Order.objects.filter(customer=request.user, status='delivered').aggregate(Sum('total_price'))['total_price__sum'] or 0
-        recent_orders = Order.objects.filter(customer=request.user).order_by('-created_at')[:5]
+        customer = rollups.get_rollup('customer', request.user.id)
+        recent_orders = plan_queryset(Order.objects.filter(customer=request.user), OrderSerializer).order_by('-created_at')[:5]
         recent_orders_data = OrderSerializer(recent_orders, many=True).data
         return Response({
-            'total_orders': total_orders,
-            'total_spent': float(total_spent),
+            'total_orders': customer.orders,
+            'total_spent': float(customer.delivered_revenue),
             'recent_orders': recent_orders_data
         })
 
@@ -276,13 +566,14 @@ class AnalyticsViewSet(viewsets.ViewSet):
     def delivery_analytics(self, request):
         if request.user.role != 'delivery_partner':
             return Response({'error': 'Delivery partner access required'}, status=403)
-        total_deliveries = Delivery.objects.filter(delivery_partner=request.user).count()
-        completed_deliveries = Delivery.objects.filter(delivery_partner=request.user, status='completed').count()
+        partner = rollups.get_rollup('delivery_partner', request.user.id)
+        total_deliveries = partner.deliveries
+        completed_deliveries = partner.completed_deliveries
         today = timezone.now().date()
-        weekly_deliveries = Delivery.objects.filter(delivery_partner=request.user, assigned_at__date__gte=today - timedelta(days=7)).count()
+        weekly_deliveries = rollups.sum_days('delivery_partner', request.user.id, today - timedelta(days=7), 'deliveries')
         return Response({
             'total_deliveries': total_deliveries,
             'completed_deliveries': completed_deliveries,
             'weekly_deliveries': weekly_deliveries,
             'completion_rate': round((completed_deliveries / total_deliveries * 100) if total_deliveries > 0 else 0, 2)
-        })
\ No newline at end of file
+        })
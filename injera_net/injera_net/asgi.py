@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'injera_net.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up: serves the notification stream, the rest goes to Django
+from core.streams import NotificationStreamRouter  # noqa: E402
+
+application = NotificationStreamRouter(django_application)
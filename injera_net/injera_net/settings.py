@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -127,14 +128,72 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
 REST_FRAMEWORK = {
+    # Bearer tokens only: the API has no session (or CSRF) to check. See
+    # core.authentication for how the user is resolved without a query
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.SessionAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.authentication.ClaimsJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
-    )
+    ),
+    'DEFAULT_PAGINATION_CLASS': 'core.pagination.KeysetCursorPagination',
+    'PAGE_SIZE': 50,
+}
+
+# Serve the hot GET endpoints with the async handlers in core.async_views
+# (under ASGI); False routes them to the sync viewsets
+ASYNC_READ_VIEWS = True
+
+# Per-view latency, query and serialization histograms, served at /api/metrics/
+REQUEST_METRICS = True
+# Log requests slower than this (milliseconds) or running more queries than
+# this, with their SQL, to the core.metrics logger; None disables either check
+REQUEST_METRICS_SLOW_MS = None
+REQUEST_METRICS_MAX_QUERIES = None
+
+# Upper bound for the `?page_size=` query parameter on list endpoints
+PAGINATION_MAX_PAGE_SIZE = 200
+
+# Notifications are queued and written in batches by a background thread
+# ('async'), or inline with the request ('sync')
+NOTIFICATION_DISPATCH_MODE = 'async'
+NOTIFICATION_BATCH_SIZE = 500
+NOTIFICATION_FLUSH_INTERVAL = 0.5  # seconds
+NOTIFICATION_WRITE_RETRIES = 3  # retries of a failed batch write before it is dropped
+NOTIFICATION_STREAM_HEARTBEAT = 15  # seconds between keepalives on idle notification streams
+# Read notifications older than this are archived and deleted by purge_notifications
+NOTIFICATION_RETENTION_DAYS = 30
+NOTIFICATION_ARCHIVE_DIR = BASE_DIR / 'archive' / 'notifications'  # None to delete without archiving
+
+# Delivery partner assignment: 'first_available' or 'nearest' (closest to the maker)
+DELIVERY_ASSIGNMENT_STRATEGY = 'nearest'
+# 'immediate' assigns a partner when an order is paid; 'batch' leaves paid orders
+# to the dispatch_deliveries command, which assigns them together
+DELIVERY_DISPATCH_MODE = 'immediate'
+GEO_INDEX_TTL = 30  # seconds before the partner location index reloads
+GEO_INDEX_CELL_SIZE = 0.01  # degrees, roughly 1 km
+
+# Rows each platform analytics bucket is split into, so concurrent order and
+# payment writes rarely wait on the same row lock; rebuild_rollups after changing
+ROLLUP_PLATFORM_SHARDS = 8
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'injera-net',
+    },
 }
+# Product list/detail response cache; point the alias at a shared backend
+# (e.g. django.core.cache.backends.redis.RedisCache) when running several processes
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_TIMEOUT = 300  # seconds
+
+# Reviews a product needs to be listed by /api/products/top_rated/
+TOP_RATED_MIN_REVIEWS = 3
+
+# Product search: 'fts5' (SQLite full-text index, ranked and typo tolerant) or
+# 'database' (plain LIKE filters); 'fts5' falls back to it on databases without FTS5
+PRODUCT_SEARCH_BACKEND = 'fts5'
 
 
 AUTH_USER_MODEL = 'core.User'
@@ -145,4 +204,19 @@ from datetime import timedelta
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(days=365),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=365),
+    # Issue tokens carrying the username, role and is_staff claims
+    "TOKEN_OBTAIN_SERIALIZER": "core.authentication.ClaimsTokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "core.authentication.ClaimsTokenRefreshSerializer",
 }
+
+# Role claims of a token are trusted this long after it was issued (seconds);
+# afterwards its user is read through a per-process cache of user rows kept
+# JWT_USER_CACHE_TTL seconds, so role changes and deactivation take effect
+# within JWT_CLAIMS_MAX_AGE + JWT_USER_CACHE_TTL
+JWT_CLAIMS_MAX_AGE = 300
+JWT_USER_CACHE_SIZE = 10000  # users; 0 disables the cache
+JWT_USER_CACHE_TTL = 60
+
+# A background thread in each process re-reads the token revocations table
+# this often (seconds); revocations made elsewhere take effect within this delay
+TOKEN_REVOCATION_SYNC_INTERVAL = 5